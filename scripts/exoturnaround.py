@@ -6,13 +6,7 @@ import stglib
 
 args = stglib.cmd.exoturnaround_parser().parse_args()
 
-try:
-    ds = stglib.exo.read_exo(args.basefile + ".csv", skiprows=args.skiprows)
-except UnicodeDecodeError:
-    # try reading as Mac OS Western for old versions of Mac Excel
-    ds = stglib.exo.read_exo(
-        args.basefile + ".csv", skiprows=args.skiprows, encoding="mac-roman"
-    )
+ds = stglib.exo.read_exo(args.basefile + ".csv", skiprows=args.skiprows)
 
 plt.figure(figsize=(8.5, 11))
 plt.subplot(4, 1, 1)
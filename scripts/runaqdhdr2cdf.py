@@ -16,4 +16,7 @@ with open(args.config) as f:
 for k in config:
     metadata[k] = config[k]
 
+if args.store_format is not None:
+    metadata["store_format"] = args.store_format
+
 RAW = stglib.aqd.hdr2cdf.prf_to_cdf(metadata)
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+import sys
+
+import stglib
+
+args = stglib.cmd.batch_parser().parse_args()
+
+summary = stglib.batch.run_batch(
+    args.manifest,
+    logdir=args.logdir,
+    max_workers=args.jobs,
+    profile=vars(args),
+    perf_report=args.perf_report,
+    trace_memory=args.trace_memory,
+)
+
+if any(r["status"] != "ok" for r in summary):
+    sys.exit(1)
@@ -4,4 +4,4 @@ import stglib
 
 args = stglib.cmd.ecocdf2nc_parser().parse_args()
 
-ds = stglib.eco.cdf_to_nc(args.cdfname)
+ds = stglib.eco.cdf_to_nc(args.cdfname, profile=vars(args))
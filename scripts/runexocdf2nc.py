@@ -5,6 +5,6 @@ import stglib
 args = stglib.cmd.exocdf2nc_parser().parse_args()
 
 if args.atmpres:
-    ds = stglib.exo.cdf_to_nc(args.cdfname, atmpres=args.atmpres)
+    ds = stglib.exo.cdf_to_nc(args.cdfname, atmpres=args.atmpres, profile=vars(args))
 else:
-    ds = stglib.exo.cdf_to_nc(args.cdfname)
+    ds = stglib.exo.cdf_to_nc(args.cdfname, profile=vars(args))
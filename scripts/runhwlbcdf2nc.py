@@ -4,4 +4,4 @@ import stglib
 
 args = stglib.cmd.hwlbcdf2nc_parser().parse_args()
 
-ds = stglib.hobo.cdf_to_nc(args.cdfname)
+ds = stglib.hobo.cdf_to_nc(args.cdfname, profile=vars(args))
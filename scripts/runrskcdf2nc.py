@@ -5,6 +5,8 @@ import stglib
 args = stglib.cmd.rskcdf2nc_parser().parse_args()
 
 if args.atmpres:
-    ds = stglib.rsk.cdf2nc.cdf_to_nc(args.cdfname, atmpres=args.atmpres)
+    ds = stglib.rsk.cdf2nc.cdf_to_nc(
+        args.cdfname, atmpres=args.atmpres, profile=vars(args)
+    )
 else:
-    ds = stglib.rsk.cdf2nc.cdf_to_nc(args.cdfname)
+    ds = stglib.rsk.cdf2nc.cdf_to_nc(args.cdfname, profile=vars(args))
@@ -4,4 +4,4 @@ import stglib
 
 args = stglib.cmd.rsknc2waves_parser().parse_args()
 
-ds = stglib.rsk.nc2waves.nc_to_waves(args.ncname)
+ds = stglib.rsk.nc2waves.nc_to_waves(args.ncname, profile=vars(args))
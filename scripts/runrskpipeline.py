@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+import yaml
+
+import stglib
+
+args = stglib.cmd.rskpipeline_parser().parse_args()
+
+# initialize metadata from the globalatts file
+metadata = stglib.read_globalatts(args.gatts)
+
+# Add additional metadata from metadata config file
+with open(args.config) as f:
+    config = yaml.safe_load(f)
+
+for k in config:
+    metadata[k] = config[k]
+
+with stglib.monitor.report(args.perf_report, trace_memory=args.trace_memory):
+    ds = stglib.rsk.pipeline.rsk_to_waves(
+        metadata,
+        atmpres=args.atmpres,
+        intermediate=args.intermediate,
+        profile=vars(args),
+        use_cache=args.use_cache,
+    )
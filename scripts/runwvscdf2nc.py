@@ -5,6 +5,8 @@ import stglib
 args = stglib.cmd.wvscdf2nc_parser().parse_args()
 
 if args.atmpres:
-    VEL = stglib.aqd.wvscdf2nc.cdf_to_nc(args.cdfname, atmpres=args.atmpres)
+    VEL = stglib.aqd.wvscdf2nc.cdf_to_nc(
+        args.cdfname, atmpres=args.atmpres, profile=vars(args)
+    )
 else:
-    VEL = stglib.aqd.wvscdf2nc.cdf_to_nc(args.cdfname)
+    VEL = stglib.aqd.wvscdf2nc.cdf_to_nc(args.cdfname, profile=vars(args))
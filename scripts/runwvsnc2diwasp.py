@@ -4,4 +4,4 @@ import stglib
 
 args = stglib.cmd.wvsnc2diwasp_parser().parse_args()
 
-ds = stglib.aqd.wvsnc2diwasp.nc_to_diwasp(args.ncname)
+ds = stglib.aqd.wvsnc2diwasp.nc_to_diwasp(args.ncname, profile=vars(args))
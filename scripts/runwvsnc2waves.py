@@ -4,4 +4,4 @@ import stglib
 
 args = stglib.cmd.wvsnc2waves_parser().parse_args()
 
-ds = stglib.aqd.wvsnc2waves.nc_to_waves(args.ncname)
+ds = stglib.aqd.wvsnc2waves.nc_to_waves(args.ncname, profile=vars(args))
@@ -29,12 +29,10 @@ setup(
         "Intended Audience :: Science/Research",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
     ],
     # install_requires=['numpy', 'netCDF4', 'xarray'],
-    python_requires=">=3.5",
+    python_requires=">=3.7",
     packages=find_packages(exclude=["doc", "tests"]),
     scripts=[
         "scripts/runaqdhdr2cdf.py",
@@ -47,6 +45,8 @@ setup(
         "scripts/runrskcdf2nc.py",
         "scripts/runrsknc2waves.py",
         "scripts/runrsknc2diwasp.py",
+        "scripts/runrskupdatewaves.py",
+        "scripts/runrskpipeline.py",
         "scripts/runecocsv2cdf.py",
         "scripts/runecocdf2nc.py",
         "scripts/runexocsv2cdf.py",
@@ -55,6 +55,7 @@ setup(
         "scripts/runwvscdf2nc.py",
         "scripts/runwvsnc2diwasp.py",
         "scripts/runwvsnc2waves.py",
+        "scripts/runbatch.py",
         "scripts/aqdturnaround.py",
         "scripts/exoturnaround.py",
     ],
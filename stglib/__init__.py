@@ -1,8 +1,52 @@
-from . import aqd, argonaut, core, eco, exo, hobo, indexvel, iq, rdi, rsk, troll
-from ._version import get_versions
-from .core import cmd, utils, waves
-from .core.utils import read_globalatts
-from .aqd import qaqc
-
-__version__ = get_versions()["version"]
-del get_versions
+import importlib
+
+# Subpackages and modules are imported on first use, so that importing stglib
+# (e.g. to convert one instrument file) does not import every instrument
+# reader and their dependencies
+_submodules = [
+    "aqd",
+    "argonaut",
+    "core",
+    "eco",
+    "exo",
+    "hobo",
+    "indexvel",
+    "iq",
+    "rdi",
+    "rsk",
+    "troll",
+]
+
+_aliases = {
+    "batch": ".core.batch",
+    "cmd": ".core.cmd",
+    "monitor": ".core.monitor",
+    "utils": ".core.utils",
+    "waves": ".core.waves",
+    "qaqc": ".aqd.qaqc",
+}
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    elif name in _aliases:
+        value = importlib.import_module(_aliases[name], __name__)
+    elif name == "read_globalatts":
+        value = importlib.import_module(".core.utils", __name__).read_globalatts
+    elif name == "__version__":
+        from ._version import get_versions
+
+        value = get_versions()["version"]
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    # loaded submodules and aliases are also in globals()
+    return sorted(
+        set(list(globals()) + _submodules + list(_aliases) + ["read_globalatts"])
+    )
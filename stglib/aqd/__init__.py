@@ -1 +1,22 @@
-from . import cdf2nc, hdr2cdf, qaqc, wvscdf2nc, wvsnc2diwasp, wvsnc2waves, wvswad2cdf
+import importlib
+
+# modules are imported on first use, see stglib/__init__.py
+_submodules = [
+    "cdf2nc",
+    "hdr2cdf",
+    "qaqc",
+    "wvscdf2nc",
+    "wvsnc2diwasp",
+    "wvsnc2waves",
+    "wvswad2cdf",
+]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _submodules)
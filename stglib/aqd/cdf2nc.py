@@ -2,21 +2,19 @@ from __future__ import division, print_function
 
 import xarray as xr
 
-from ..core import utils
+from ..core import monitor, utils
 from . import qaqc
 
 
-def cdf_to_nc(cdf_filename, atmpres=False):
+@monitor.timed
+def cdf_to_nc(cdf_filename, atmpres=False, profile=None):
     """
     Load a "raw" .cdf file and generate a processed .nc file
     """
 
-    # Load raw .cdf data
+    # Load raw .cdf data, clipped to in/out water times or via good_ens
     VEL = qaqc.load_cdf(cdf_filename, atmpres=atmpres)
 
-    # Clip data to in/out water times or via good_ens
-    VEL = utils.clip_ds(VEL)
-
     # Create water_depth attribute
     # VEL = utils.create_water_depth(VEL)
     VEL = utils.create_nominal_instrument_depth(VEL)
@@ -50,7 +48,7 @@ def cdf_to_nc(cdf_filename, atmpres=False):
     VEL = qaqc.make_bin_depth(VEL)
 
     # Reshape and associate dimensions with lat/lon
-    for var in [
+    latlonvars = [
         "U",
         "V",
         "W",
@@ -62,9 +60,8 @@ def cdf_to_nc(cdf_filename, atmpres=False):
         "Roll",
         "bin_depth",
         "Pressure_ac",
-    ]:
-        if var in VEL:
-            VEL = utils.add_lat_lon(VEL, var)
+    ]
+    VEL = utils.add_singleton_dims(VEL, [var for var in latlonvars if var in VEL])
 
     # swap_dims from bindist to depth
     VEL = ds_swap_dims(VEL)
@@ -110,9 +107,11 @@ def cdf_to_nc(cdf_filename, atmpres=False):
         nc_filename = VEL.attrs["filename"] + "-a.nc"
 
     if utils.is_cf(VEL):
-        VEL.to_netcdf(nc_filename, encoding={"time": {"dtype": "i4"}})
+        utils.write_nc(
+            VEL, nc_filename, profile=profile, encoding={"time": {"dtype": "i4"}}
+        )
     else:
-        VEL.to_netcdf(nc_filename, unlimited_dims=["time"])
+        utils.write_nc(VEL, nc_filename, profile=profile, unlimited_dims=["time"])
 
     print("Done writing netCDF file", nc_filename)
 
@@ -3,10 +3,11 @@ from __future__ import division, print_function
 import pandas as pd
 import xarray as xr
 
-from ..core import utils
+from ..core import monitor, utils
 from . import qaqc
 
 
+@monitor.timed
 def prf_to_cdf(metadata):
     """Load a Aquadopp text files and output to netCDF format"""
 
@@ -64,13 +65,14 @@ def prf_to_cdf(metadata):
     # need to drop datetime
     ds = ds.drop("datetime")
 
-    ds.to_netcdf(cdf_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, cdf_filename, raw=True, unlimited_dims=["time"])
 
     print("Finished writing data to %s" % cdf_filename)
 
     return ds
 
 
+@monitor.timed
 def load_sen(basefile):
     """Load data from .sen file"""
 
@@ -112,6 +114,7 @@ def load_sen(basefile):
     return RAW
 
 
+@monitor.timed
 def load_amp_vel(RAW, basefile):
     """Load amplitude and velocity data from the .aN and .vN files"""
 
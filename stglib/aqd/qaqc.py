@@ -5,7 +5,7 @@ import math
 import numpy as np
 import xarray as xr
 
-from ..core import utils
+from ..core import atmos, monitor, utils
 
 
 def ds_rename(ds, waves=False):
@@ -71,24 +71,21 @@ def ds_rename(ds, waves=False):
     return ds
 
 
-def load_cdf(cdf_filename, atmpres=False):
+@monitor.timed
+def load_cdf(cdf_filename, atmpres=False, wvs=False):
     """
-    Load raw .cdf file and, optionally, an atmospheric pressure .cdf file
+    Load raw .cdf file, clipped to in/out water times or via good_ens, and,
+    optionally, an atmospheric pressure .cdf file. Only the clipped data are
+    read from disk.
     """
 
-    ds = xr.load_dataset(cdf_filename)
+    ds = utils.open_clipped_dataset(cdf_filename, wvs=wvs)
 
     if atmpres is not False:
-        p = xr.load_dataset(atmpres)
         # TODO: check to make sure this data looks OK
-        ds["Pressure_ac"] = xr.DataArray(
-            ds["Pressure"]
-            - p["atmpres"].reindex_like(
-                ds["Pressure"], method="nearest", tolerance="5s"
-            )
-            - p[
-                "atmpres"
-            ].offset  # need to set a tolerance since we can be off by a couple seconds somewhere
+        # need to set a tolerance since we can be off by a couple seconds somewhere
+        ds["Pressure_ac"] = atmos.atmos_correct(
+            ds["Pressure"], atmpres, ds.attrs, tolerance="5s"
         )
 
     return ds
@@ -124,6 +121,7 @@ def make_tilt(p, r):
     )
 
 
+@monitor.timed
 def coord_transform(vel1, vel2, vel3, heading, pitch, roll, T, T_orig, cs):
     """Perform coordinate transformation to ENU"""
 
@@ -144,8 +142,7 @@ def coord_transform(vel1, vel2, vel3, heading, pitch, roll, T, T_orig, cs):
         print("Data are in %s coordinates; transforming to Earth " "coordinates" % cs)
 
         for i in range(N):
-            if not i % 200:
-                print("{:.1f}% complete".format(i / N * 100))
+            monitor.progress("coord_transform", i, N)
             hh = np.pi * (heading[i] - 90) / 180
             pp = np.pi * pitch[i] / 180
             rr = np.pi * roll[i] / 180
@@ -1,16 +1,16 @@
 from __future__ import division, print_function
 
-from ..core import utils
+from ..core import monitor, utils
 from . import qaqc
 
 
-def cdf_to_nc(cdf_filename, atmpres=False, writefile=True, format="NETCDF3_64BIT"):
+@monitor.timed
+def cdf_to_nc(
+    cdf_filename, atmpres=False, writefile=True, format="NETCDF3_64BIT", profile=None
+):
 
-    # Load raw .cdf data
-    ds = qaqc.load_cdf(cdf_filename, atmpres=atmpres)
-
-    # Clip data to in/out water times or via good_ens
-    ds = utils.clip_ds(ds, wvs=True)
+    # Load raw .cdf data, clipped to in/out water times or via good_ens_wvs
+    ds = qaqc.load_cdf(cdf_filename, atmpres=atmpres, wvs=True)
 
     # Create water_depth variables
     # ds = utils.create_water_depth(ds)
@@ -44,18 +44,18 @@ def cdf_to_nc(cdf_filename, atmpres=False, writefile=True, format="NETCDF3_64BIT
             ds = utils.set_var_dtype(ds, var)
 
     # Need to add lat lon to certain variables
-    for var in ["Hdg_1215", "Ptch_1216", "Roll_1217"]:
-        ds = utils.add_lat_lon(ds, var)
+    ds = utils.add_singleton_dims(ds, ["Hdg_1215", "Ptch_1216", "Roll_1217"])
 
     # Ensure no _FillValue is assigned to coordinates
     ds = utils.ds_coord_no_fillvalue(ds)
 
     if writefile:
         nc_filename = ds.attrs["filename"] + "wvsb-cal.nc"
-        ds.to_netcdf(nc_filename, format=format)
         # Rename time variables for EPIC compliance, keeping a time_cf
         # coorindate.
-        utils.rename_time_2d(nc_filename, ds)
+        utils.write_nc(
+            utils.ds_rename_time_2d(ds), nc_filename, profile=profile, format=format
+        )
 
         print("Done writing netCDF file", nc_filename)
 
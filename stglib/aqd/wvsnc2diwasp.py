@@ -3,10 +3,11 @@ from __future__ import division, print_function
 import numpy as np
 import xarray as xr
 
-from ..core import utils, waves
+from ..core import monitor, utils, waves
 
 
-def nc_to_diwasp(nc_filename, format="NETCDF3_64BIT"):
+@monitor.timed
+def nc_to_diwasp(nc_filename, format="NETCDF3_64BIT", profile=None):
 
     ds = utils.open_time_2d_dataset(nc_filename)
 
@@ -112,11 +113,11 @@ def nc_to_diwasp(nc_filename, format="NETCDF3_64BIT"):
     ds = utils.ds_add_diwasp_history(ds)
 
     # add lat/lon coordinates to each variable
-    for var in ds.variables:
-        if (var not in ds.coords) and ("time" not in var):
-            ds = utils.add_lat_lon(ds, var)
-            # cast as float32
-            ds = utils.set_var_dtype(ds, var)
+    datavars = [var for var in ds.data_vars if "time" not in var]
+    ds = utils.add_singleton_dims(ds, datavars)
+    for var in datavars:
+        # cast as float32
+        ds = utils.set_var_dtype(ds, var)
 
     # remove lat and lon from burst dimension: they are singleton so can
     # remove them both with one call to squeeze()
@@ -128,7 +129,7 @@ def nc_to_diwasp(nc_filename, format="NETCDF3_64BIT"):
 
     print("Writing to netCDF")
 
-    ds.to_netcdf(nc_filename, format=format)
+    utils.write_nc(ds, nc_filename, profile=profile, format=format)
 
     print("Done creating", nc_filename)
 
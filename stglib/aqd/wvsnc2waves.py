@@ -3,10 +3,11 @@ from __future__ import division, print_function
 import xarray as xr
 import numpy as np
 
-from ..core import utils, waves
+from ..core import monitor, utils, waves
 from . import qaqc
 
-def nc_to_waves(nc_filename):
+@monitor.timed
+def nc_to_waves(nc_filename, profile=None):
 
     ds = xr.load_dataset(nc_filename, decode_times=False)
 
@@ -143,7 +144,7 @@ def nc_to_waves(nc_filename):
 
     nc_filename = ds.attrs["filename"] + "wvs-a.nc"
 
-    ds.to_netcdf(nc_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, nc_filename, profile=profile, unlimited_dims=["time"])
 
     print("Done creating", nc_filename)
 
@@ -4,10 +4,11 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 
-from ..core import utils
+from ..core import monitor, utils
 from . import qaqc
 
 
+@monitor.timed
 def wad_to_cdf(metadata, writefile=True):
     """Load Aquadopp waves data and create raw netCDF file
 
@@ -74,12 +75,13 @@ def wad_to_cdf(metadata, writefile=True):
 
     if writefile:
         cdf_filename = ds.attrs["filename"] + "wvs-raw.cdf"
-        ds.to_netcdf(cdf_filename)
+        utils.write_nc(ds, cdf_filename, raw=True)
         print("Finished writing data to %s" % cdf_filename)
 
     return ds
 
 
+@monitor.timed
 def load_whd(metadata):
     """Load data from .whd file"""
 
@@ -123,6 +125,7 @@ def load_whd(metadata):
     return ds
 
 
+@monitor.timed
 def load_wad(ds):
 
     wadfile = ds.attrs["basefile"] + ".wad"
@@ -0,0 +1,159 @@
+from __future__ import division, print_function
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from . import cache, utils
+
+# atmospheric pressure records loaded so far, by absolute path. Each is
+# reloaded only if its file changes, so processing many instruments against
+# the same record in one process reads it once
+_records = {}
+
+NAT = np.iinfo(np.int64).min
+
+
+def load_atmpres(atmpres):
+    """
+    Load an atmospheric pressure .cdf file (see the Atmospheric compensation
+    section of the documentation) and return a dict with the times, sorted
+    and as int64 nanoseconds, the atmpres values in the same order and the
+    offset attribute. Records are cached, so loading the same file again is
+    free.
+    """
+
+    path = os.path.abspath(atmpres)
+    state = cache.file_state(path)
+    if path in _records and _records[path]["state"] == state:
+        return _records[path]
+
+    met = xr.load_dataset(atmpres)
+    time = met["time"].values.astype("datetime64[ns]").astype(np.int64)
+    values = met["atmpres"].values
+    good = time != NAT
+    time, values = time[good], values[good]
+    if np.any(np.diff(time) < 0):
+        order = np.argsort(time, kind="stable")
+        time, values = time[order], values[order]
+
+    _records[path] = {
+        "state": state,
+        "time": time,
+        "atmpres": values,
+        "offset": met["atmpres"].offset,
+        "grids": {},
+    }
+
+    return _records[path]
+
+
+def interp_atmpres(record, time, method="nearest", tolerance=None):
+    """
+    Return the atmospheric pressure of a record loaded with load_atmpres at
+    each of the given times.
+
+    Parameters
+    ----------
+    record : dict
+        Atmospheric pressure record, from load_atmpres
+    time : array_like
+        1-D array of datetime64 target times
+    method : {"nearest", "linear"}, optional
+        Take the nearest atmospheric pressure sample, with ties going to the
+        later one, or interpolate linearly between the samples either side.
+        Default "nearest"
+    tolerance : str or pandas.Timedelta, optional
+        Maximum distance, e.g. "5s", from a target time to the sample(s)
+        used. Targets further away, or outside the record for "linear", are
+        NaN. Default None, for no limit; 0 only uses exact matches
+
+    Returns
+    -------
+    numpy.ndarray
+        Atmospheric pressure at each target time
+
+    Notes
+    -----
+    Results are cached for each target time grid, so the interpolation is
+    only done once however many variables or files use the same grid.
+    """
+
+    time = np.asarray(time).astype("datetime64[ns]").astype(np.int64)
+    key = (method, str(tolerance), hashlib.sha1(time.tobytes()).hexdigest())
+    if key in record["grids"]:
+        return record["grids"][key]
+
+    t = record["time"]
+    p = record["atmpres"]
+    tol = np.inf if tolerance is None else pd.Timedelta(tolerance).value
+
+    # first sample at or after each target, and the one before it
+    right = np.searchsorted(t, time)
+    left = right - 1
+    rc = np.minimum(right, len(t) - 1)
+    lc = np.maximum(left, 0)
+    dr = np.where(right < len(t), (t[rc] - time).astype(float), np.inf)
+    dl = np.where(left >= 0, (time - t[lc]).astype(float), np.inf)
+
+    valid = time != NAT
+    dtype = p.dtype if p.dtype.kind == "f" else np.float64
+    out = np.full(time.shape, np.nan, dtype=dtype)
+
+    if method == "nearest":
+        # ties go to the later sample, as in pandas
+        idx = np.where(dl < dr, lc, rc)
+        ok = valid & (np.minimum(dl, dr) <= tol)
+        out[ok] = p[idx[ok]]
+    elif method == "linear":
+        exact = valid & (dr == 0)
+        inside = (left >= 0) & (right < len(t))
+        ok = valid & inside & ~exact & (dl <= tol) & (dr <= tol)
+        w = dl[ok] / (dl[ok] + dr[ok])
+        out[ok] = p[lc[ok]] + w * (p[rc[ok]] - p[lc[ok]])
+        out[exact] = p[rc[exact]]
+    else:
+        raise ValueError(
+            "atmpres method must be nearest or linear, not {}".format(method)
+        )
+
+    # the same array is returned for every later request on this grid
+    out.flags.writeable = False
+    record["grids"][key] = out
+
+    return out
+
+
+def atmos_correct(da, atmpres, attrs=None, tolerance=0):
+    """
+    Return pressure da corrected with an atmospheric pressure file, i.e.
+    da - atmpres - offset, with atmpres taken at the times of da (see
+    interp_atmpres). da may have other dimensions, such as sample for burst
+    data, besides time.
+
+    The atmpres_method and atmpres_tolerance entries of attrs, normally the
+    global attributes of the instrument data, override the default method
+    "nearest" and the given tolerance. The default tolerance of 0 requires
+    the atmospheric pressure record to be on the same time base as the
+    instrument. In float32 working precision (see utils.working_precision)
+    the result is float32.
+    """
+
+    if attrs is None:
+        attrs = {}
+
+    record = load_atmpres(atmpres)
+    values = interp_atmpres(
+        record,
+        da["time"].values,
+        method=attrs.get("atmpres_method", "nearest"),
+        tolerance=attrs.get("atmpres_tolerance", tolerance),
+    )
+    if utils.working_precision(attrs) == "float32":
+        values = values.astype(np.float32)
+    atm = xr.DataArray(values, dims="time", coords={"time": da["time"]})
+
+    return da - atm - record["offset"]
@@ -0,0 +1,287 @@
+from __future__ import division, print_function
+
+import concurrent.futures
+import contextlib
+import os
+import time
+import traceback
+
+import yaml
+
+from . import monitor, utils
+
+INSTRUMENTS = ["aqd", "wvs", "rsk", "exo", "eco", "hobo", "iq", "rdi"]
+
+
+def read_manifest(manifest):
+    """
+    Read a batch manifest YAML file and return the list of jobs, each with
+    its metadata assembled from the global attributes file and instrument
+    configuration file.
+
+    The manifest has a ``jobs`` list. Each job gives the ``instrument``
+    type (one of aqd, wvs, rsk, exo, eco, hobo, iq, rdi), the ``config``
+    file and, optionally, the ``gatts`` file, the ``directory`` containing
+    the instrument data files, the ``atmpres`` file and a ``name`` used
+    for the log file. ``gatts``, ``directory`` and ``atmpres`` given at the
+    top level of the manifest apply to all jobs that do not set them. Paths
+    are relative to the directory containing the manifest.
+
+    Each global attributes and configuration file is read once, however
+    many jobs use it.
+    """
+
+    with open(manifest) as f:
+        campaign = yaml.safe_load(f)
+
+    root = os.path.dirname(os.path.abspath(manifest))
+
+    def path(p):
+        return os.path.normpath(os.path.join(root, p))
+
+    gatts = {}
+    configs = {}
+    jobs = []
+    names = set()
+
+    for n, entry in enumerate(campaign["jobs"]):
+        entry = dict(entry)
+        for k in ["gatts", "directory", "atmpres"]:
+            if k not in entry and k in campaign:
+                entry[k] = campaign[k]
+
+        if entry.get("instrument") not in INSTRUMENTS:
+            raise ValueError(
+                "Job {}: instrument must be one of {}, not {}".format(
+                    n, ", ".join(INSTRUMENTS), entry.get("instrument")
+                )
+            )
+
+        if "gatts" not in entry or "config" not in entry:
+            raise ValueError("Job {}: gatts and config must be specified".format(n))
+
+        gattsfile = path(entry["gatts"])
+        if gattsfile not in gatts:
+            gatts[gattsfile] = utils.read_globalatts(gattsfile)
+
+        configfile = path(entry["config"])
+        if configfile not in configs:
+            with open(configfile) as f:
+                configs[configfile] = yaml.safe_load(f)
+
+        metadata = dict(gatts[gattsfile])
+        metadata.update(configs[configfile])
+
+        name = entry.get("name", "{}-{}".format(entry["instrument"], n))
+        if name in names:
+            raise ValueError("Job {}: name {} is not unique".format(n, name))
+        names.add(name)
+
+        jobs.append(
+            {
+                "name": name,
+                "instrument": entry["instrument"],
+                "directory": path(entry.get("directory", ".")),
+                "atmpres": path(entry["atmpres"]) if entry.get("atmpres") else None,
+                "metadata": metadata,
+            }
+        )
+
+    return jobs
+
+
+def process_instrument(instrument, metadata, atmpres=None, profile=None):
+    """
+    Run all processing steps for one instrument in the current directory,
+    as the run*.py scripts for that instrument would be run in turn
+    """
+
+    from .. import aqd, eco, exo, hobo, iq, rdi, rsk
+
+    kwargs = {"profile": profile}
+    if atmpres is not None:
+        kwargs["atmpres"] = atmpres
+
+    def output(ds, suffix, prefix=False):
+        # file written by the previous step, named as in that step
+        filename = ds.attrs["filename"] + suffix
+        if prefix and "prefix" in ds.attrs:
+            filename = ds.attrs["prefix"] + filename
+        return utils.store_path(filename, ds.attrs, profile)
+
+    if instrument == "rsk":
+        return rsk.pipeline.rsk_to_waves(metadata, **kwargs)
+    elif instrument == "wvs":
+        ds = aqd.wvswad2cdf.wad_to_cdf(metadata)
+        ds = aqd.wvscdf2nc.cdf_to_nc(output(ds, "wvs-raw.cdf"), **kwargs)
+        return aqd.wvsnc2waves.nc_to_waves(output(ds, "wvsb-cal.nc"), profile=profile)
+    elif instrument == "aqd":
+        ds = aqd.hdr2cdf.prf_to_cdf(metadata)
+        return aqd.cdf2nc.cdf_to_nc(output(ds, "-raw.cdf", prefix=True), **kwargs)
+    elif instrument == "rdi":
+        ds = rdi.raw2cdf.raw_to_cdf(metadata)
+        return rdi.cdf2nc.cdf_to_nc(output(ds, "-raw.cdf", prefix=True), **kwargs)
+    elif instrument == "exo":
+        ds = exo.csv_to_cdf(metadata)
+        return exo.cdf_to_nc(output(ds, "-raw.cdf"), **kwargs)
+    elif instrument == "eco":
+        ds = eco.csv_to_cdf(metadata)
+        return eco.cdf_to_nc(output(ds, "-raw.cdf"), **kwargs)
+    elif instrument == "hobo":
+        if atmpres is not None:
+            raise ValueError("atmpres is not supported for HOBO instruments")
+        ds = hobo.csv_to_cdf(metadata)
+        return hobo.cdf_to_nc(output(ds, "-raw.cdf"), profile=profile)
+    elif instrument == "iq":
+        if atmpres is not None:
+            raise ValueError("atmpres is not supported for IQ instruments")
+        ds = iq.mat_to_cdf(metadata)
+        return iq.cdf_to_nc(output(ds, "-raw.cdf"), profile=profile)
+
+
+def run_job(job, logdir, profile=None, perf_report=None, trace_memory=False):
+    """
+    Process one manifest job, writing everything it prints, and the
+    traceback if it fails, to <logdir>/<name>.log. Exceptions are not
+    raised, so one failed instrument does not stop the others.
+
+    If perf_report is "json" or "csv", a performance report of the job (see
+    monitor.report) is written to <logdir>/<name>-perf.json or .csv.
+
+    Returns a dict with the job name, status ("ok" or "failed"), elapsed
+    time in seconds and log file path.
+    """
+
+    logfile = os.path.join(logdir, job["name"] + ".log")
+    if perf_report is not None:
+        perf_report = os.path.join(logdir, job["name"] + "-perf." + perf_report)
+    cwd = os.getcwd()
+    t0 = time.time()
+
+    with open(logfile, "w") as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                os.chdir(job["directory"])
+                with monitor.report(perf_report, trace_memory=trace_memory):
+                    process_instrument(
+                        job["instrument"],
+                        job["metadata"],
+                        atmpres=job["atmpres"],
+                        profile=profile,
+                    )
+                status = "ok"
+            except Exception:
+                traceback.print_exc()
+                status = "failed"
+            finally:
+                os.chdir(cwd)
+
+    return {
+        "name": job["name"],
+        "status": status,
+        "elapsed": time.time() - t0,
+        "log": logfile,
+    }
+
+
+def run_batch(
+    manifest,
+    logdir=None,
+    max_workers=None,
+    profile=None,
+    perf_report=None,
+    trace_memory=False,
+):
+    """
+    Process all instruments in a batch manifest (see read_manifest) in
+    parallel using a pool of processes, so the time taken is set by the
+    slowest instrument rather than the sum of all of them.
+
+    Parameters
+    ----------
+    manifest : string
+        Path to the manifest YAML file
+    logdir : string, optional
+        Directory for the per-job log files. Default is a ``logs``
+        directory next to the manifest
+    max_workers : int, optional
+        Maximum number of processes. Default is the number of CPUs
+    profile : dict, optional
+        netCDF output settings used for all jobs, see utils.output_profile
+    perf_report : {"json", "csv"}, optional
+        Write a performance report of each job to the log directory in this
+        format. Default is not to write them
+    trace_memory : bool, optional
+        Trace memory allocations in the performance reports. Default False
+
+    Returns
+    -------
+    list of dict
+        Summary of each job, as returned by run_job, in manifest order
+    """
+
+    jobs = read_manifest(manifest)
+
+    if logdir is None:
+        logdir = os.path.join(os.path.dirname(os.path.abspath(manifest)), "logs")
+    os.makedirs(logdir, exist_ok=True)
+    logdir = os.path.abspath(logdir)
+
+    print("Processing {} instruments from {}".format(len(jobs), manifest))
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                run_job,
+                job,
+                logdir,
+                profile=profile,
+                perf_report=perf_report,
+                trace_memory=trace_memory,
+            ): job
+            for job in jobs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # the worker process itself died
+                result = {
+                    "name": job["name"],
+                    "status": "failed ({})".format(type(e).__name__),
+                    "elapsed": float("nan"),
+                    "log": os.path.join(logdir, job["name"] + ".log"),
+                }
+            print("{}: {}".format(result["name"], result["status"]))
+            results[job["name"]] = result
+
+    summary = [results[job["name"]] for job in jobs]
+    print_summary(summary)
+
+    return summary
+
+
+def print_summary(summary):
+    """
+    Print a table of job names, statuses, elapsed times and log files
+    """
+
+    width = max([len("name")] + [len(r["name"]) for r in summary])
+    print(
+        "{:{w}}  {:8}  {:>9}  {}".format("name", "status", "time (s)", "log", w=width)
+    )
+    for r in summary:
+        print(
+            "{:{w}}  {:8}  {:9.1f}  {}".format(
+                r["name"], r["status"], r["elapsed"], r["log"], w=width
+            )
+        )
+
+    nfailed = sum(r["status"] != "ok" for r in summary)
+    print(
+        "{} of {} instruments processed successfully".format(
+            len(summary) - nfailed, len(summary)
+        )
+    )
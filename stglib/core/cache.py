@@ -0,0 +1,124 @@
+from __future__ import division, print_function
+
+import hashlib
+import json
+import os
+
+import stglib
+
+CACHE_DIR = ".stglib_cache"
+
+
+def file_state(path):
+    """
+    Return the size and modification time (ns) of a file, or the total size
+    and latest modification time of the files in a directory such as a Zarr
+    store. Returns None if path does not exist.
+    """
+
+    if os.path.isdir(path):
+        size = 0
+        mtime = os.stat(path).st_mtime_ns
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                st = os.stat(os.path.join(root, f))
+                size += st.st_size
+                mtime = max(mtime, st.st_mtime_ns)
+        return [size, mtime]
+    elif os.path.exists(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+    else:
+        return None
+
+
+def fingerprint(stage, files=None, upstream=None, metadata=None, **kwargs):
+    """
+    Return a fingerprint of the inputs of a processing stage: the stage
+    name, the stglib version, the size and modification time of each input
+    file, the fingerprint of the previous stage, the metadata entries the
+    stage depends on and any other arguments given as keyword arguments.
+    The fingerprint changes if any of these change.
+
+    Parameters
+    ----------
+    stage : str
+        Stage name, e.g. "rsk_to_cdf"
+    files : list of str, optional
+        Input files
+    upstream : str, optional
+        Fingerprint of the stage the input Dataset comes from
+    metadata : dict, optional
+        Metadata entries the stage depends on
+    **kwargs
+        Other arguments affecting the output, e.g. atmpres or profile.
+        Values must be JSON serializable, or are compared by their str()
+
+    Returns
+    -------
+    str
+        SHA-256 hex digest
+    """
+
+    state = {
+        "stage": stage,
+        "version": stglib.__version__,
+        "files": [[x, file_state(x)] for x in files or []],
+        "upstream": upstream,
+        "metadata": metadata or {},
+        "kwargs": kwargs,
+    }
+
+    return hashlib.sha256(
+        json.dumps(state, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def record_path(filename):
+    """
+    Return the path of the cache record of an output file, kept in a
+    .stglib_cache directory next to the file
+    """
+
+    head, tail = os.path.split(filename)
+    return os.path.join(head, CACHE_DIR, tail + ".json")
+
+
+def read_record(filename):
+    """
+    Return the cache record of an output file, or None if there is none
+    """
+
+    try:
+        with open(record_path(filename)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(filename, fp):
+    """
+    Return True if filename was written by a stage with fingerprint fp and
+    has not been modified since
+    """
+
+    record = read_record(filename)
+    if record is None:
+        return False
+
+    return record["fingerprint"] == fp and record["output"] == file_state(filename)
+
+
+def save_record(filename, fp, **kwargs):
+    """
+    Record that filename was written by a stage with fingerprint fp. Other
+    keyword arguments are stored in the record as well and must be JSON
+    serializable.
+    """
+
+    path = record_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {"fingerprint": fp, "output": file_state(filename)}
+    record.update(kwargs)
+    with open(path, "w") as f:
+        json.dump(record, f)
@@ -15,6 +15,74 @@ def gattsarg(parser):
     )
 
 
+def storeformatarg(parser):
+    parser.add_argument(
+        "--store-format",
+        dest="store_format",
+        choices=["netcdf", "zarr"],
+        help=(
+            "write output as a netCDF file (the default) or a Zarr store. "
+            "Overrides store_format in the config file"
+        ),
+    )
+
+
+def perfreportarg(parser):
+    parser.add_argument(
+        "--perf-report",
+        dest="perf_report",
+        metavar="FILE",
+        help=(
+            "write the wall time, CPU time and memory use of each processing "
+            "step to FILE, as CSV if it ends with .csv and JSON otherwise"
+        ),
+    )
+    parser.add_argument(
+        "--trace-memory",
+        dest="trace_memory",
+        action="store_true",
+        help=(
+            "also trace memory allocations of each step in --perf-report. "
+            "Slows processing considerably"
+        ),
+    )
+
+
+def ncprofilearg(parser):
+    storeformatarg(parser)
+    parser.add_argument(
+        "--nc-profile",
+        dest="nc_profile",
+        choices=["timeseries", "burst"],
+        help=(
+            "write compressed, chunked NETCDF4 output with chunks suited to "
+            "time-series or burst access. Overrides nc_profile in the "
+            "config file"
+        ),
+    )
+    parser.add_argument(
+        "--nc-complevel",
+        dest="nc_complevel",
+        type=int,
+        choices=range(1, 10),
+        metavar="{1-9}",
+        help="zlib compression level for --nc-profile. Default 4",
+    )
+    parser.add_argument(
+        "--nc-chunk-time",
+        dest="nc_chunk_time",
+        type=int,
+        help="number of time steps per chunk, overriding --nc-profile",
+    )
+    parser.add_argument(
+        "--nc-pack-velocity",
+        dest="nc_pack_velocity",
+        action="store_const",
+        const="int16",
+        help="pack velocities as int16 with a scale_factor",
+    )
+
+
 def aqdhdr2cdf_parser():
     description = (
         "Convert Aquadopp text files to raw .cdf format. Run this "
@@ -24,6 +92,8 @@ def aqdhdr2cdf_parser():
     gattsarg(parser)
     yamlarg(parser)
 
+    storeformatarg(parser)
+
     return parser
 
 
@@ -38,6 +108,8 @@ def aqdcdf2nc_parser():
         "--atmpres", help=("path to cdf file containing " "atmopsheric pressure data")
     )
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -51,6 +123,8 @@ def wvswad2cdf_parser():
     gattsarg(parser)
     yamlarg(parser)
 
+    storeformatarg(parser)
+
     return parser
 
 
@@ -62,6 +136,8 @@ def wvscdf2nc_parser():
         "--atmpres", help=("path to cdf file containing " "atmopsheric pressure data")
     )
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -70,6 +146,8 @@ def wvsnc2diwasp_parser():
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("ncname", help="processed .nc filename")
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -78,6 +156,8 @@ def wvsnc2waves_parser():
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("ncname", help="processed .nc filename")
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -91,6 +171,8 @@ def rskrsk2cdf_parser():
     gattsarg(parser)
     yamlarg(parser)
 
+    storeformatarg(parser)
+
     return parser
 
 
@@ -105,6 +187,8 @@ def rskcdf2nc_parser():
         "--atmpres", help=("path to cdf file containing " "atmopsheric pressure data")
     )
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -121,6 +205,66 @@ def rsknc2waves_parser():
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("ncname", help="processed .nc filename")
 
+    ncprofilearg(parser)
+
+    return parser
+
+
+def rskupdatewaves_parser():
+    description = (
+        "Append wave statistics from new bursts in a (partially downloaded) "
+        "RBR d|wave .rsk file to the waves statistics file. "
+        "Run this script from the directory containing d|wave files"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    gattsarg(parser)
+    yamlarg(parser)
+    parser.add_argument(
+        "--atmpres", help=("path to cdf file containing " "atmopsheric pressure data")
+    )
+
+    perfreportarg(parser)
+    ncprofilearg(parser)
+
+    return parser
+
+
+def rskpipeline_parser():
+    description = (
+        "Process an RBR d|wave .rsk file to wave statistics in a single "
+        "step, without writing the intermediate raw .cdf and .nc files "
+        "unless requested. Run this script from the directory containing "
+        "d|wave files"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    gattsarg(parser)
+    yamlarg(parser)
+    parser.add_argument(
+        "--atmpres", help=("path to cdf file containing " "atmopsheric pressure data")
+    )
+    parser.add_argument(
+        "--write",
+        dest="intermediate",
+        action="append",
+        choices=["raw", "nc"],
+        help=(
+            "also write the intermediate raw .cdf (raw) or b-cal.nc (nc) "
+            "file. May be given more than once"
+        ),
+    )
+    parser.add_argument(
+        "--cache",
+        dest="use_cache",
+        action="store_true",
+        help=(
+            "keep the intermediate files and skip the steps whose inputs "
+            "have not changed since the last run"
+        ),
+    )
+
+    perfreportarg(parser)
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -133,6 +277,8 @@ def hwlbcsv2cdf_parser():
     gattsarg(parser)
     yamlarg(parser)
 
+    storeformatarg(parser)
+
     return parser
 
 
@@ -141,6 +287,8 @@ def hwlbcdf2nc_parser():
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("cdfname", help="raw .CDF filename")
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -153,6 +301,8 @@ def iqmat2cdf_parser():
     gattsarg(parser)
     yamlarg(parser)
 
+    storeformatarg(parser)
+
     return parser
 
 
@@ -161,6 +311,8 @@ def iqcdf2nc_parser():
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("cdfname", help="raw .CDF filename")
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -173,6 +325,8 @@ def exocsv2cdf_parser():
     gattsarg(parser)
     yamlarg(parser)
 
+    storeformatarg(parser)
+
     return parser
 
 
@@ -184,6 +338,8 @@ def exocdf2nc_parser():
         "--atmpres", help=("path to cdf file containing " "atmopsheric pressure data")
     )
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -196,6 +352,8 @@ def ecolog2cdf_parser():
     gattsarg(parser)
     yamlarg(parser)
 
+    storeformatarg(parser)
+
     return parser
 
 
@@ -204,6 +362,8 @@ def ecocdf2nc_parser():
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument("cdfname", help="raw .CDF filename")
 
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -215,6 +375,8 @@ def rdiraw2cdf_parser():
     gattsarg(parser)
     yamlarg(parser)
 
+    storeformatarg(parser)
+
     return parser
 
 
@@ -228,6 +390,48 @@ def rdicdf2nc_parser():
         "--atmpres", help=("path to cdf file containing " "atmopsheric pressure data")
     )
 
+    ncprofilearg(parser)
+
+    return parser
+
+
+def batch_parser():
+    description = (
+        "Process all instruments of a mooring deployment listed in a "
+        "manifest YAML file, running the instruments in parallel. "
+        "Each instrument is processed from raw data through all steps, "
+        "with its output logged to a separate file"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("manifest", help="batch manifest YAML file")
+    parser.add_argument(
+        "--logdir",
+        help="directory for log files. Default is logs/ next to the manifest",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of instruments to process at once. Default is the number of CPUs",
+    )
+    parser.add_argument(
+        "--perf-report",
+        dest="perf_report",
+        choices=["json", "csv"],
+        help=(
+            "write the wall time, CPU time and memory use of each processing "
+            "step of each instrument to the log directory in this format"
+        ),
+    )
+    parser.add_argument(
+        "--trace-memory",
+        dest="trace_memory",
+        action="store_true",
+        help="also trace memory allocations of each step in --perf-report",
+    )
+
+    ncprofilearg(parser)
+
     return parser
 
 
@@ -0,0 +1,197 @@
+from __future__ import division, print_function
+
+import contextlib
+import csv
+import functools
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+FIELDS = [
+    "name",
+    "depth",
+    "start",
+    "wall_time",
+    "cpu_time",
+    "peak_rss",
+    "peak_rss_increase",
+    "traced_memory_increase",
+    "traced_memory_peak",
+]
+
+# records of the active report, the stack of steps being timed and the
+# progress callback
+_state = {"records": None, "stack": [], "t0": None, "progress": None}
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of this process in bytes, or None if
+    it cannot be determined
+    """
+
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def timed(func):
+    """
+    Decorator recording the wall time, CPU time, peak RSS and, if enabled,
+    tracemalloc statistics of each call of func while a report is active
+    (see report). Otherwise func is called directly.
+    """
+
+    name = "{}.{}".format(func.__module__.replace("stglib.", ""), func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _state["records"] is None:
+            return func(*args, **kwargs)
+
+        with step(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def step(name):
+    """
+    Context manager recording the statistics of a block of code under name
+    while a report is active
+    """
+
+    if _state["records"] is None:
+        yield
+        return
+
+    tracing = tracemalloc.is_tracing()
+    frame = {"peak": 0}
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        # the peak is reset for each step, so pass it on to the enclosing ones
+        for f in _state["stack"]:
+            f["peak"] = max(f["peak"], peak - f["base"])
+        tracemalloc.reset_peak()
+        frame["base"] = current
+
+    record = {
+        "name": name,
+        "depth": len(_state["stack"]),
+        "start": time.perf_counter() - _state["t0"],
+    }
+    rss0 = peak_rss()
+    cpu0 = time.process_time()
+    _state["stack"].append(frame)
+
+    try:
+        yield
+    finally:
+        _state["stack"].pop()
+        record["wall_time"] = time.perf_counter() - _state["t0"] - record["start"]
+        record["cpu_time"] = time.process_time() - cpu0
+        record["peak_rss"] = peak_rss()
+        if rss0 is not None:
+            record["peak_rss_increase"] = record["peak_rss"] - rss0
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            frame["peak"] = max(frame["peak"], peak - frame["base"])
+            record["traced_memory_increase"] = current - frame["base"]
+            record["traced_memory_peak"] = frame["peak"]
+            for f in _state["stack"]:
+                f["peak"] = max(f["peak"], peak - f["base"])
+        _state["records"].append(record)
+
+
+@contextlib.contextmanager
+def report(filename=None, trace_memory=False):
+    """
+    Record the statistics of all timed steps run within the block and,
+    optionally, write them to a JSON or CSV file, depending on the extension
+    of filename.
+
+    Each record has the step name, its nesting depth, its start time and
+    wall time in seconds since the start of the block, its CPU time in
+    seconds, the peak resident set size of the process in bytes at its end
+    and how much the step increased it, and, if trace_memory is True, the
+    net increase and peak of memory allocated by Python during the step,
+    from tracemalloc. Tracing memory slows processing considerably.
+
+    Yields the list of records, which is filled in as steps finish.
+    """
+
+    if _state["records"] is not None:
+        raise RuntimeError("A performance report is already being recorded")
+
+    records = []
+    _state.update(records=records, stack=[], t0=time.perf_counter())
+
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+
+    try:
+        yield records
+    finally:
+        if started:
+            tracemalloc.stop()
+        _state.update(records=None, stack=[], t0=None)
+
+    # records are appended as steps finish; list them in the order they
+    # started
+    records.sort(key=lambda r: r["start"])
+
+    if filename is not None:
+        write_report(records, filename)
+        print("Wrote performance report to", filename)
+
+
+def write_report(records, filename):
+    """
+    Write performance records to a CSV file if filename ends with .csv, or
+    a JSON file otherwise
+    """
+
+    if filename.lower().endswith(".csv"):
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(filename, "w") as f:
+            json.dump(records, f, indent=1)
+
+
+def set_progress(callback=None):
+    """
+    Send progress reports of long loops to callback, called as
+    callback(name, fraction) with fraction between 0 and 1. With the default
+    of None they are printed.
+    """
+
+    _state["progress"] = callback
+
+
+def progress(name, i, n, every=200):
+    """
+    Report progress of item i of n of a loop in name, every `every` items
+    """
+
+    if i % every:
+        return
+
+    if _state["progress"] is None:
+        print("{:.1f}% complete".format(i / n * 100))
+    else:
+        _state["progress"](name, i / n)
@@ -0,0 +1,281 @@
+from __future__ import division, print_function
+
+import numpy as np
+
+from . import utils
+
+# QA/QC rules in the order they are applied. Each is configured by a
+# <var>_<rule> global attribute, except salinity, which is enabled for all
+# variables with trim_by_salinity
+EXO_RULES = [
+    "min",
+    "max",
+    "min_diff",
+    "max_diff",
+    "med_diff",
+    "med_diff_pct",
+    "bad_ens",
+    "salinity",
+]
+
+ECO_RULES = [
+    "std_max",
+    "min",
+    "max",
+    "min_diff",
+    "max_diff",
+    "med_diff",
+    "med_diff_pct",
+    "bad_ens",
+]
+
+
+def compile_rules(ds, variables, rules):
+    """
+    Return a dict of the rules configured for each variable, as a list of
+    (rule, value) pairs in the order of rules, and print what each will trim
+    """
+
+    kernel_size = ds.attrs.get("kernel_size", 5)
+    compiled = {}
+
+    for var in variables:
+        if var not in ds:
+            continue
+
+        compiled[var] = []
+        for rule in rules:
+            if rule == "salinity":
+                if trim_by_salinity(ds, var):
+                    print("%s: Trimming using valid salinity threshold" % var)
+                    compiled[var].append((rule, None))
+                continue
+
+            if var + "_" + rule not in ds.attrs:
+                continue
+            value = ds.attrs[var + "_" + rule]
+
+            if rule == "bad_ens":
+                for n in range(0, len(value), 2):
+                    print(
+                        "%s: Trimming using bad_ens %s" % (var, str(value[n : n + 2]))
+                    )
+                    compiled[var].append((rule, value[n : n + 2]))
+                continue
+
+            if rule == "std_max":
+                msg = "%s: Trimming using maximum standard deviation of %f" % (
+                    var,
+                    value,
+                )
+            elif rule == "min":
+                msg = "%s: Trimming using minimum value of %f" % (var, value)
+            elif rule == "max":
+                msg = "%s: Trimming using maximum value of %f" % (var, value)
+            elif rule == "min_diff":
+                msg = "%s: Trimming using minimum diff of %f" % (var, value)
+            elif rule == "max_diff":
+                msg = "%s: Trimming using maximum diff of %f" % (var, value)
+            elif rule == "med_diff":
+                msg = "%s: Trimming using %d-point median filter diff of %f" % (
+                    var,
+                    kernel_size,
+                    value,
+                )
+            elif rule == "med_diff_pct":
+                msg = "%s: Trimming using %d-point median filter diff of %f pct" % (
+                    var,
+                    kernel_size,
+                    value,
+                )
+            else:
+                raise ValueError("Unknown QA/QC rule {}".format(rule))
+            print(msg)
+            compiled[var].append((rule, value))
+
+        if not compiled[var]:
+            del compiled[var]
+
+    return compiled
+
+
+def trim_by_salinity(ds, var):
+    """Return True if var is to be trimmed where salinity is missing"""
+
+    # xarray doesn't support writing attributes as booleans
+    return (
+        "trim_by_salinity" in ds.attrs
+        and ds.attrs["trim_by_salinity"].lower() == "true"
+        and not (
+            "trim_by_salinity_exclude" in ds.attrs
+            and var in ds.attrs["trim_by_salinity_exclude"]
+        )
+    )
+
+
+def apply_rules(ds, variables, rules=EXO_RULES):
+    """
+    Trim variables using the QA/QC rules configured in the global
+    attributes, with the same results and notes as applying each rule to
+    each variable in turn.
+
+    Variables with the same dimensions and dtype are stacked into a 2-D
+    array, and each rule builds one mask for all the variables it applies
+    to. Each rule sees the values filled by the rules before it. The
+    salinity rule is applied last, once salinity (S_41) has been trimmed,
+    so the group containing S_41 is done first.
+
+    The running median of each variable is computed once, when the first of
+    med_diff and med_diff_pct is applied, and reused by the other, so
+    med_diff_pct compares against the median of the values before med_diff
+    trimmed them.
+    """
+
+    compiled = compile_rules(ds, variables, rules)
+
+    groups = {}
+    for var in compiled:
+        key = (ds[var].dims, ds[var].shape, ds[var].dtype)
+        groups.setdefault(key, []).append(var)
+    groups = sorted(groups.values(), key=lambda names: "S_41" not in names)
+
+    for names in groups:
+        x = np.stack([ds[var].values for var in names])
+        if x.dtype.kind != "f":
+            x = x.astype(float)
+
+        medians = {}
+        for rule in rules:
+            rows = [
+                (i, value)
+                for i, var in enumerate(names)
+                for r, value in compiled[var]
+                if r == rule
+            ]
+            if rows:
+                apply_rule(ds, rule, x, names, rows, medians)
+
+        for i, var in enumerate(names):
+            if ds[var].dtype.kind == "f":
+                ds[var].values = x[i]
+            else:
+                ds[var] = ds[var].copy(data=x[i])
+
+    for var in compiled:
+        for rule, value in compiled[var]:
+            if rule == "salinity" and var == "S_41":
+                continue
+            ds = utils.insert_note(ds, var, note(ds, var, rule, value))
+
+    return ds
+
+
+def apply_rule(ds, rule, x, names, rows, medians=None):
+    """
+    Fill with NaN the values of the stacked variables x, named names, that
+    fail rule, given the (row, value) pairs of the variables it applies to.
+    The running medians of the med_diff rules are looked up in, or added
+    to, the dict medians by row.
+    """
+
+    if medians is None:
+        medians = {}
+
+    idx = [i for i, _ in rows]
+
+    if rule == "salinity":
+        if "S_41" in names:
+            salinity = x[names.index("S_41")]
+        else:
+            salinity = ds["S_41"].values
+        x[np.ix_(idx, np.isnan(salinity))] = np.nan
+        return
+
+    if rule == "bad_ens":
+        # each bad_ens pair is applied in turn
+        for i, value in rows:
+            if isinstance(value[0], str):
+                time = ds[names[i]]["time"].values
+                bads = (time >= np.datetime64(value[0])) & (
+                    time <= np.datetime64(value[1])
+                )
+                x[i, bads] = np.nan
+            else:
+                x[i, np.arange(value[0], value[1])] = np.nan
+        return
+
+    # compare in the dtype of the data, as with a scalar threshold
+    values = np.asarray([value for _, value in rows], dtype=x.dtype)[:, None]
+    # avoid copying the rows when the rule applies to all of them
+    xs = x if idx == list(range(len(x))) else x[idx]
+
+    if rule == "std_max":
+        std = np.stack([ds[names[i] + "_std"].values for i in idx])
+        bads = std > values.astype(std.dtype)
+    elif rule == "min":
+        bads = xs < values
+    elif rule == "max":
+        bads = xs > values
+    elif rule in ["min_diff", "max_diff"]:
+        diff = np.zeros_like(xs)
+        diff[:, 1:] = np.diff(xs, axis=1)
+        bads = diff < values if rule == "min_diff" else diff > values
+    elif rule in ["med_diff", "med_diff_pct"]:
+        todo = [i for i in idx if i not in medians]
+        if todo:
+            filtered = utils.rolling_median(
+                x[todo],
+                kernel_size=ds.attrs.get("kernel_size", 5),
+                nan_policy=ds.attrs.get("median_nan_policy", "omit"),
+            )
+            medians.update(zip(todo, filtered))
+        filtered = np.stack([medians[i] for i in idx])
+        if rule == "med_diff":
+            bads = np.abs(xs - filtered) > values
+        else:
+            bads = 100 * np.abs(xs - filtered) / xs > values
+
+    xs[bads] = np.nan
+    if xs is not x:
+        x[idx] = xs
+
+
+def note(ds, var, rule, value):
+    """Return the note added to var when trimmed with rule"""
+
+    kernel_size = ds.attrs.get("kernel_size", 5)
+
+    if rule == "std_max":
+        return "Values filled where standard deviation greater than %f units. " % value
+    elif rule == "min":
+        return "Values filled where less than %f units. " % value
+    elif rule == "max":
+        return "Values filled where greater than %f units. " % value
+    elif rule == "min_diff":
+        return (
+            "Values filled where data decreases by more than %f "
+            "units in a single time step. " % value
+        )
+    elif rule == "max_diff":
+        return (
+            "Values filled where data increases by more than %f "
+            "units in a single time step. " % value
+        )
+    elif rule == "med_diff":
+        return (
+            "Values filled where difference between %d-point "
+            "median filter and original values is greater than "
+            "%f. " % (kernel_size, value)
+        )
+    elif rule == "med_diff_pct":
+        return (
+            "Values filled where percent difference between "
+            "%d-point median filter and original values is greater "
+            "than %f. " % (kernel_size, value)
+        )
+    elif rule == "bad_ens":
+        return "Data clipped using bad_ens values of %s. " % (
+            str(ds.attrs[var + "_bad_ens"])
+        )
+    elif rule == "salinity":
+        return "Values filled using valid salinity threshold. "
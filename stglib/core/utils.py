@@ -2,6 +2,7 @@ from __future__ import division, print_function
 
 import csv
 import inspect
+import io
 import os
 import platform
 import sqlite3
@@ -11,11 +12,12 @@ import warnings
 import netCDF4
 import numpy as np
 import pandas as pd
-import scipy.io as spio
 import xarray as xr
 
 import stglib
 
+from . import monitor
+
 
 def is_cf(ds):
     if ("Conventions" in ds.attrs) and (str(ds.attrs["Conventions"]) == "CF-1.6"):
@@ -24,6 +26,7 @@ def is_cf(ds):
         return False
 
 
+@monitor.timed
 def clip_ds(ds, wvs=False):
     """
     Clip an xarray Dataset from metadata, either via good_ens or
@@ -31,6 +34,10 @@ def clip_ds(ds, wvs=False):
 
     wvs only applies to Aquadopp waves here. It is distinct from waves flag
     because AQD waves can have a different sampling interval than AQD currents
+
+    The indices to keep are found from the time coordinate alone, so a
+    lazily opened Dataset (see open_clipped_dataset) is only sliced, and
+    no data variables are read.
     """
 
     print(
@@ -56,10 +63,14 @@ def clip_ds(ds, wvs=False):
         else:
             good_ens = ds.attrs["good_ens"]
 
-        goods = []
-        for x in good_ens:
-            goods.append(np.arange(x[0], x[1]))
-        goods = np.hstack(goods)
+        if len(good_ens) == 1:
+            # a slice can be read lazily without fancy indexing
+            goods = slice(good_ens[0][0], good_ens[0][1])
+        else:
+            goods = []
+            for x in good_ens:
+                goods.append(np.arange(x[0], x[1]))
+            goods = np.hstack(goods)
 
         ds = ds.isel(time=goods)
 
@@ -71,9 +82,7 @@ def clip_ds(ds, wvs=False):
         print("Clipping data using good_ens_wvs")
         good_ens = ds.attrs["good_ens_wvs"]
 
-        goods = np.arange(good_ens[0], good_ens[1])
-
-        ds = ds.isel(time=goods)
+        ds = ds.isel(time=slice(good_ens[0], good_ens[1]))
 
         histtext = "Data clipped using good_ens_wvs values of {}. ".format(
             str(good_ens)
@@ -86,13 +95,21 @@ def clip_ds(ds, wvs=False):
         # and Recovery_date
         print("Clipping data using good_dates")
 
-        where = np.where(
-            (ds["time"].values >= np.datetime64(ds.attrs["good_dates"][0]))
-            & (ds["time"].values <= np.datetime64(ds.attrs["good_dates"][1]))
-        )[0]
-        print("good_dates[0] {}, idx {}".format(ds.attrs["good_dates"][0], where.min()))
-        print("good_dates[1] {}, idx {}".format(ds.attrs["good_dates"][1], where.max()))
-        ds = ds.sel(time=slice(ds.attrs["good_dates"][0], ds.attrs["good_dates"][1]))
+        idx = time_indexer(
+            ds["time"].values, ds.attrs["good_dates"][0], ds.attrs["good_dates"][1]
+        )
+        ds = ds.isel(time=idx)
+        if len(ds["time"]):
+            print(
+                "good_dates[0] {}, idx {}".format(
+                    ds.attrs["good_dates"][0], describe_indexer(idx)[0]
+                )
+            )
+            print(
+                "good_dates[1] {}, idx {}".format(
+                    ds.attrs["good_dates"][1], describe_indexer(idx)[1]
+                )
+            )
 
         histtext = "Data clipped using good_dates of {}. ".format(
             ds.attrs["good_dates"]
@@ -103,7 +120,13 @@ def clip_ds(ds, wvs=False):
     elif "Deployment_date" in ds.attrs and "Recovery_date" in ds.attrs:
         # we clip by the times in/out of water as specified in the metadata
         print("Clipping data using Deployment_date and Recovery_date")
-        ds = ds.sel(time=slice(ds.attrs["Deployment_date"], ds.attrs["Recovery_date"]))
+        ds = ds.isel(
+            time=time_indexer(
+                ds["time"].values,
+                ds.attrs["Deployment_date"],
+                ds.attrs["Recovery_date"],
+            )
+        )
 
         histtext = (
             "Data clipped using Deployment_date of {} and " "Recovery_date of {}. "
@@ -129,10 +152,72 @@ def clip_ds(ds, wvs=False):
     return ds
 
 
+def date_bounds(date):
+    """
+    Return the first and last time covered by a date from the metadata, as
+    numpy datetime64. Like pandas partial string indexing, a string such as
+    "2016-10-21" covers the whole day.
+    """
+
+    if isinstance(date, str):
+        p = pd.Period(date)
+        first, last = p.start_time, p.end_time
+    else:
+        first = last = pd.Timestamp(date)
+
+    return first.to_datetime64(), last.to_datetime64()
+
+
+def time_indexer(time, start, stop):
+    """
+    Return an indexer for the times between the start and stop dates,
+    inclusive. For sorted times, as is almost always the case, this is a slice
+    found by binary search; otherwise it is an array of indices.
+    """
+
+    first = date_bounds(start)[0]
+    last = date_bounds(stop)[1]
+
+    if np.all(time[1:] >= time[:-1]):
+        return slice(
+            np.searchsorted(time, first, side="left"),
+            np.searchsorted(time, last, side="right"),
+        )
+    else:
+        return np.flatnonzero((time >= first) & (time <= last))
+
+
+def describe_indexer(idx):
+    """Return the first and last index selected by a slice or index array"""
+
+    if isinstance(idx, slice):
+        return idx.start, idx.stop - 1
+    else:
+        return idx.min(), idx.max()
+
+
+@monitor.timed
+def open_clipped_dataset(filename, wvs=False):
+    """
+    Open a raw .cdf file lazily, clip it with clip_ds and load only the
+    clipped data into memory, in the working precision (see
+    to_working_precision). Samples collected before deployment or after
+    recovery are never read from disk.
+    """
+
+    with xr.open_dataset(filename, engine=store_engine(filename)) as ds:
+        return to_working_precision(clip_ds(ds, wvs=wvs)).load()
+
+
+@monitor.timed
 def add_min_max(ds):
     """
     Add minimum and maximum values to variables in NC or CDF files
     This function assumes the data are in xarray DataArrays within Datasets
+
+    Minimum and maximum are computed together in a single pass over each
+    variable, ignoring NaNs. Chunked (dask) variables are reduced lazily and
+    computed together at the end.
     """
 
     exclude = list(ds.dims)
@@ -141,20 +226,78 @@ def add_min_max(ds):
 
     alloweddims = ["time", "sample", "depth"]
 
+    lazy = {}
+
     for k in ds.variables:
         if k not in exclude:
-            kwargs = {"dim": tuple(d for d in alloweddims if d in ds[k].dims)}
+            dims = tuple(d for d in alloweddims if d in ds[k].dims)
+
+            if ds[k].chunks is not None:
+                lazy[k] = (ds[k].min(dim=dims), ds[k].max(dim=dims))
+                continue
+
+            if np.issubdtype(ds[k].dtype, np.number) and ds[k].size:
+                axis = tuple(ds[k].get_axis_num(d) for d in dims)
+                mn, mx = nanminmax(ds[k].values, axis=axis)
+            else:
+                mn = ds[k].min(dim=dims).values
+                mx = ds[k].max(dim=dims).values
 
             ds[k].attrs.update(
                 {
-                    "minimum": ds[k].min(**kwargs).squeeze().values,
-                    "maximum": ds[k].max(**kwargs).squeeze().values,
+                    "minimum": np.asarray(mn).squeeze(),
+                    "maximum": np.asarray(mx).squeeze(),
                 }
             )
 
+    if lazy:
+        import dask
+
+        (computed,) = dask.compute(lazy)
+        for k, (mn, mx) in computed.items():
+            ds[k].attrs.update(
+                {"minimum": mn.squeeze().values, "maximum": mx.squeeze().values}
+            )
+
     return ds
 
 
+def nanminmax(a, axis=None, blocksize=2**16):
+    """
+    Return the minimum and maximum of a numpy array along axis, ignoring
+    NaNs.
+
+    The array is processed in blocks of about blocksize elements along the
+    first reduced axis, and both reductions are applied to each block while
+    it is in cache, so the data are only read from memory once and no
+    temporary copies are made.
+    """
+
+    if axis is None:
+        axis = tuple(range(a.ndim))
+    elif np.ndim(axis) == 0:
+        axis = (axis,)
+
+    if not axis:
+        return a, a
+
+    ax0 = axis[0]
+    step = max(1, blocksize * a.shape[ax0] // a.size)
+
+    mn = mx = None
+    for i in range(0, a.shape[ax0], step):
+        block = a[(slice(None),) * ax0 + (slice(i, i + step),)]
+        bmn = np.fmin.reduce(block, axis=axis)
+        bmx = np.fmax.reduce(block, axis=axis)
+        if mn is None:
+            mn, mx = bmn, bmx
+        else:
+            mn = np.fmin(mn, bmn)
+            mx = np.fmax(mx, bmx)
+
+    return mn, mx
+
+
 def insert_history(ds, histtext):
     if "history" in ds.attrs:
         ds.attrs["history"] = histtext + ds.attrs["history"]
@@ -517,6 +660,448 @@ def set_var_dtype(ds, var, dtype="float32"):
     return ds
 
 
+def working_precision(attrs):
+    """
+    Return the floating point precision data are processed in, "float64"
+    (the default) or "float32", from working_precision in attrs (usually
+    from the instrument configuration file)
+    """
+
+    prec = attrs.get("working_precision", "float64")
+    if prec not in ["float64", "float32"]:
+        raise ValueError(
+            "working_precision must be float64 or float32, not {}".format(prec)
+        )
+
+    return prec
+
+
+def to_working_precision(ds):
+    """
+    Cast float64 data variables to float32 if the working precision of ds
+    (see working_precision) is float32, halving the memory they use. Most
+    variables are written as float32 anyway. Time variables are left alone
+    and, as the cast is lazy, a lazily opened Dataset is read straight into
+    float32 arrays.
+    """
+
+    if working_precision(ds.attrs) != "float32":
+        return ds
+
+    for var in ds.data_vars:
+        if "time" in var or ds[var].dtype != np.float64:
+            continue
+        encoding = ds[var].encoding
+        ds[var] = ds[var].astype(np.float32)
+        ds[var].encoding = encoding
+
+    return ds
+
+
+def rolling_median(x, kernel_size=5, nan_policy="omit"):
+    """
+    Centered running median of x, along the last axis for 2-D x.
+
+    Uses the skip list rolling median of pandas, which is O(n log k) for n
+    values and a kernel of k points, where scipy.signal.medfilt is O(n k).
+    Away from the ends and from NaNs the result is the same as medfilt.
+
+    Parameters
+    ----------
+    x : array_like
+        1-D array, or 2-D array of rows to filter separately
+    kernel_size : int, optional
+        Odd number of points in the window. Default 5
+    nan_policy : {"omit", "propagate"}, optional
+        "omit" takes the median of the values in each window that are not
+        NaN, so values filled by an earlier trim don't spread; the result is
+        only NaN where all values in the window are. "propagate" gives NaN
+        wherever the window contains a NaN. Default "omit"
+
+    Returns
+    -------
+    numpy.ndarray
+        Running median, in the dtype of x for floating point x
+
+    Notes
+    -----
+    Near the ends the window is shortened to the values available, rather
+    than padded with zeros as medfilt does.
+    """
+
+    x = np.asarray(x)
+    if int(kernel_size) != kernel_size or kernel_size < 1 or kernel_size % 2 == 0:
+        raise ValueError(
+            "kernel_size must be a positive odd integer, not {}".format(kernel_size)
+        )
+    if nan_policy not in ["omit", "propagate"]:
+        raise ValueError(
+            "nan_policy must be omit or propagate, not {}".format(nan_policy)
+        )
+    if x.ndim not in [1, 2]:
+        raise ValueError("x must be 1-D or 2-D, not {}-D".format(x.ndim))
+
+    kernel_size = int(kernel_size)
+    df = pd.DataFrame(x.T)
+    filtered = df.rolling(kernel_size, center=True, min_periods=1).median()
+    filtered = filtered.values.T
+
+    if nan_policy == "propagate":
+        nans = df.isna().rolling(kernel_size, center=True, min_periods=1).sum()
+        filtered = np.where(nans.values.T > 0, np.nan, filtered)
+
+    if x.dtype.kind == "f":
+        filtered = filtered.astype(x.dtype, copy=False)
+
+    return filtered.reshape(x.shape)
+
+
+def burst_matrix(x, spb):
+    """
+    Reshape samples x, collected in bursts of spb samples, into a (burst,
+    sample) array. A partial final burst, as when logging stops mid-burst,
+    is padded with NaN, and the array cast to float if needed to hold them.
+    """
+
+    x = np.asarray(x)
+    nbursts = -(-len(x) // spb)
+    short = nbursts * spb - len(x)
+    if short:
+        dtype = np.result_type(x.dtype, np.float32)
+        x = np.concatenate([x.astype(dtype), np.full(short, np.nan, dtype=dtype)])
+
+    return x.reshape((nbursts, spb))
+
+
+def burst_stats(da, stats=("mean", "std"), dim="sample", calibration=None, ddof=0):
+    """
+    Return statistics of each burst of a burst-sampled variable.
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        Samples, with bursts along dim
+    stats : list of str, optional
+        Statistics to compute: any of "mean", "std", "var", "median", "min",
+        "max", "count" (of valid samples) and "pNN" for the NNth percentile,
+        e.g. "p90". Default ("mean", "std")
+    dim : str, optional
+        Sample dimension. Default "sample"
+    calibration : array_like, optional
+        Polynomial calibration coefficients, highest power first as for
+        numpy.polyval, applied to the samples once before all statistics
+        are computed
+    ddof : int, optional
+        Delta degrees of freedom of std and var. Default 0
+
+    Returns
+    -------
+    dict
+        DataArray of each statistic, keyed by name, with dim removed
+
+    Notes
+    -----
+    NaN samples, such as those padding a partial final burst (see
+    burst_matrix), are ignored, as by the xarray reductions. The mean is
+    computed once and shared by std and var, and the sort behind the median
+    and percentiles is done once for all of them.
+    """
+
+    dims = [d for d in da.dims if d != dim]
+    coords = {k: v for k, v in da.coords.items() if dim not in v.dims}
+    x = da.transpose(*dims, dim).values
+    if calibration is not None:
+        x = np.polyval(calibration, x)
+    if x.dtype.kind != "f":
+        x = x.astype(np.float64)
+
+    valid = ~np.isnan(x)
+    if valid.all():
+        valid = None
+        n = x.shape[-1]
+    else:
+        n = valid.sum(axis=-1)
+        x = np.where(valid, x, 0)
+
+    out = {}
+    with warnings.catch_warnings():
+        # bursts with no valid samples give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+
+        mean = x.sum(axis=-1) / n
+        if "std" in stats or "var" in stats:
+            d = x - mean[..., None]
+            if valid is not None:
+                d[~valid] = 0
+            var = (d * d).sum(axis=-1) / np.maximum(n - ddof, 0)
+
+        qs = {}
+        for name in stats:
+            if name == "median":
+                qs[name] = 50
+            elif name.startswith("p") and name[1:].replace(".", "", 1).isdigit():
+                qs[name] = float(name[1:])
+        if qs:
+            xq = x if valid is None else np.where(valid, x, np.nan)
+            q = np.nanpercentile(xq, list(qs.values()), axis=-1)
+
+        for name in stats:
+            if name == "mean":
+                out[name] = mean
+            elif name == "std":
+                out[name] = np.sqrt(var)
+            elif name == "var":
+                out[name] = var
+            elif name in ["min", "max"]:
+                fill = np.inf if name == "min" else -np.inf
+                xm = x if valid is None else np.where(valid, x, fill)
+                v = xm.min(axis=-1) if name == "min" else xm.max(axis=-1)
+                out[name] = np.where(n > 0, v, np.nan)
+            elif name == "count":
+                out[name] = np.broadcast_to(n, mean.shape).copy()
+            elif name in qs:
+                out[name] = q[list(qs).index(name)]
+            else:
+                raise ValueError("Unknown burst statistic {}".format(name))
+
+    return {k: xr.DataArray(v, dims=dims, coords=coords) for k, v in out.items()}
+
+
+def output_profile(ds, profile=None):
+    """
+    Return the netCDF output settings for a Dataset, or None if no output
+    profile is used and files are written with the defaults of each writer.
+
+    Settings are read from the nc_* global attributes, which usually come
+    from the instrument configuration file, and can be overridden by the
+    nc_* entries of the profile dict, usually the parsed command line
+    arguments (see cmd.ncprofilearg):
+
+    nc_profile : "timeseries" or "burst"
+        Write compressed NETCDF4 files. timeseries uses chunks of about 1 MB
+        spanning many time steps; burst uses one burst per chunk for
+        variables with a sample dimension, so single bursts can be read
+        quickly
+    nc_complevel : int
+        zlib compression level, 1 to 9. Default 4
+    nc_shuffle : int
+        1 to apply the HDF5 shuffle filter before compression, 0 otherwise.
+        Default 1
+    nc_chunk_time : int
+        Number of time steps per chunk for all variables, overriding the
+        profile
+    nc_pack_velocity : "int16"
+        Pack velocities as int16 with a scale_factor suited to their units
+    """
+
+    settings = nc_settings(ds.attrs, profile)
+
+    if "nc_profile" not in settings:
+        return None
+
+    if settings["nc_profile"] not in ["timeseries", "burst"]:
+        raise ValueError(
+            "nc_profile must be timeseries or burst, not {}".format(
+                settings["nc_profile"]
+            )
+        )
+
+    settings.setdefault("nc_complevel", 4)
+    settings.setdefault("nc_shuffle", 1)
+
+    return settings
+
+
+def nc_settings(attrs, profile=None):
+    """
+    Collect the nc_* output settings from attrs, overridden by those in
+    profile, ignoring unset (None) values
+    """
+
+    settings = {k: v for k, v in attrs.items() if k.startswith("nc_") and v is not None}
+    if profile is not None:
+        settings.update(
+            {k: v for k, v in profile.items() if k.startswith("nc_") and v is not None}
+        )
+
+    return settings
+
+
+def get_store_format(attrs, profile=None):
+    """
+    Return the storage format for output files, "netcdf" (the default) or
+    "zarr", from store_format in attrs (usually from the instrument
+    configuration file) or in profile (usually the command line)
+    """
+
+    fmt = attrs.get("store_format")
+    if profile is not None and profile.get("store_format") is not None:
+        fmt = profile["store_format"]
+
+    if fmt is None:
+        return "netcdf"
+    elif fmt not in ["netcdf", "zarr"]:
+        raise ValueError("store_format must be netcdf or zarr, not {}".format(fmt))
+
+    return fmt
+
+
+def store_path(filename, attrs, profile=None):
+    """
+    Return the path an output file is written to: filename for netCDF, or
+    filename with a .zarr extension in place of .nc or .cdf for Zarr stores
+    """
+
+    if get_store_format(attrs, profile) == "zarr":
+        return os.path.splitext(filename)[0] + ".zarr"
+    else:
+        return filename
+
+
+def store_engine(filename):
+    """
+    Return the xarray engine for reading an output file: "zarr" for Zarr
+    stores, otherwise None to let xarray choose a netCDF engine
+    """
+
+    if os.path.splitext(os.path.normpath(filename))[1] == ".zarr":
+        return "zarr"
+    else:
+        return None
+
+
+def nc_encoding(ds, settings, encoding=None, zarr=False):
+    """
+    Build the to_netcdf (or to_zarr) encoding for all variables in a Dataset
+    from output_profile settings, keeping dtype and _FillValue already set in
+    the variable encodings. Entries in encoding take precedence.
+
+    Zarr stores are chunked along time in chunks of about 4 MB, which suit
+    parallel reads, and use the default Zarr compressor.
+    """
+
+    keep = ["dtype", "_FillValue", "units", "calendar", "scale_factor", "add_offset"]
+    # scale factors giving a resolution of 0.1 mm/s
+    velscale = {
+        "m s-1": 1e-4,
+        "m/s": 1e-4,
+        "cm s-1": 1e-2,
+        "cm/s": 1e-2,
+        "mm s-1": 1e-1,
+        "mm/s": 1e-1,
+    }
+
+    enc = {}
+    for k in ds.variables:
+        var = ds[k].variable
+        enc[k] = {x: var.encoding[x] for x in keep if x in var.encoding}
+        if zarr and enc[k].get("_FillValue", 0) is None:
+            # the Zarr backend only accepts an unset fill value as a default
+            del enc[k]["_FillValue"]
+
+        # leave dimension coordinates and strings alone
+        if var.dims == (k,) or var.ndim == 0 or var.dtype.kind not in "iufcM":
+            continue
+
+        if not zarr:
+            enc[k].update(
+                {
+                    "zlib": True,
+                    "complevel": int(settings["nc_complevel"]),
+                    "shuffle": bool(int(settings["nc_shuffle"])),
+                }
+            )
+
+        chunks = list(var.shape)
+        if "time" in var.dims and var.shape[var.dims.index("time")]:
+            i = var.dims.index("time")
+            if "nc_chunk_time" in settings:
+                ntime = int(settings["nc_chunk_time"])
+            elif (
+                not zarr and settings["nc_profile"] == "burst" and "sample" in var.dims
+            ):
+                ntime = 1
+            else:
+                # about 1 MB (netCDF) or 4 MB (Zarr) per chunk
+                target = 2**22 if zarr else 2**20
+                ntime = target // max(1, var.dtype.itemsize * var.size // chunks[i])
+            if zarr:
+                # Zarr chunks may extend past the data, leaving room to append
+                chunks[i] = max(1, ntime)
+            else:
+                chunks[i] = max(1, min(ntime, chunks[i]))
+        if all(chunks):
+            enc[k]["chunks" if zarr else "chunksizes"] = tuple(chunks)
+
+        if (
+            settings.get("nc_pack_velocity") == "int16"
+            and var.attrs.get("units") in velscale
+            and var.dtype.kind == "f"
+        ):
+            scale = velscale[var.attrs["units"]]
+            vmax = np.nanmax(np.abs(var.values)) if var.size else 0
+            if vmax < 32767 * scale:
+                enc[k].update(
+                    {"dtype": "int16", "scale_factor": scale, "_FillValue": -32768}
+                )
+                enc[k].pop("add_offset", None)
+            else:
+                print(
+                    "Not packing {} as int16; values exceed the range "
+                    "of the scale factor {}".format(k, scale)
+                )
+
+    if encoding is not None:
+        for k in encoding:
+            enc.setdefault(k, {}).update(encoding[k])
+
+    return enc
+
+
+@monitor.timed
+def write_nc(
+    ds, filename, profile=None, format=None, encoding=None, raw=False, **kwargs
+):
+    """
+    Write a Dataset to netCDF, using the output profile from the nc_*
+    attributes or profile if one is given (see output_profile). Otherwise the
+    file is written as before, using format and encoding.
+
+    If store_format is "zarr" (see get_store_format) a Zarr store is written
+    instead, with the same variables and attributes, at the path given by
+    store_path.
+
+    Raw files (raw=True) are never compressed or packed with the output
+    profile; they only follow store_format.
+    """
+
+    if get_store_format(ds.attrs, profile) == "zarr":
+        settings = {} if raw else nc_settings(ds.attrs, profile)
+        path = store_path(filename, ds.attrs, profile)
+        print("Writing Zarr store", path)
+        ds.to_zarr(
+            path, mode="w", encoding=nc_encoding(ds, settings, encoding, zarr=True)
+        )
+        return
+
+    settings = None if raw else output_profile(ds, profile)
+
+    if settings is None:
+        ds.to_netcdf(filename, format=format, encoding=encoding, **kwargs)
+    else:
+        print(
+            "Writing compressed NETCDF4 file with {} chunking".format(
+                settings["nc_profile"]
+            )
+        )
+        ds.to_netcdf(
+            filename,
+            format="NETCDF4",
+            encoding=nc_encoding(ds, settings, encoding=encoding),
+            **kwargs
+        )
+
+
 def rename_time(ds):
     """
     Rename time variables for EPIC compliance, keeping a time_cf coorindate.
@@ -536,22 +1121,53 @@ def rename_time(ds):
     return ds
 
 
+def ds_rename_time_2d(ds):
+    """
+    Rename time variables of a burst Dataset for EPIC compliance before it is
+    written, keeping a time_cf variable. The 1-D CF time becomes time_cf and
+    the 2-D EPIC times become time and time2 on the (time, sample)
+    dimensions, so the file is written in a single pass.
+    """
+
+    if is_cf(ds):
+        print("not renaming 2D time because CF==1.6")
+        return ds
+
+    ds = ds.drop_indexes("time").rename_vars(
+        {"time": "time_cf", "epic_time_2d": "time", "epic_time2_2d": "time2"}
+    )
+    # keep these as data variables so no coordinates attributes are written
+    ds = ds.reset_coords([k for k in ["time_cf", "time", "time2"] if k in ds.coords])
+
+    return ds
+
+
 def rename_time_2d(nc_filename, ds):
+    """
+    Rename time variables of a burst file that has already been written to
+    nc_filename, as ds_rename_time_2d does, by rewriting the file.
+
+    Deprecated: apply ds_rename_time_2d to the Dataset before writing it
+    instead, which writes the file once.
+    """
+
+    warnings.warn(
+        "rename_time_2d is deprecated; apply ds_rename_time_2d before writing",
+        DeprecationWarning,
+    )
+
     if is_cf(ds):
         print("not renaming 2D time because CF==1.6")
-        pass
-    else:
-        # Need to do this in two steps after renaming the variable.
-        # Not sure why, but it works this way.
-        with netCDF4.Dataset(nc_filename, "r+") as nc:
-            nc.renameVariable("time", "time_cf")
-            # nc.renameVariable('time_2d', 'time_cf_2d')
-            timebak = nc["epic_time_2d"][:]
-            nc.renameVariable("epic_time_2d", "time")
-            nc.renameVariable("epic_time2_2d", "time2")
+        return
+
+    with netCDF4.Dataset(nc_filename) as nc:
+        fmt = nc.data_model.replace("_OFFSET", "")
 
-        with netCDF4.Dataset(nc_filename, "r+") as nc:
-            nc["time"][:] = timebak
+    with xr.open_dataset(nc_filename, decode_times=False) as f:
+        unlimited_dims = f.encoding.get("unlimited_dims", None)
+        renamed = ds_rename_time_2d(f.load())
+
+    renamed.to_netcdf(nc_filename, format=fmt, unlimited_dims=unlimited_dims)
 
 
 def open_time_2d_dataset(filename):
@@ -559,16 +1175,21 @@ def open_time_2d_dataset(filename):
     # to coordinates and variables with the same name, otherwise it raises a
     # MissingDimensionsError
     # Check if CF or not, and return the correct dataset
-    with xr.open_dataset(filename, decode_times=False, drop_variables="time") as ds:
+    engine = store_engine(filename)
+    with xr.open_dataset(
+        filename, engine=engine, decode_times=False, drop_variables="time"
+    ) as ds:
         if is_cf(ds):
             iscf = True
         else:
             iscf = False
 
     if iscf:
-        return xr.open_dataset(filename)
+        return xr.open_dataset(filename, engine=engine)
     else:
-        return xr.open_dataset(filename, decode_times=False, drop_variables="time")
+        return xr.open_dataset(
+            filename, engine=engine, decode_times=False, drop_variables="time"
+        )
 
 
 def epic_to_cf_time(ds):
@@ -612,13 +1233,39 @@ def make_epic_time2(jd):
     return np.round((jd - np.floor(jd)) * 86400000).astype(np.int32)
 
 
+def datetime_to_epic(time):
+    """
+    Convert datetime64 values to EPIC time (true Julian day) and time2
+    (milliseconds since 0000 GMT) using integer arithmetic on milliseconds
+    since 1970-01-01.
+
+    Only elementwise operations are used, so time may be a numpy array, a
+    chunked (dask) array or an xarray DataArray of any shape.
+
+    Returns
+    -------
+    tuple
+        (epic_time, epic_time2) as int32
+    """
+
+    # round to the nearest millisecond
+    ms = (time.astype("datetime64[ns]").astype(np.int64) + 500000) // 1000000
+    days = ms // 86400000
+
+    # 1970-01-01 is true Julian day 2440588
+    epic_time = (days + 2440588).astype(np.int32)
+    epic_time2 = (ms - days * 86400000).astype(np.int32)
+
+    return epic_time, epic_time2
+
+
 def create_epic_times(ds, waves=False):
-    jd = make_jd(ds["time"].to_dataframe().index)
+    epic_time, epic_time2 = datetime_to_epic(ds["time"].values)
 
-    ds["epic_time"] = xr.DataArray(make_epic_time(jd), dims="time")
+    ds["epic_time"] = xr.DataArray(epic_time, dims="time")
     ds["epic_time"].encoding["_FillValue"] = None
 
-    ds["epic_time2"] = xr.DataArray(make_epic_time2(jd), dims="time")
+    ds["epic_time2"] = xr.DataArray(epic_time2, dims="time")
     ds["epic_time2"].encoding["_FillValue"] = None
 
     return ds
@@ -626,26 +1273,24 @@ def create_epic_times(ds, waves=False):
 
 def create_2d_time(ds):
     print("Creating 2D time variable")
-    # time increment in milliseconds
-    td = ds.attrs["sample_interval"] * np.arange(ds.attrs["samples_per_burst"]) * 1000
-
-    # time_2d is a CF representation of a 2d time
-    ds["time_2d"] = xr.DataArray(
-        np.expand_dims(ds["time"], 1) + [np.timedelta64(int(x), "ms") for x in td],
-        dims=("time", "sample"),
+    # time increment in whole milliseconds
+    td = (
+        (ds.attrs["sample_interval"] * np.arange(ds.attrs["samples_per_burst"]) * 1000)
+        .astype(np.int64)
+        .astype("timedelta64[ms]")
     )
 
-    raveljd = make_jd(pd.DatetimeIndex(np.ravel(ds["time_2d"])))
-    jd_2d = np.reshape(raveljd, ds["time_2d"].shape)
+    # CF representation of a 2d time, broadcast from time and sample offsets
+    time_2d = np.expand_dims(ds["time"].values, 1) + td
 
-    ds["epic_time_2d"] = xr.DataArray(make_epic_time(jd_2d), dims=("time", "sample"))
+    epic_time, epic_time2 = datetime_to_epic(time_2d)
+
+    ds["epic_time_2d"] = xr.DataArray(epic_time, dims=("time", "sample"))
     ds["epic_time_2d"].encoding["_FillValue"] = None
 
-    ds["epic_time2_2d"] = xr.DataArray(make_epic_time2(jd_2d), dims=("time", "sample"))
+    ds["epic_time2_2d"] = xr.DataArray(epic_time2, dims=("time", "sample"))
     ds["epic_time2_2d"].encoding["_FillValue"] = None
 
-    ds = ds.drop("time_2d")  # don't need it anymore
-
     return ds
 
 
@@ -665,15 +1310,24 @@ def add_start_stop_time(ds):
 def add_lat_lon(ds, var):
     """Add lat and lon dimensions"""
 
-    ds[var] = xr.concat([ds[var]], dim=ds["lon"])
-    ds[var] = xr.concat([ds[var]], dim=ds["lat"])
+    return add_singleton_dims(ds, [var], ["lat", "lon"])
 
-    # Reorder so lat, lon are at the end.
-    dims = [d for d in ds[var].dims if (d != "lon") and (d != "lat")]
-    dims.extend(["lat", "lon"])
-    dims = tuple(dims)
 
-    ds[var] = ds[var].transpose(*dims)
+def add_singleton_dims(ds, variables, dims=("lat", "lon")):
+    """
+    Add singleton dimensions, such as lat and lon, or lat, lon and depth,
+    to the end of each of variables, in the given order.
+
+    The dimensions must already be in ds with length 1. The expanded
+    variables are views of the original data, so no data are copied.
+    Attributes and encoding are kept.
+    """
+
+    for var in variables:
+        v = ds[var].variable
+        # Reorder so the new dimensions are at the end.
+        newdims = tuple(d for d in v.dims if d not in dims) + tuple(dims)
+        ds[var] = v.set_dims(newdims)
 
     return ds
 
@@ -866,16 +1520,7 @@ def no_p_create_depth(ds):
 
 def no_p_add_depth(ds, var):
     # no_p = no pressure sensor. also use for exo
-    ds[var] = xr.concat([ds[var]], dim=ds["depth"])
-
-    # Reorder so lat, lon are at the end.
-    dims = [d for d in ds[var].dims if (d != "depth")]
-    dims.extend(["depth"])
-    dims = tuple(dims)
-
-    ds[var] = ds[var].transpose(*dims)
-
-    return ds
+    return add_singleton_dims(ds, [var], ["depth"])
 
 
 def insert_note(ds, var, notetxt):
@@ -984,6 +1629,98 @@ def read_samplingrates_continuous(ds, conn):
     return ds
 
 
+def footer_offset(filnam, skipfooter):
+    """
+    Return the byte offset of the start of the last skipfooter lines of a
+    text file, reading only as much of the end of the file as needed.
+
+    Lines end with LF, CR LF or CR, as in Python's universal newlines mode,
+    and blank lines count, as with the skipfooter option of pandas.read_csv.
+    """
+
+    size = os.path.getsize(filnam)
+    if skipfooter <= 0:
+        return size
+
+    chunk = 65536
+    with open(filnam, "rb") as f:
+        while True:
+            start = max(size - chunk, 0)
+            f.seek(start)
+            tail = np.frombuffer(f.read(), dtype=np.uint8)
+
+            lf = tail == ord("\n")
+            # a \r not followed by \n also ends a line
+            cr = tail == ord("\r")
+            cr[:-1] &= ~lf[1:]
+            starts = np.flatnonzero(lf | cr) + 1 + start
+            # a line ending at the end of the file doesn't start another one
+            starts = starts[starts < size]
+            if start == 0:
+                starts = np.concatenate([[0], starts])
+
+            if len(starts) >= skipfooter:
+                return int(starts[-skipfooter])
+            if start == 0:
+                return 0
+            chunk *= 4
+
+
+def read_csv_skipfooter(filnam, skipfooter=0, **kwargs):
+    """
+    Read a CSV file with pandas.read_csv, less its last skipfooter lines.
+
+    pandas only supports skipfooter with its slow Python engine, which parses
+    line by line, so the footer is found from the end of the file (see
+    footer_offset) and the rest is given to the C engine instead. The
+    DataFrame is the same as that read with skipfooter by the Python engine.
+    Other keyword arguments are passed to pandas.read_csv.
+    """
+
+    with open(filnam, "rb") as f:
+        data = f.read(footer_offset(filnam, skipfooter))
+
+    # translate line endings as the Python engine does, as the C engine
+    # miscounts skiprows over blank lines ending with a bare \r
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+    return pd.read_csv(io.BytesIO(data), **kwargs)
+
+
+def combine_date_time(dates, times, datefmt=None, timefmt=None):
+    """
+    Return the times given by a column of dates and a column of times of
+    day, as a datetime64 Series.
+
+    Records have few distinct dates and, at high sample rates, few distinct
+    times of day compared with their length, so each distinct value is
+    parsed once and the results added, which is much faster than parsing
+    the combined strings. datefmt and timefmt are strftime formats; if None,
+    the format is inferred from the first value, as pandas.to_datetime does.
+    Raises ValueError if a value cannot be parsed.
+    """
+
+    dcodes, duniques = pd.factorize(dates.astype(str))
+    tcodes, tuniques = pd.factorize(times.astype(str))
+
+    days = pd.to_datetime(duniques, format=datefmt).values
+    clock = None
+    if timefmt is None:
+        # pandas can't infer the format of times without dates, and would
+        # parse each with dateutil, so times like 13:45:00 are read as
+        # durations where possible
+        try:
+            clock = pd.to_timedelta(tuniques).values
+        except ValueError:
+            pass
+    if clock is None:
+        clock = pd.to_datetime(tuniques, format=timefmt)
+        clock = (clock - clock.normalize()).values
+
+    return pd.Series(days[dcodes] + clock[tcodes], index=dates.index)
+
+
 def read_globalatts(fname):
     """
     Read global attributes file (glob_attxxxx.txt) and create metadata
@@ -1016,24 +1753,74 @@ def str2num(s):
         return s
 
 
-def loadmat(filename):
+def loadmat(filename, variable_names=None):
     """
     this function should be called instead of direct spio.loadmat
     as it cures the problem of not properly recovering python dictionaries
     from mat files. It calls the function check keys to cure all entries
-    which are still mat-objects
+    which are still mat-objects. If variable_names is given, only those
+    variables are read.
 
     from: `StackOverflow <https://stackoverflow.com/q/7008608>`_
     """
-    data = spio.loadmat(filename, struct_as_record=False, squeeze_me=True)
+    import scipy.io as spio
+
+    data = spio.loadmat(
+        filename, struct_as_record=False, squeeze_me=True, variable_names=variable_names
+    )
     return _check_keys(data)
 
 
+def is_mat73(filename):
+    """
+    Return True if filename is a MATLAB v7.3 .mat file. These are HDF5
+    files, which scipy.io.loadmat can't read, with a 512 byte header
+    """
+
+    with open(filename, "rb") as f:
+        f.seek(512)
+        return f.read(8) == b"\x89HDF\r\n\x1a\n"
+
+
+def read_mat73(obj, rows=None):
+    """
+    Return a variable of a MATLAB v7.3 .mat file opened with h5py, as
+    loadmat returns it: arrays squeezed, with scalars as Python scalars,
+    char arrays as str and structs as dicts. If rows is given, only the
+    first rows rows of an array are read from disk.
+    """
+    import h5py
+
+    if isinstance(obj, h5py.Group):
+        return {k: read_mat73(obj[k]) for k in obj if not k.startswith("#")}
+
+    mclass = obj.attrs.get("MATLAB_class", b"")
+    if isinstance(mclass, bytes):
+        mclass = mclass.decode()
+    if obj.attrs.get("MATLAB_empty", 0):
+        return "" if mclass == "char" else np.array([])
+
+    # MATLAB arrays are column-major, so their dimensions are reversed in
+    # HDF5 and rows are along the last axis
+    data = obj[()] if rows is None else obj[..., :rows]
+    data = np.asarray(data).T
+
+    if mclass == "char":
+        return "".join(chr(c) for c in data.ravel())
+    if mclass == "logical":
+        data = data.astype(bool)
+
+    data = np.squeeze(data)
+    return data.item() if data.ndim == 0 else data
+
+
 def _check_keys(dic):
     """
     checks if entries in dictionary are mat-objects. If yes
     todict is called to change them to nested dictionaries
     """
+    import scipy.io as spio
+
     for key in dic:
         if isinstance(dic[key], spio.matlab.mio5_params.mat_struct):
             dic[key] = _todict(dic[key])
@@ -1044,6 +1831,8 @@ def _todict(matobj):
     """
     A recursive function which constructs from matobjects nested dictionaries
     """
+    import scipy.io as spio
+
     dic = {}
     for strg in matobj._fieldnames:
         elem = matobj.__dict__[strg]
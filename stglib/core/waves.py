@@ -1,11 +1,12 @@
 from __future__ import division, print_function
 
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.signal as spsig
 import xarray as xr
 
+from . import monitor
 
+
+@monitor.timed
 def make_waves_ds(ds, noise=0.75):
 
     print("Computing waves statistics")
@@ -60,7 +61,7 @@ def make_waves_ds(ds, noise=0.75):
     return spec
 
 
-def pressure_spectra(x, fs=1.0, window="hanning", nperseg=256, **kwargs):
+def pressure_spectra(x, fs=1.0, window="hann", nperseg=256, **kwargs):
     """Compute pressure spectral density using Welch's method
 
     Parameters
@@ -70,7 +71,7 @@ def pressure_spectra(x, fs=1.0, window="hanning", nperseg=256, **kwargs):
     fs : float, optional
         Sampling frequency (Hz)
     window : str, optional
-        Window, default 'hanning'
+        Window, default 'hann'
     nperseg : int, optional
         Length of each segment, default 256
     **kwargs
@@ -83,6 +84,8 @@ def pressure_spectra(x, fs=1.0, window="hanning", nperseg=256, **kwargs):
     Pxx : ndarray
         Power spectral density of pressure data
     """
+    import scipy.signal as spsig
+
     f, Pxx = spsig.welch(x, fs=fs, window=window, nperseg=nperseg, **kwargs)
     return f, Pxx
 
@@ -385,6 +388,8 @@ def puv_quick(
     puvq.m also had contributions from Laura Landerman and Patrick Dickudt
     """
 
+    import scipy.signal as spsig
+
     gravity = 9.81  # m/s^2
     if fft_window_type == "hanning":
         fft_window_type = "hann"  # this is just the way scipy signal likes it
@@ -620,6 +625,8 @@ def plot_spectra(
     :return:  figure and axis handles
     """
 
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(2, 1, figsize=(15, 5))
     ax[0].plot(frequencies, Guv, label="Guv")
     ax[0].plot(frequencies, Guu, label="Guu")
@@ -3,11 +3,9 @@ from __future__ import division, print_function
 import warnings
 
 import numpy as np
-import pandas as pd
 import xarray as xr
 
-from . import exo
-from .core import utils
+from .core import monitor, rules, utils
 
 
 def read_par(filnam, spb=False, skiprows=None, skipfooter=0):
@@ -68,24 +66,25 @@ def read_ntu(filnam, spb=False, skiprows=None, skipfooter=0):
 
 def read_eco_csv(filnam, names, skiprows=None, skipfooter=0):
 
-    return pd.read_csv(
-        filnam,
-        sep="\t",
-        names=names,
-        parse_dates=[["date", "time"]],
-        infer_datetime_format=True,
-        engine="python",
-        skiprows=skiprows,
-        skipfooter=skipfooter,
+    # the footer is removed before parsing, so the fast C engine can be used
+    df = utils.read_csv_skipfooter(
+        filnam, skipfooter=skipfooter, sep="\t", names=names, skiprows=skiprows
     )
 
+    # as parse_dates=[["date", "time"]], but parsing each distinct date and
+    # time of day once
+    df.insert(0, "date_time", utils.combine_date_time(df["date"], df["time"]))
+
+    return df.drop(columns=["date", "time"])
+
 
 def eco_pd_to_xr(df, spb=False):
 
     if spb:
-        # get middle time
-        times = df["date_time"].values.reshape((-1, spb))[:, int(spb / 2)]
-        counts = df["counts"].values.reshape((-1, spb))
+        # get middle time, or the last time of a partial final burst
+        counts = utils.burst_matrix(df["counts"].values, spb)
+        mid = np.arange(len(counts)) * spb + int(spb / 2)
+        times = df["date_time"].values[np.minimum(mid, len(df) - 1)]
         sample = range(spb)
 
         ds = xr.Dataset(
@@ -104,6 +103,7 @@ def eco_pd_to_xr(df, spb=False):
     return ds
 
 
+@monitor.timed
 def csv_to_cdf(metadata):
     """
     Process ECO .csv file to a raw .cdf file
@@ -139,20 +139,21 @@ def csv_to_cdf(metadata):
     # configure file
     cdf_filename = ds.attrs["filename"] + "-raw.cdf"
 
-    ds.to_netcdf(cdf_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, cdf_filename, raw=True, unlimited_dims=["time"])
 
     print("Finished writing data to %s" % cdf_filename)
 
     return ds
 
 
-def cdf_to_nc(cdf_filename, atmpres=False):
+@monitor.timed
+def cdf_to_nc(cdf_filename, atmpres=False, profile=None):
     """
     Load a "raw" .cdf file and generate a processed .nc file
     """
 
     # Load raw .cdf data
-    ds = xr.open_dataset(cdf_filename)
+    ds = utils.to_working_precision(xr.open_dataset(cdf_filename))
 
     # definition of PAR is
     # PAR = Im * 10 ^ ((x-a0)/a1)
@@ -167,24 +168,25 @@ def cdf_to_nc(cdf_filename, atmpres=False):
     # https://www.seabird.com/asset-get.download.jsa?id=54627862518
 
     if "par" in ds.attrs["INST_TYPE"].lower():
+        stats = utils.burst_stats(ds["counts"], ["mean"])
         ds["PAR_905"] = ds.attrs["Im"] * 10 ** (
-            (ds["counts"].mean(dim="sample") - ds.attrs["a0"]) / ds.attrs["a1"]
+            (stats["mean"] - ds.attrs["a0"]) / ds.attrs["a1"]
         )
         ds["PAR_905"].attrs["units"] = "umol m-2 s-1"
         ds["PAR_905"].attrs["long_name"] = "Photosynthetically active " "radiation"
 
     if "ntu" in ds.attrs["INST_TYPE"].lower():
         if "user_ntucal_coeffs" in ds.attrs:
-            ds["Turb"] = xr.DataArray(
-                np.polyval(ds.attrs["user_ntucal_coeffs"], ds["counts"]),
-                dims=["time", "sample"],
-            ).mean(dim="sample")
+            # calibrate the samples once for both statistics
+            stats = utils.burst_stats(
+                ds["counts"],
+                ["mean", "std"],
+                calibration=ds.attrs["user_ntucal_coeffs"],
+            )
+            ds["Turb"] = stats["mean"]
             ds["Turb"].attrs["units"] = "NTU"
             ds["Turb"].attrs["long_name"] = "Turbidity"
-            ds["Turb_std"] = xr.DataArray(
-                np.polyval(ds.attrs["user_ntucal_coeffs"], ds["counts"]),
-                dims=["time", "sample"],
-            ).std(dim="sample")
+            ds["Turb_std"] = stats["std"]
             ds["Turb_std"].attrs["units"] = "NTU"
             ds["Turb_std"].attrs["long_name"] = "Turbidity burst standard " "deviation"
 
@@ -211,13 +213,12 @@ def cdf_to_nc(cdf_filename, atmpres=False):
 
     ds = utils.no_p_create_depth(ds)
 
-    # add lat/lon coordinates to each variable
-    for var in ds.variables:
-        if (var not in ds.coords) and ("time" not in var):
-            ds = utils.add_lat_lon(ds, var)
-            ds = utils.no_p_add_depth(ds, var)
-            # cast as float32
-            ds = utils.set_var_dtype(ds, var)
+    # add lat/lon/depth coordinates to each variable
+    datavars = [var for var in ds.data_vars if "time" not in var]
+    ds = utils.add_singleton_dims(ds, datavars, ["lat", "lon", "depth"])
+    for var in datavars:
+        # cast as float32
+        ds = utils.set_var_dtype(ds, var)
 
     ds = utils.rename_time(ds)
 
@@ -225,7 +226,7 @@ def cdf_to_nc(cdf_filename, atmpres=False):
     print("Writing cleaned/trimmed data to .nc file")
     nc_filename = ds.attrs["filename"] + "-a.nc"
 
-    ds.to_netcdf(nc_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, nc_filename, profile=profile, unlimited_dims=["time"])
     print("Done writing netCDF file", nc_filename)
 
 
@@ -275,39 +276,11 @@ def ds_add_attrs(ds):
 def eco_qaqc(ds):
     # QA/QC ECO data
     if "ntu" in ds.attrs["INST_TYPE"].lower():
-        for var in ["Turb"]:
-            ds = trim_max_std(ds, var)
-
-            ds = exo.trim_min(ds, var)
-
-            ds = exo.trim_max(ds, var)
-
-            ds = exo.trim_min_diff(ds, var)
-
-            ds = exo.trim_max_diff(ds, var)
-
-            ds = exo.trim_med_diff(ds, var)
-
-            ds = exo.trim_med_diff_pct(ds, var)
-
-            ds = exo.trim_bad_ens(ds, var)
+        # as trim_max_std(), exo.trim_min(), ..., exo.trim_bad_ens()
+        ds = rules.apply_rules(ds, ["Turb"], rules.ECO_RULES)
 
     return ds
 
 
 def trim_max_std(ds, var):
-    if var + "_std_max" in ds.attrs:
-        print(
-            "%s: Trimming using maximum standard deviation of %f"
-            % (var, ds.attrs[var + "_std_max"])
-        )
-        ds[var][ds["Turb_std"] > ds.attrs[var + "_std_max"]] = np.nan
-
-        notetxt = (
-            "Values filled where standard deviation greater than %f "
-            "units. " % ds.attrs[var + "_std_max"]
-        )
-
-        ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["std_max"])
@@ -1,19 +1,27 @@
 from __future__ import division, print_function
 
+import csv
+import io
+import re
 import warnings
 
 import numpy as np
 import pandas as pd
-import scipy.signal
 import xarray as xr
 
-from .core import utils
+from .core import atmos, monitor, rules, utils
 
 
-def read_exo(filnam, skiprows=25, encoding="utf-8"):
+@monitor.timed
+def read_exo(filnam, skiprows=25, encoding=None, engine=None):
     """Read data from a YSI EXO multiparameter sonde .csv file into an xarray
     Dataset.
 
+    The file is read once: the header, for the sensor serial numbers, comes
+    from the same text as the data, and dates are parsed with the format
+    given in the names of the date and time columns, e.g.
+    "Date (MM/DD/YYYY)".
+
     Parameters
     ----------
     filnam : string
@@ -21,7 +29,11 @@ def read_exo(filnam, skiprows=25, encoding="utf-8"):
     skiprows : int, optional
         How many header rows to skip. Default 25
     encoding : string, optional
-        File encoding. Default 'utf-8'
+        File encoding. Default is to use 'utf-8' if the file is valid UTF-8,
+        and 'mac-roman', as written by old versions of Mac Excel, otherwise
+    engine : string, optional
+        pandas CSV parser engine, e.g. 'pyarrow' if pyarrow is installed.
+        Default is the pandas default, 'c'
 
     Returns
     -------
@@ -29,33 +41,11 @@ def read_exo(filnam, skiprows=25, encoding="utf-8"):
         An xarray Dataset of the EXO data
     """
 
+    raw, text, encoding = read_exo_text(filnam, encoding=encoding)
+
     try:
         exo = pd.read_csv(
-            filnam,
-            skiprows=skiprows,
-            infer_datetime_format=True,
-            # parse_dates=[['Date (MM/DD/YYYY)',
-            #               'Time (HH:MM:SS)']],
-            parse_dates=[[0, 1]],
-            encoding=encoding,
-        )
-    except UnicodeDecodeError:
-        exo = pd.read_csv(
-            filnam,
-            skiprows=skiprows,
-            infer_datetime_format=True,
-            # parse_dates=[['Date (MM/DD/YYYY)',
-            #               'Time (HH:MM:SS)']],
-            parse_dates=[[0, 1]],
-            encoding="mac-roman",
-        )
-    except NotImplementedError as e:
-        print(
-            (
-                " *** Could not decode file. Try saving the csv file using "
-                "UTF-8 encoding and retrying\n"
-            ),
-            e,
+            io.BytesIO(raw), skiprows=skiprows, encoding=encoding, engine=engine
         )
     except ValueError as e:
         print(
@@ -65,12 +55,14 @@ def read_exo(filnam, skiprows=25, encoding="utf-8"):
             ),
             e,
         )
-    # exo.rename(columns={'Date (MM/DD/YYYY)_Time (HH:MM:SS)': 'time'},
-    #            inplace=True)
-    exo.rename(
-        columns={exo.columns[0]: "time"}, inplace=True
-    )  # rename first column to time.
-    # Need to do this because the format of the date/time header can change between versions
+        raise
+
+    # combine the date and time columns. Their names give the format, which
+    # can change between versions of KOR
+    datecol, timecol = exo.columns[:2]
+    time = parse_exo_time(exo[datecol], exo[timecol])
+    exo = exo.drop(columns=[datecol, timecol])
+    exo.insert(0, "time", time)
     exo.set_index("time", inplace=True)
     exo.rename(columns=lambda x: x.replace(" ", "_"), inplace=True)
     exo.rename(columns=lambda x: x.replace("/", "_per_"), inplace=True)
@@ -83,7 +75,7 @@ def read_exo(filnam, skiprows=25, encoding="utf-8"):
         exo["Press_dbar"] = exo[pvar] * 0.689476
 
     exo = xr.Dataset(exo)
-    hdr = read_exo_header(filnam, encoding=encoding)
+    hdr = parse_exo_header(head_lines(text, skiprows + 1))
     exo.attrs["serial_number"] = hdr["serial_number"]
     exo.attrs["INST_TYPE"] = "YSI EXO2 Multiparameter Sonde"
     exo.attrs["COMPOSITE"] = np.int32(0)
@@ -138,6 +130,88 @@ def read_exo(filnam, skiprows=25, encoding="utf-8"):
     return exo
 
 
+def read_exo_text(filnam, encoding=None):
+    """
+    Return the bytes of an EXO .csv file, its text and its encoding, which,
+    if not given, is detected as in read_exo
+    """
+
+    with open(filnam, "rb") as f:
+        raw = f.read()
+
+    if encoding is None:
+        # check the whole file, as accented characters can be anywhere, e.g.
+        # in the site name of each row
+        try:
+            text = raw.decode("utf-8")
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            encoding = "mac-roman"
+            text = raw.decode(encoding)
+    else:
+        text = raw.decode(encoding)
+
+    # pandas ignores a byte order mark
+    return raw, text.lstrip("\ufeff"), encoding
+
+
+def head_lines(text, n):
+    """Return the first n lines of text, without splitting the rest"""
+
+    # line endings may be \r\n, \n or, from old Macs, \r
+    size = 65536
+    while True:
+        lines = text[:size].splitlines()
+        if len(lines) > n or size >= len(text):
+            return lines[:n]
+        size *= 4
+
+
+# tokens of the date and time formats in the column names written by KOR
+DATE_TOKENS = {"MM": "%m", "DD": "%d", "YYYY": "%Y", "YY": "%y"}
+TIME_TOKENS = {"HH": "%H", "MM": "%M", "mm": "%M", "SS": "%S", "ss": "%S"}
+
+
+def exo_time_format(name, tokens):
+    """
+    Return the strftime format of a date or time column from its name and
+    the format tokens used, e.g. "%m/%d/%Y" for "Date (MM/DD/YYYY)", or None
+    if it cannot be determined
+    """
+
+    m = re.search(r"\(([^)]*)\)", name)
+    if m is None:
+        return None
+    fields = re.findall(r"[A-Za-z]+", m.group(1))
+    if not fields or any(f not in tokens for f in fields):
+        return None
+
+    return re.sub(r"[A-Za-z]+", lambda f: tokens[f.group(0)], m.group(1))
+
+
+def parse_exo_time(dates, times):
+    """
+    Return the times of the date and time columns of an EXO .csv file, as a
+    datetime64 Series.
+
+    The dates and times are parsed with the formats given in the column
+    names (see utils.combine_date_time). If the formats are unknown or don't
+    match, the combined strings are parsed, inferring their format.
+    """
+
+    datefmt = exo_time_format(dates.name, DATE_TOKENS)
+    timefmt = exo_time_format(times.name, TIME_TOKENS)
+
+    if datefmt is not None and timefmt is not None:
+        try:
+            return utils.combine_date_time(dates, times, datefmt, timefmt)
+        except ValueError:
+            pass
+
+    return pd.to_datetime(dates.astype(str) + " " + times.astype(str))
+
+
+@monitor.timed
 def csv_to_cdf(metadata):
     """
     Process EXO .csv file to a raw .cdf file
@@ -145,15 +219,11 @@ def csv_to_cdf(metadata):
 
     basefile = metadata["basefile"]
 
-    try:
-        ds = read_exo(basefile + ".csv", skiprows=metadata["skiprows"])
-    except UnicodeDecodeError:
-        # try reading as Mac OS Western for old versions of Mac Excel
-        ds = read_exo(
-            basefile + ".csv", skiprows=metadata["skiprows"], encoding="mac-roman"
-        )
-
-    metadata.pop("skiprows")
+    ds = read_exo(
+        basefile + ".csv",
+        skiprows=metadata.pop("skiprows"),
+        engine=metadata.pop("csv_engine", None),
+    )
 
     # write out metadata first, then deal exclusively with xarray attrs
     ds = utils.write_metadata(ds, metadata)
@@ -168,23 +238,21 @@ def csv_to_cdf(metadata):
     # configure file
     cdf_filename = ds.attrs["filename"] + "-raw.cdf"
 
-    ds.to_netcdf(cdf_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, cdf_filename, raw=True, unlimited_dims=["time"])
 
     print("Finished writing data to %s" % cdf_filename)
 
     return ds
 
 
-def cdf_to_nc(cdf_filename, atmpres=False):
+@monitor.timed
+def cdf_to_nc(cdf_filename, atmpres=False, profile=None):
     """
     Load a "raw" .cdf file and generate a processed .nc file
     """
 
-    # Load raw .cdf data
-    ds = xr.load_dataset(cdf_filename)
-
-    # Clip data to in/out water times or via good_ens
-    ds = utils.clip_ds(ds)
+    # Load raw .cdf data, clipped to in/out water times or via good_ens
+    ds = utils.open_clipped_dataset(cdf_filename)
 
     ds = ds_rename_vars(ds)
 
@@ -205,11 +273,10 @@ def cdf_to_nc(cdf_filename, atmpres=False):
     if atmpres:
         print("Atmospherically correcting data")
 
-        met = xr.load_dataset(atmpres)
         # need to save attrs before the subtraction, otherwise they are lost
         attrs = ds["P_1"].attrs
-        ds["P_1ac"] = ds["P_1"] - met["atmpres"] - met["atmpres"].offset
-        print("Correcting using offset of %f" % met["atmpres"].offset)
+        ds["P_1ac"] = atmos.atmos_correct(ds["P_1"], atmpres, ds.attrs)
+        print("Correcting using offset of %f" % atmos.load_atmpres(atmpres)["offset"])
         ds["P_1ac"].attrs = attrs
 
     ds = exo_qaqc(ds)
@@ -234,13 +301,12 @@ def cdf_to_nc(cdf_filename, atmpres=False):
 
     ds = utils.no_p_create_depth(ds)
 
-    # add lat/lon coordinates to each variable
-    for var in ds.variables:
-        if (var not in ds.coords) and ("time" not in var):
-            ds = utils.add_lat_lon(ds, var)
-            ds = utils.no_p_add_depth(ds, var)
-            # cast as float32
-            ds = utils.set_var_dtype(ds, var)
+    # add lat/lon/depth coordinates to each variable
+    datavars = [var for var in ds.data_vars if "time" not in var]
+    ds = utils.add_singleton_dims(ds, datavars, ["lat", "lon", "depth"])
+    for var in datavars:
+        # cast as float32
+        ds = utils.set_var_dtype(ds, var)
 
     ds = utils.rename_time(ds)
 
@@ -252,7 +318,7 @@ def cdf_to_nc(cdf_filename, atmpres=False):
     print("Writing cleaned/trimmed data to .nc file")
     nc_filename = ds.attrs["filename"] + "-a.nc"
 
-    ds.to_netcdf(nc_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, nc_filename, profile=profile, unlimited_dims=["time"])
     print("Done writing netCDF file", nc_filename)
 
 
@@ -432,16 +498,37 @@ def ds_add_attrs(ds):
     return ds
 
 
-def read_exo_header(filnam, encoding="utf-8"):
+def read_exo_header(filnam, encoding=None):
+    """
+    Return the serial numbers in the header of an EXO .csv file. See
+    parse_exo_header
+    """
+
+    _, text, _ = read_exo_text(filnam, encoding=encoding)
+
+    return parse_exo_header(text.splitlines())
+
+
+def parse_exo_header(lines):
+    """
+    Return the serial number of the sonde and, as a dict for each sensor,
+    the sensor serial number and, for old versions of KOR, the data columns,
+    from the header lines of an EXO .csv file
+    """
+
+    rows = list(csv.reader(lines))
     header = {}
-    try:
+
+    def cell(row, n):
+        # empty cells are NaN, as read by pandas
+        if n < len(row) and row[n] != "":
+            return row[n]
+        return np.nan
+
+    if rows and rows[0] and rows[0][0] == "KOR Export File":
         # Old version of KOR export file
-        hdr = pd.read_csv(filnam, skiprows=None, encoding=encoding)
-        hdr = pd.DataFrame(hdr.iloc[:, 0:4])
-        # print(hdr)
-        header["serial_number"] = (
-            hdr[hdr["KOR Export File"] == "Sonde ID"].values[0][1].split(" ")[1]
-        )
+        hdr = {row[0]: row for row in reversed(rows[1:]) if row}
+        header["serial_number"] = cell(hdr["Sonde ID"], 1).split(" ")[1]
         for var in [
             "fDOM",
             "Total Algae BGA-PE",
@@ -452,24 +539,26 @@ def read_exo_header(filnam, encoding="utf-8"):
             "pH",
             "Depth Non-Vented 0-10m",
         ]:
-            vals = hdr[hdr["KOR Export File"] == var]
-            if not vals.empty:
+            if var in hdr:
                 header[var] = {}
-                header[var]["sensor_serial_number"] = vals.values[0][1]
+                header[var]["sensor_serial_number"] = cell(hdr[var], 1)
                 header[var]["data_columns"] = [
-                    int(x) for x in vals.values[0][3].split(";")
+                    int(x) for x in cell(hdr[var], 3).split(";")
                 ]
-    except pd.errors.ParserError:
-        # new version of KOR export file
-        hdr = pd.read_csv(filnam, skiprows=4, encoding=encoding)
-        hdr = pd.DataFrame(hdr.iloc[:, 3:-1])
+    else:
+        # new version of KOR export file. The fifth line sets the number of
+        # columns, and sensor names follow the row of serial numbers
         header["serial_number"] = "unknown"
-        row = np.where(hdr.iloc[:, 0] == "SENSOR SERIAL NUMBER:")
-        a = np.vstack([hdr.iloc[row[0] + 1, :].values, hdr.iloc[row[0], :].values]).T
-        for v in a:
-            if v[0] != "Site Name":
-                header[v[0]] = {}
-                header[v[0]]["sensor_serial_number"] = v[1]
+        ncol = len(rows[4])
+        body = [row for row in rows[5:] if row]
+        for n in range(len(body) - 1):
+            if cell(body[n], 3) == "SENSOR SERIAL NUMBER:":
+                for k in range(3, ncol - 1):
+                    name = cell(body[n + 1], k)
+                    if name != "Site Name":
+                        header[name] = {}
+                        header[name]["sensor_serial_number"] = cell(body[n], k)
+                break
 
     return header
 
@@ -480,206 +569,64 @@ def exo_qaqc(ds):
     Trim EXO data based on metadata
     """
 
-    # S_41 needs to be first in list for trim_by_salinity()
-    for var in [
-        "S_41",
-        "C_51",
-        "SpC_48",
-        "T_28",
-        "Turb",
-        "fDOMRFU",
-        "fDOMQSU",
-        "CHLrfu",
-        "Fch_906",
-        "BGAPErfu",
-        "BGAPE",
-        "OST_62",
-        "DO",
-        "pH_159",
-        "pHmV",
-        "P_1ac",
-        "P_1",
-    ]:
-        ds = trim_min(ds, var)
-
-        ds = trim_max(ds, var)
-
-        ds = trim_min_diff(ds, var)
-
-        ds = trim_max_diff(ds, var)
-
-        ds = trim_med_diff(ds, var)
-
-        ds = trim_med_diff_pct(ds, var)
-
-        ds = trim_bad_ens(ds, var)
-
-        ds = trim_by_salinity(ds, var)  # this must come last
-
-    return ds
+    # rules are applied as trim_min(), trim_max(), ..., trim_by_salinity()
+    # would be to each variable in turn
+    return rules.apply_rules(
+        ds,
+        [
+            "S_41",
+            "C_51",
+            "SpC_48",
+            "T_28",
+            "Turb",
+            "fDOMRFU",
+            "fDOMQSU",
+            "CHLrfu",
+            "Fch_906",
+            "BGAPErfu",
+            "BGAPE",
+            "OST_62",
+            "DO",
+            "pH_159",
+            "pHmV",
+            "P_1ac",
+            "P_1",
+        ],
+        rules.EXO_RULES,
+    )
 
 
+# single rules, for scripts that trim one variable at a time
 def trim_min(ds, var):
-    if var + "_min" in ds.attrs:
-        print("%s: Trimming using minimum value of %f" % (var, ds.attrs[var + "_min"]))
-        ds[var][ds[var] < ds.attrs[var + "_min"]] = np.nan
-
-        notetxt = "Values filled where less than %f units. " % ds.attrs[var + "_min"]
-
-        ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["min"])
 
 
 def trim_max(ds, var):
-    if var + "_max" in ds.attrs:
-        print("%s: Trimming using maximum value of %f" % (var, ds.attrs[var + "_max"]))
-        ds[var][ds[var] > ds.attrs[var + "_max"]] = np.nan
-
-        notetxt = "Values filled where greater than %f units. " % ds.attrs[var + "_max"]
-
-        ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["max"])
 
 
 def trim_min_diff(ds, var):
-    if var + "_min_diff" in ds.attrs:
-        print(
-            "%s: Trimming using minimum diff of %f" % (var, ds.attrs[var + "_min_diff"])
-        )
-        ds[var][np.ediff1d(ds[var], to_begin=0) < ds.attrs[var + "_min_diff"]] = np.nan
-
-        notetxt = (
-            "Values filled where data decreases by more than %f "
-            "units in a single time step. " % ds.attrs[var + "_min_diff"]
-        )
-
-        ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["min_diff"])
 
 
 def trim_max_diff(ds, var):
-    if var + "_max_diff" in ds.attrs:
-        print(
-            "%s: Trimming using maximum diff of %f" % (var, ds.attrs[var + "_max_diff"])
-        )
-        ds[var][np.ediff1d(ds[var], to_begin=0) > ds.attrs[var + "_max_diff"]] = np.nan
-
-        notetxt = (
-            "Values filled where data increases by more than %f "
-            "units in a single time step. " % ds.attrs[var + "_max_diff"]
-        )
-
-        ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["max_diff"])
 
 
 def trim_med_diff(ds, var):
-    if var + "_med_diff" in ds.attrs:
-        if "kernel_size" in ds.attrs:
-            kernel_size = ds.attrs["kernel_size"]
-        else:
-            kernel_size = 5
-        print(
-            "%s: Trimming using %d-point median filter diff of %f"
-            % (var, kernel_size, ds.attrs[var + "_med_diff"])
-        )
-        filtered = scipy.signal.medfilt(ds[var], kernel_size=kernel_size)
-        bads = np.abs(ds[var] - filtered) > ds.attrs[var + "_med_diff"]
-        ds[var][bads] = np.nan
-
-        notetxt = (
-            "Values filled where difference between %d-point "
-            "median filter and original values is greater than "
-            "%f. " % (kernel_size, ds.attrs[var + "_med_diff"])
-        )
-
-        ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["med_diff"])
 
 
 def trim_med_diff_pct(ds, var):
-    if var + "_med_diff_pct" in ds.attrs:
-        if "kernel_size" in ds.attrs:
-            kernel_size = ds.attrs["kernel_size"]
-        else:
-            kernel_size = 5
-        print(
-            "%s: Trimming using %d-point median filter diff of %f pct"
-            % (var, kernel_size, ds.attrs[var + "_med_diff_pct"])
-        )
-        filtered = scipy.signal.medfilt(ds[var], kernel_size=kernel_size)
-        bads = (
-            100 * np.abs(ds[var] - filtered) / ds[var] > ds.attrs[var + "_med_diff_pct"]
-        )
-        ds[var][bads] = np.nan
-
-        notetxt = (
-            "Values filled where percent difference between "
-            "%d-point median filter and original values is greater "
-            "than %f. " % (kernel_size, ds.attrs[var + "_med_diff_pct"])
-        )
-
-        ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["med_diff_pct"])
 
 
 def trim_bad_ens(ds, var):
-    if var + "_bad_ens" in ds.attrs:
-        inc = np.arange(0, len(ds.attrs[var + "_bad_ens"]), 2)
-        for n in inc:
-            print(
-                "%s: Trimming using bad_ens %s"
-                % (var, str(ds.attrs[var + "_bad_ens"][n : n + 2]))
-            )
-            if isinstance(ds.attrs[var + "_bad_ens"][n], str):
-                bads = (ds["time"] >= np.datetime64(ds.attrs[var + "_bad_ens"][n])) & (
-                    ds["time"] <= np.datetime64(ds.attrs[var + "_bad_ens"][n + 1])
-                )
-                ds[var] = ds[var].where(~bads)
-            else:
-                bads = np.full(ds[var].shape, False)
-                bads[
-                    np.arange(
-                        ds.attrs[var + "_bad_ens"][n], ds.attrs[var + "_bad_ens"][n + 1]
-                    )
-                ] = True
-                ds[var][bads] = np.nan
-
-            notetxt = "Data clipped using bad_ens values of %s. " % (
-                str(ds.attrs[var + "_bad_ens"])
-            )
-
-            ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["bad_ens"])
 
 
 def trim_by_salinity(ds, var):
-    if (
-        "trim_by_salinity" in ds.attrs
-        and ds.attrs["trim_by_salinity"].lower() == "true"
-    ):  # xarray doesn't support writing attributes as booleans
-        if (
-            "trim_by_salinity_exclude" in ds.attrs
-            and var in ds.attrs["trim_by_salinity_exclude"]
-        ):
-            pass
-        else:
-            print("%s: Trimming using valid salinity threshold" % var)
-            ds[var][ds["S_41"].isnull()] = np.nan
-
-            if var != "S_41":
-                notetxt = "Values filled using valid salinity threshold. "
-
-                ds = utils.insert_note(ds, var, notetxt)
-
-    return ds
+    return rules.apply_rules(ds, [var], ["salinity"])
 
 
 def exo_add_delta_t(ds):
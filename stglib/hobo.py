@@ -4,9 +4,10 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 
-from .core import utils
+from .core import monitor, utils
 
 
+@monitor.timed
 def read_hobo(filnam, skiprows=1, skipfooter=0):
     """Read data from an Onset HOBO pressure sensor .csv file into an xarray
     Dataset.
@@ -25,21 +26,48 @@ def read_hobo(filnam, skiprows=1, skipfooter=0):
     xarray.Dataset
         An xarray Dataset of the HOBO data
     """
-    hobo = pd.read_csv(
+    # the footer is removed before parsing, so the fast C engine can be used
+    hobo = utils.read_csv_skipfooter(
         filnam,
+        skipfooter=skipfooter,
         usecols=[0, 1, 2, 3],
         names=["#", "datetime", "abspres_kPa", "temp_C"],
-        engine="python",
         skiprows=skiprows,
-        skipfooter=skipfooter,
     )
-    hobo["time"] = pd.to_datetime(hobo["datetime"])
+    hobo["time"] = parse_hobo_time(hobo["datetime"])
     hobo["abspres_dbar"] = hobo["abspres_kPa"] / 10
     hobo.set_index("time", inplace=True)
 
     return xr.Dataset(hobo)
 
 
+# date formats of HOBOware exports. pandas can't infer those with AM/PM,
+# and would parse each value separately with dateutil
+HOBO_TIME_FORMATS = [
+    "%m/%d/%y %I:%M:%S %p",
+    "%m/%d/%Y %I:%M:%S %p",
+    "%m/%d/%y %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S",
+]
+
+
+def parse_hobo_time(datetimes):
+    """
+    Parse the date time column of a HOBO .csv file with the first of
+    HOBO_TIME_FORMATS that matches all values, or else by inferring the
+    format
+    """
+
+    for fmt in HOBO_TIME_FORMATS:
+        try:
+            return pd.to_datetime(datetimes, format=fmt)
+        except ValueError:
+            pass
+
+    return pd.to_datetime(datetimes)
+
+
+@monitor.timed
 def csv_to_cdf(metadata):
     """
     Process HOBO .csv file to a raw .cdf file
@@ -71,7 +99,7 @@ def csv_to_cdf(metadata):
     # configure file
     cdf_filename = ds.attrs["filename"] + "-raw.cdf"
 
-    ds.to_netcdf(cdf_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, cdf_filename, raw=True, unlimited_dims=["time"])
 
     print("Finished writing data to %s" % cdf_filename)
 
@@ -142,16 +170,14 @@ def get_serial_number(filnam):
         return line2[sn + 9 : sn + 17]
 
 
-def cdf_to_nc(cdf_filename):
+@monitor.timed
+def cdf_to_nc(cdf_filename, profile=None):
     """
     Load a "raw" .cdf file and generate a processed .nc file
     """
 
-    # Load raw .cdf data
-    ds = xr.open_dataset(cdf_filename)
-
-    # Clip data to in/out water times or via good_ens
-    ds = utils.clip_ds(ds)
+    # Load raw .cdf data, clipped to in/out water times or via good_ens
+    ds = utils.open_clipped_dataset(cdf_filename)
 
     # assign min/max:
     ds = utils.add_min_max(ds)
@@ -169,13 +195,12 @@ def cdf_to_nc(cdf_filename):
 
     ds = utils.no_p_create_depth(ds)
 
-    # add lat/lon coordinates to each variable
-    for var in ds.variables:
-        if (var not in ds.coords) and ("time" not in var):
-            ds = utils.add_lat_lon(ds, var)
-            ds = utils.no_p_add_depth(ds, var)
-            # cast as float32
-            ds = utils.set_var_dtype(ds, var)
+    # add lat/lon/depth coordinates to each variable
+    datavars = [var for var in ds.data_vars if "time" not in var]
+    ds = utils.add_singleton_dims(ds, datavars, ["lat", "lon", "depth"])
+    for var in datavars:
+        # cast as float32
+        ds = utils.set_var_dtype(ds, var)
 
     ds = utils.rename_time(ds)
 
@@ -183,5 +208,5 @@ def cdf_to_nc(cdf_filename):
     print("Writing cleaned/trimmed data to .nc file")
     nc_filename = ds.attrs["filename"] + "-a.nc"
 
-    ds.to_netcdf(nc_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, nc_filename, profile=profile, unlimited_dims=["time"])
     print("Done writing netCDF file", nc_filename)
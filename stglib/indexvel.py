@@ -2,8 +2,6 @@ from __future__ import division, print_function
 
 import numpy as np
 import pandas as pd
-import scipy.stats
-import xmltodict
 
 
 def read_areacomp_stationarea(filename):
@@ -19,6 +17,8 @@ def read_areacomp(filename):
 
 
 def read_qrev_xml(filename, encoding="utf-8"):
+    import xmltodict
+
     with open(filename, encoding=encoding) as fd:
         return xmltodict.parse(fd.read())
 
@@ -87,6 +87,8 @@ def linregress(adcp):
     and standard error of the slope. This is just a wrapper around
     `scipy.stats.linregress()`
     """
+    import scipy.stats
+
     (
         adcp["slope"],
         adcp["intercept"],
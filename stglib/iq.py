@@ -1,13 +1,14 @@
 from __future__ import division, print_function
 
-import matplotlib.pyplot as plt
+import fnmatch
+
 import numpy as np
 import xarray as xr
 
-from . import core
-from .core import utils
+from .core import monitor, utils
 
 
+@monitor.timed
 def mat_to_cdf(metadata):
     """
     Process SonTek IQ .mat data to raw .cdf file
@@ -15,7 +16,7 @@ def mat_to_cdf(metadata):
 
     basefile = metadata["basefile"]
 
-    ds = read_iq(basefile + ".mat")
+    ds = read_iq(basefile + ".mat", variables=metadata.pop("iq_variables", None))
 
     # write out metadata first, then deal exclusively with xarray attrs
     ds = utils.write_metadata(ds, metadata)
@@ -27,14 +28,15 @@ def mat_to_cdf(metadata):
     # configure file
     cdf_filename = ds.attrs["filename"] + "-raw.cdf"
 
-    ds.to_netcdf(cdf_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, cdf_filename, raw=True, unlimited_dims=["time"])
 
     print("Finished writing data to %s" % cdf_filename)
 
     return ds
 
 
-def read_iq(filnam):
+@monitor.timed
+def read_iq(filnam, variables=None):
     """Read SonTek IQ data which has been exported as a Matlab .mat file from IQ
     software into an xarray Dataset
 
@@ -42,21 +44,122 @@ def read_iq(filnam):
     ----------
     filnam : string
         The SonTek .mat filename
+    variables : list of str, optional
+        Names of the time-dependent variables to read besides
+        FlowData_SampleTime, which may include shell-style wildcards, e.g.
+        ["FlowData_*"] to leave out the Profile_* arrays. Default is to read
+        all of them
 
     Returns
     -------
     xarray.Dataset
         An xarray Dataset of the IQ data
+
+    Notes
+    -----
+    Only the variables needed are read from the file. MATLAB v7.3 .mat files,
+    which are HDF5 files, are read with h5py, reading only the rows within
+    the time record of each array from disk, so large profile arrays are not
+    read in full.
+    """
+
+    if utils.is_mat73(filnam):
+        import h5py
+
+        with h5py.File(filnam, "r") as f:
+            shapes = {k: f[k].shape[::-1] for k in f if isinstance(f[k], h5py.Dataset)}
+
+            def read(k, rows=None):
+                return utils.read_mat73(f[k], rows=rows)
+
+            return iq_to_xr(shapes, read, variables)
+
+    import scipy.io as spio
+
+    shapes = {name: shape for name, shape, _ in spio.whosmat(filnam)}
+    timelen = int(np.prod(shapes["FlowData_SampleTime"]))
+    names = [
+        k
+        for k in shapes
+        if k in IQ_STRUCTS + ["FlowData_SampleTime"]
+        or (
+            iq_dims(k, np.prod(shapes[k]), timelen) is not None
+            and is_wanted(k, variables)
+        )
+    ]
+    iqmat = utils.loadmat(filnam, variable_names=names)
+
+    def read(k, rows=None):
+        return iqmat[k] if rows is None else np.atleast_1d(iqmat[k])[0:rows]
+
+    return iq_to_xr(shapes, read, variables)
+
+
+# structs holding units and instrument settings
+IQ_STRUCTS = ["Data_Units", "System_IqSetup", "System_Id", "System_IqState"]
+
+# per-profile header vectors used by make_beamdist to locate the cells
+IQ_HEADERS = [
+    "FlowSubData_PrfHeader_%d_%s" % (bm, k)
+    for bm in range(4)
+    for k in ["BlankingDistance", "CellSize"]
+]
+
+
+def is_wanted(k, variables):
+    """
+    Return True if variable k is to be read, given the names or wildcard
+    patterns of read_iq
+    """
+
+    if variables is None or k == "FlowData_SampleTime":
+        return True
+
+    # the profile headers are read with the profiles, for make_beamdist
+    if k.startswith("FlowSubData_PrfHeader_"):
+        k = "Profile_" + k.split("_")[2] + "_Vel"
+
+    return any(fnmatch.fnmatchcase(k, pattern) for pattern in variables)
+
+
+def iq_dims(k, size, timelen):
+    """
+    Return the dimensions of variable k of an IQ .mat file, with size
+    values, or None if it is not read
+    """
+
+    if k in IQ_HEADERS:
+        return ("time",)
+    if "__" in k or "FlowSubData" in k or k.startswith("#"):
+        return None
+    # need to do this because sometimes the flowsubdata and profile data is
+    # one burst longer
+    if size == timelen:
+        return ("time",)
+    elif "_2_" in k or "_3_" in k:
+        return ("time", "cell_across")
+    elif "_0_" in k or "_1_" in k:
+        return ("time", "cell_along")
+    elif "FlowData_Vel" in k or "FlowData_SNR" in k:
+        return ("time", "velbeam")
+    elif "FlowData_NoiseLevel" in k:
+        return ("time", "beam")
+
+
+def iq_to_xr(shapes, read, variables=None):
+    """
+    Build the Dataset of read_iq from the MATLAB shapes of the variables in
+    a .mat file and a function read(name, rows=None) returning a variable,
+    or only its first rows rows
     """
 
-    iqmat = core.utils.loadmat(filnam)
     # offset = iqmat['FlowSubData_PrfHeader_0_BlankingDistance']
     # beamdist_0 = np.linspace(offset, offset + \
     # 100*iqmat['FlowSubData_PrfHeader_0_CellSize'], 100)
     ds = {}
 
     ds["time"] = xr.DataArray(
-        iqmat["FlowData_SampleTime"],
+        np.ravel(read("FlowData_SampleTime")),
         attrs={
             "standard_name": "time",
             "axis": "T",
@@ -80,50 +183,37 @@ def read_iq(filnam):
     # ds['beamdist_0'] = xr.DataArray(beamdist_0, dims='beamdist_0')
     # attrs = {}
 
-    # need to do this because sometimes the flowsubdata and profile data is
-    # one burst longer
     timelen = len(ds["time"])
+    units = read("Data_Units")
+
+    for k in shapes:
+        if not is_wanted(k, variables):
+            continue
+        dims = iq_dims(k, np.prod(shapes[k]), timelen)
+        if dims is None:
+            continue
+        if len(dims) == 1:
+            ds[k] = xr.DataArray(np.ravel(read(k, rows=timelen)), dims=dims)
+        else:
+            ds[k] = xr.DataArray(read(k, rows=timelen), dims=dims)
+        if k in units:
+            ds[k].attrs["units"] = units[k].replace("/s", " s-1")
 
-    for k in iqmat:
-        if "__" not in k and "FlowSubData" not in k:
-            # print(k, np.shape(iqmat[k]))
-            if len(np.ravel(iqmat[k])) == len(ds["time"]):
-                ds[k] = xr.DataArray(np.ravel(iqmat[k]), dims="time")
-                if k in iqmat["Data_Units"]:
-                    ds[k].attrs["units"] = iqmat["Data_Units"][k].replace("/s", " s-1")
-            elif "_2_" in k or "_3_" in k:
-                ds[k] = xr.DataArray(
-                    iqmat[k][0:timelen, :], dims=("time", "cell_across")
-                )
-                if k in iqmat["Data_Units"]:
-                    ds[k].attrs["units"] = iqmat["Data_Units"][k].replace("/s", " s-1")
-            elif "_0_" in k or "_1_" in k:
-                ds[k] = xr.DataArray(
-                    iqmat[k][0:timelen, :], dims=("time", "cell_along")
-                )
-                if k in iqmat["Data_Units"]:
-                    ds[k].attrs["units"] = iqmat["Data_Units"][k].replace("/s", " s-1")
-            elif "FlowData_Vel" in k or "FlowData_SNR" in k:
-                ds[k] = xr.DataArray(iqmat[k][0:timelen, :], dims=("time", "velbeam"))
-                if k in iqmat["Data_Units"]:
-                    ds[k].attrs["units"] = iqmat["Data_Units"][k].replace("/s", " s-1")
-            elif "FlowData_NoiseLevel" in k:
-                ds[k] = xr.DataArray(iqmat[k][0:timelen, :], dims=("time", "beam"))
-                if k in iqmat["Data_Units"]:
-                    ds[k].attrs["units"] = iqmat["Data_Units"][k].replace("/s", " s-1")
-
-    ds["cell_along"] = np.arange(ds["Profile_0_Vel"].shape[1])
-    ds["cell_across"] = np.arange(ds["Profile_2_Vel"].shape[1])
+    if "Profile_0_Vel" in ds:
+        ds["cell_along"] = np.arange(ds["Profile_0_Vel"].shape[1])
+    if "Profile_2_Vel" in ds:
+        ds["cell_across"] = np.arange(ds["Profile_2_Vel"].shape[1])
 
     ds = xr.Dataset(ds)
-    for k in iqmat["System_IqSetup"]["basicSetup"]:
+    setup = read("System_IqSetup")
+    for k in setup["basicSetup"]:
         if "spare" not in k:
-            ds.attrs[k] = iqmat["System_IqSetup"]["basicSetup"][k]
-    for k in iqmat["System_Id"]:
-        ds.attrs[k] = iqmat["System_Id"][k]
-    for k in iqmat["System_IqState"]:
+            ds.attrs[k] = setup["basicSetup"][k]
+    for k, v in read("System_Id").items():
+        ds.attrs[k] = v
+    for k, v in read("System_IqState").items():
         if "spare" not in k:
-            ds.attrs[k] = iqmat["System_IqState"][k]
+            ds.attrs[k] = v
 
     return xr.decode_cf(ds)
 
@@ -167,12 +257,16 @@ def clean_iq(iq):
     iq["Vel_Mean"].values[iq["Vel_Mean"] < -214748] = np.nan
     iq["Vel"].values[iq["Vel"] == -214748368] = np.nan
     for bm in range(4):
+        # profiles may have been left out with iq_variables
         pr = "Profile_" + str(bm) + "_Vel"
-        iq[pr].values[iq[pr] == -214748368] = np.nan
+        if pr in iq:
+            iq[pr].values[iq[pr] == -214748368] = np.nan
         am = "Profile_" + str(bm) + "_Amp"
-        iq[am].values[iq[am] == 65535] = np.nan
+        if am in iq:
+            iq[am].values[iq[am] == 65535] = np.nan
         st = "Profile_" + str(bm) + "_VelStd"
-        iq[st].values[iq[st] < 0] = np.nan
+        if st in iq:
+            iq[st].values[iq[st] < 0] = np.nan
 
     return iq
 
@@ -190,25 +284,35 @@ def vel_to_ms(iq):
 
 def make_beamdist(iq):
     """
-    Generate physical coordinates to pair with the logical beamdist coordinates
+    Generate physical coordinates to pair with the logical cell coordinates
+    of each beam's profiles. cells_N is the distance of each cell along beam
+    N, from the FlowSubData_PrfHeader_N_BlankingDistance and
+    FlowSubData_PrfHeader_N_CellSize of each profile, and time_N is the time
+    of each cell, a read-only broadcast view of time rather than a copy.
+    Beams without profiles or headers are skipped.
     """
     for bm in range(4):
-        if bm < 2:
-            bdname = "beamdist_0_1"
-        else:
-            bdname = "beamdist_2_3"
-
-        r = range(len(iq[bdname]))
-
-        time = np.tile(iq["time"], (len(iq[bdname]), 1)).transpose()
-
-        cells = np.zeros(np.shape(iq["Profile_" + str(bm) + "_Vel"]))
         fsdbd = "FlowSubData_PrfHeader_" + str(bm) + "_BlankingDistance"
         fsdcs = "FlowSubData_PrfHeader_" + str(bm) + "_CellSize"
-        for n in range(len(iq["time"])):
-            cells[n, :] = iq[fsdbd][n].values + r * iq[fsdcs][n].values
-        iq["cells_" + str(bm)] = xr.DataArray(cells, dims=("time", bdname))
-        iq["time_" + str(bm)] = xr.DataArray(time, dims=("time", bdname))
+        if any(k not in iq for k in ["Profile_" + str(bm) + "_Vel", fsdbd, fsdcs]):
+            continue
+
+        prof = iq["Profile_" + str(bm) + "_Vel"]
+        bdname = prof.dims[1]
+
+        r = xr.DataArray(np.arange(prof.shape[1]), dims=bdname)
+        cells = (iq[fsdbd] + r * iq[fsdcs]).transpose("time", bdname)
+
+        # wrapping the view in a new Variable would copy it, as for any
+        # datetime64 data
+        time = iq["time"].variable.set_dims(prof.sizes)
+        time.attrs = {}
+        time.encoding = {}
+        iq["cells_" + str(bm)] = (("time", bdname), cells.values)
+        iq["cells_" + str(bm)].attrs["long_name"] = "Beam %d cell distance" % bm
+        if "units" in iq[fsdbd].attrs:
+            iq["cells_" + str(bm)].attrs["units"] = iq[fsdbd].attrs["units"]
+        iq["time_" + str(bm)] = time
         iq = iq.set_coords(["cells_" + str(bm), "time_" + str(bm)])
 
     return iq
@@ -219,6 +323,8 @@ def make_iq_plots(iq, directory="", savefig=False):
     Make IQ turnaround plots
     """
 
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(11, 8.5))
 
     for n, var in enumerate(
@@ -233,21 +339,23 @@ def make_iq_plots(iq, directory="", savefig=False):
     plt.show()
 
 
-def cdf_to_nc(cdf_filename, format="NETCDF3_64BIT"):
+@monitor.timed
+def cdf_to_nc(cdf_filename, format="NETCDF3_64BIT", profile=None):
     """
     Load a "raw" .cdf file and generate a processed .nc file
     """
 
-    # Load raw .cdf data
-    ds = xr.open_dataset(cdf_filename)
+    # Load raw .cdf data, clipped to in/out water times or via good_ens
+    ds = utils.open_clipped_dataset(cdf_filename)
 
     ds = remove_FlowData(ds)
 
-    # Clip data to in/out water times or via good_ens
-    ds = utils.clip_ds(ds)
-
     ds = clean_iq(ds)
 
+    # cell distances and times of the profiles, which replace the headers
+    ds = make_beamdist(ds).drop_vars([k for k in IQ_HEADERS if k in ds])
+    beamcoords = [k for k in ds.coords if k[:-1] in ["cells_", "time_"]]
+
     # assign min/max:
     ds = utils.add_min_max(ds)
 
@@ -269,29 +377,35 @@ def cdf_to_nc(cdf_filename, format="NETCDF3_64BIT"):
     ds = ds.drop(["SampleNumber", "SampleTime"])
 
     # add lat/lon coordinates to each variable
-    for var in ds.variables:
-        if (var not in ds.coords) and ("time" not in var):
-            ds = utils.add_lat_lon(ds, var)
-            # cast as float32
-            ds = utils.set_var_dtype(ds, var)
+    datavars = [var for var in ds.data_vars if "time" not in var]
+    ds = utils.add_singleton_dims(ds, datavars)
+    for var in datavars:
+        # cast as float32
+        ds = utils.set_var_dtype(ds, var)
 
     ds = utils.rename_time(ds)
 
-    dsflow = ds.copy()
-    dsprof = ds.copy()
-
-    dsflow = dsflow.drop([k for k in dsflow if "Profile_" in k])
-    dsprof = dsprof.drop([k for k in dsprof if "Profile_" not in k])
+    # the flow and profile files share the coordinates and attributes, and
+    # each takes its own data variables without copying them
+    profvars = [k for k in ds.data_vars if "Profile_" in k]
+    dsflow = ds.drop_vars(profvars + beamcoords)
+    dsprof = ds.drop_vars([k for k in ds.data_vars if k not in profvars])
 
     # Write to .nc file
     print("Writing cleaned/trimmed data to .nc file")
 
     nc_filename = dsflow.attrs["filename"] + "flow-a.nc"
-    dsflow.to_netcdf(nc_filename, format=format, unlimited_dims=["time"])
+    utils.write_nc(
+        dsflow, nc_filename, profile=profile, format=format, unlimited_dims=["time"]
+    )
     print("Done writing netCDF file", nc_filename)
 
+    if not profvars:
+        print("No profile data; not writing profile file")
+        return
+
     nc_filename = dsprof.attrs["filename"] + "prof-a.nc"
-    dsprof.to_netcdf(nc_filename, format=format)
+    utils.write_nc(dsprof, nc_filename, profile=profile, format=format)
     print("Done writing netCDF file", nc_filename)
 
 
@@ -358,11 +472,13 @@ def ds_add_attrs(ds):
 
     # Profile Variables
     for n in range(4):
-        ds["Profile_%d_Amp" % n].attrs["long_name"] = "Beam %d amplitude" % n
-        ds["Profile_%d_VelStd" % n].attrs["long_name"] = (
-            "Beam %d velocity profile standard deviation" % n
-        )
-        ds["Profile_%d_Vel" % n].attrs["long_name"] = "Beam %d velocity profile" % n
+        for var, long_name in [
+            ("Profile_%d_Amp", "Beam %d amplitude"),
+            ("Profile_%d_VelStd", "Beam %d velocity profile standard deviation"),
+            ("Profile_%d_Vel", "Beam %d velocity profile"),
+        ]:
+            if var % n in ds:
+                ds[var % n].attrs["long_name"] = long_name % n
 
     def add_attributes(var, dsattrs):
         var.attrs.update(
@@ -1 +1,14 @@
-from . import raw2cdf, cdf2nc, rdiadcpy
+import importlib
+
+# modules are imported on first use, see stglib/__init__.py
+_submodules = ["cdf2nc", "raw2cdf", "rdiadcpy", "rdradcp"]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _submodules)
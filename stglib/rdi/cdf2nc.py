@@ -1,21 +1,19 @@
 import xarray as xr
 import numpy as np
 
-from ..core import utils
+from ..core import atmos, monitor, utils
 
 from ..aqd import qaqc
 
 
-def cdf_to_nc(cdf_filename, atmpres=None):
+@monitor.timed
+def cdf_to_nc(cdf_filename, atmpres=None, profile=None):
     """
     Load a "raw" .cdf file and generate a processed .nc file
     """
 
-    # Load raw .cdf data
-    ds = xr.load_dataset(cdf_filename)
-
-    # Clip data to in/out water times or via good_ens
-    ds = utils.clip_ds(ds)
+    # Load raw .cdf data, clipped to in/out water times or via good_ens
+    ds = utils.open_clipped_dataset(cdf_filename)
 
     ds = utils.create_nominal_instrument_depth(ds)
 
@@ -26,12 +24,11 @@ def cdf_to_nc(cdf_filename, atmpres=None):
     if atmpres is not None:
         print("Atmospherically correcting data")
 
-        met = xr.load_dataset(atmpres)
         # need to save attrs before the subtraction, otherwise they are lost
         # ds['P_1ac'] = ds['P_1'].copy(deep=True)
         attrs = ds["P_1"].attrs
-        ds["P_1ac"] = ds["P_1"] - met["atmpres"] - met["atmpres"].offset
-        print("Correcting using offset of %f" % met["atmpres"].offset)
+        ds["P_1ac"] = atmos.atmos_correct(ds["P_1"], atmpres, ds.attrs)
+        print("Correcting using offset of %f" % atmos.load_atmpres(atmpres)["offset"])
         ds["P_1ac"].attrs = attrs
 
     if ds.attrs["RDI_Coord_Transform"] == "BEAM":
@@ -131,7 +128,7 @@ def cdf_to_nc(cdf_filename, atmpres=None):
     VEL = qaqc.make_bin_depth(VEL)
 
     # Reshape and associate dimensions with lat/lon
-    for var in [
+    latlonvars = [
         "U",
         "V",
         "W",
@@ -143,9 +140,8 @@ def cdf_to_nc(cdf_filename, atmpres=None):
         "Roll",
         "bin_depth",
         "Pressure_ac",
-    ]:
-        if var in VEL:
-            VEL = utils.add_lat_lon(VEL, var)
+    ]
+    VEL = utils.add_singleton_dims(VEL, [var for var in latlonvars if var in VEL])
 
     # swap_dims from bindist to depth
     VEL = ds_swap_dims(VEL)
@@ -191,9 +187,11 @@ def cdf_to_nc(cdf_filename, atmpres=None):
         nc_filename = VEL.attrs["filename"] + "-a.nc"
 
     if utils.is_cf(VEL):
-        VEL.to_netcdf(nc_filename, encoding={"time": {"dtype": "i4"}})
+        utils.write_nc(
+            VEL, nc_filename, profile=profile, encoding={"time": {"dtype": "i4"}}
+        )
     else:
-        VEL.to_netcdf(nc_filename, unlimited_dims=["time"])
+        utils.write_nc(VEL, nc_filename, profile=profile, unlimited_dims=["time"])
 
     print("Done writing netCDF file", nc_filename)
 
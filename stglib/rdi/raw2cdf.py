@@ -1,11 +1,11 @@
 import pandas as pd
 import xarray as xr
-import matplotlib.dates
 
-from ..core import utils
-from . import rdradcp, rdiadcpy
+from ..core import monitor, utils
+from . import rdiadcpy
 
 
+@monitor.timed
 def raw_to_cdf(metadata):
     """Load a Aquadopp text files and output to netCDF format"""
 
@@ -201,7 +201,7 @@ def raw_to_cdf(metadata):
     else:
         cdf_filename = ds.attrs["filename"] + "-raw.cdf"
 
-    ds.to_netcdf(cdf_filename, unlimited_dims=["time"])
+    utils.write_nc(ds, cdf_filename, raw=True, unlimited_dims=["time"])
 
     print("Finished writing data to %s" % cdf_filename)
 
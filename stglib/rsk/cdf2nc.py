@@ -3,31 +3,69 @@ from __future__ import division, print_function
 import numpy as np
 import xarray as xr
 
-from ..core import utils
+from ..core import atmos, monitor, utils
 
 
-def cdf_to_nc(cdf_filename, atmpres=None, writefile=True, format="NETCDF3_64BIT"):
+@monitor.timed
+def cdf_to_nc(
+    cdf_filename, atmpres=None, writefile=True, format="NETCDF3_64BIT", profile=None
+):
     """
     Load raw .cdf file, trim, apply QAQC, and save to .nc
     """
 
-    # Load raw .cdf data
-    ds = xr.load_dataset(cdf_filename)
+    # Load raw .cdf data, clipped to in/out water times or via good_ens
+    ds = utils.open_clipped_dataset(cdf_filename)
 
-    # Clip data to in/out water times or via good_ens
-    ds = utils.clip_ds(ds)
+    ds = ds_to_nc(ds, atmpres=atmpres, clip=False)
+
+    if writefile:
+        # Write to .nc file
+        print("Writing cleaned/trimmed data to .nc file")
+        nc_filename = ds.attrs["filename"] + "b-cal.nc"
+
+        # Rename time variables for EPIC compliance, keeping a time_cf
+        # coorindate.
+        utils.write_nc(
+            utils.ds_rename_time_2d(ds),
+            nc_filename,
+            profile=profile,
+            format=format,
+            unlimited_dims=["time"],
+        )
+
+        print("Done writing netCDF file", nc_filename)
+
+    # rename time variables after the fact to conform with EPIC/CMG standards
+    # utils.rename_time(nc_filename)
+
+    return ds
+
+
+@monitor.timed
+def ds_to_nc(ds, atmpres=None, clip=True):
+    """
+    Trim and apply QAQC to a raw Dataset, as loaded from a raw .cdf file or
+    returned by rsk2cdf.rsk_to_xr. Set clip to False if the Dataset has
+    already been clipped with utils.clip_ds.
+    """
+
+    if clip:
+        # Clip data to in/out water times or via good_ens
+        ds = utils.clip_ds(ds)
+
+    ds = utils.to_working_precision(ds)
 
     ds = utils.create_nominal_instrument_depth(ds)
 
     if atmpres is not None:
         print("Atmospherically correcting data")
 
-        met = xr.load_dataset(atmpres)
         # need to save attrs before the subtraction, otherwise they are lost
         # ds['P_1ac'] = ds['P_1'].copy(deep=True)
         attrs = ds["P_1"].attrs
-        ds["P_1ac"] = ds["P_1"] - met["atmpres"] - met["atmpres"].offset
-        print("Correcting using offset of %f" % met["atmpres"].offset)
+        ds["P_1ac"] = atmos.atmos_correct(ds["P_1"], atmpres, ds.attrs)
+        print("Correcting using offset of %f" % atmos.load_atmpres(atmpres)["offset"])
         ds["P_1ac"].attrs = attrs
 
     # ds = utils.shift_time(ds,
@@ -70,22 +108,6 @@ def cdf_to_nc(cdf_filename, atmpres=None, writefile=True, format="NETCDF3_64BIT"
             # cast as float32
             ds = utils.set_var_dtype(ds, var)
 
-    if writefile:
-        # Write to .nc file
-        print("Writing cleaned/trimmed data to .nc file")
-        nc_filename = ds.attrs["filename"] + "b-cal.nc"
-
-        ds.to_netcdf(nc_filename, format=format, unlimited_dims=["time"])
-
-        # Rename time variables for EPIC compliance, keeping a time_cf
-        # coorindate.
-        utils.rename_time_2d(nc_filename, ds)
-
-        print("Done writing netCDF file", nc_filename)
-
-    # rename time variables after the fact to conform with EPIC/CMG standards
-    # utils.rename_time(nc_filename)
-
     return ds
 
 
@@ -0,0 +1,265 @@
+from __future__ import division, print_function
+
+import os
+import warnings
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from ..core import monitor, utils
+from . import cdf2nc, nc2waves, rsk2cdf
+
+
+@monitor.timed
+def update_waves(metadata, atmpres=None, profile=None):
+    """
+    Compute wave statistics for bursts in a (possibly partially downloaded)
+    .rsk file that are not yet in the s-a.nc file, and append them along the
+    unlimited time dimension. If the s-a.nc file does not exist it is created
+    from all bursts in the .rsk file. If store_format is "zarr" the wave
+    statistics are kept in an s-a.zarr store instead.
+
+    Only samples after the last burst already in s-a.nc are read from the
+    .rsk file, so the cost of an update is proportional to the new data.
+
+    Parameters
+    ----------
+    metadata : dict
+        Instrument metadata, as passed to rsk2cdf.rsk_to_cdf
+    atmpres : string, optional
+        Path to cdf file containing atmospheric pressure data
+    profile : dict, optional
+        netCDF output settings used when the s-a.nc file is created, see
+        utils.output_profile
+
+    Returns
+    -------
+    xarray.Dataset or None
+        Wave statistics of the new bursts, or None if there were no new
+        complete bursts
+    """
+
+    if "good_ens" in metadata:
+        raise ValueError(
+            "good_ens cannot be used for incremental processing because "
+            "ensemble indices refer to the full record. Use Deployment_date "
+            "and Recovery_date or good_dates instead"
+        )
+
+    nc_filename = utils.store_path(metadata["filename"] + "s-a.nc", metadata, profile)
+    zarr = utils.get_store_format(metadata, profile) == "zarr"
+
+    if os.path.exists(nc_filename):
+        if zarr:
+            start = next_burst_start_zarr(nc_filename)
+        else:
+            start = next_burst_start(nc_filename)
+        print("Loading bursts starting at {}".format(pd.to_datetime(start, unit="ms")))
+    else:
+        start = None
+        print("{} does not exist; processing all bursts".format(nc_filename))
+
+    # rsk_to_xr pops basefile, so give it a copy
+    ds = rsk2cdf.rsk_to_xr(dict(metadata), start=start)
+
+    if not len(ds["time"]):
+        print("No new complete bursts found")
+        return None
+
+    ds = cdf2nc.ds_to_nc(ds, atmpres=atmpres)
+
+    # the 2D EPIC times are only written to b-cal.nc
+    ds = ds.drop_vars([k for k in ["epic_time_2d", "epic_time2_2d"] if k in ds])
+
+    ds = nc2waves.ds_to_waves(ds)
+
+    if start is None:
+        utils.write_nc(ds, nc_filename, profile=profile, unlimited_dims=["time"])
+        print("Done writing netCDF file", nc_filename)
+    elif zarr:
+        append_waves_zarr(nc_filename, ds)
+        print("Appended {} bursts to {}".format(len(ds["time"]), nc_filename))
+    else:
+        append_waves(nc_filename, ds)
+        print("Appended {} bursts to {}".format(len(ds["time"]), nc_filename))
+
+    return ds
+
+
+def next_burst_start(nc_filename):
+    """
+    Return the earliest possible start of the burst following the last burst
+    in an existing s-a.nc file, in milliseconds since 1970-01-01
+    """
+
+    with netCDF4.Dataset(nc_filename) as nc:
+        if "time_cf" in nc.variables:
+            t = nc["time_cf"]
+        else:
+            t = nc["time"]
+        last = netCDF4.num2date(
+            t[-1],
+            t.units,
+            calendar=getattr(t, "calendar", "standard"),
+            only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True,
+        )
+        burst_length = nc.getncattr("burst_length")
+
+    return pd.Timestamp(last).value // 10**6 + int(round(burst_length * 1000))
+
+
+def append_waves(nc_filename, ds):
+    """
+    Append a wave statistics Dataset, as returned by nc2waves.ds_to_waves, to
+    an existing s-a.nc file along the unlimited time dimension
+    """
+
+    with netCDF4.Dataset(nc_filename, "a") as nc:
+        if "frequency" in nc.variables and not np.allclose(
+            nc["frequency"][:], ds["frequency"].values
+        ):
+            raise ValueError(
+                "Frequencies of new bursts do not match those in %s" % nc_filename
+            )
+
+        n = len(nc.dimensions["time"])
+        k = len(ds["time"])
+
+        for var in nc.variables:
+            if var not in ds.variables or "time" not in nc[var].dimensions:
+                continue
+
+            da = ds[var].transpose(*nc[var].dimensions)
+
+            if np.issubdtype(da.dtype, np.datetime64):
+                vals = netCDF4.date2num(
+                    pd.to_datetime(da.values).to_pydatetime(),
+                    nc[var].units,
+                    calendar=getattr(nc[var], "calendar", "standard"),
+                )
+            else:
+                vals = da.values
+
+            if var == "burst":
+                # burst numbers of the new bursts start from zero
+                vals = vals + nc[var][n - 1] + 1
+
+            if np.issubdtype(nc[var].dtype, np.integer):
+                if not np.all(np.mod(vals, 1) == 0):
+                    warnings.warn(
+                        "Non-integer values of %s were rounded when appending" % var
+                    )
+                vals = np.round(vals).astype(nc[var].dtype)
+
+            nc[var][n : n + k] = np.ma.masked_invalid(vals)
+
+            if "minimum" in nc[var].ncattrs() and "minimum" in ds[var].attrs:
+                nc[var].minimum = np.fmin(nc[var].minimum, ds[var].attrs["minimum"])
+                nc[var].maximum = np.fmax(nc[var].maximum, ds[var].attrs["maximum"])
+
+        nc.stop_time = ds.attrs["stop_time"]
+
+        histtext = "Wave statistics of {} bursts appended incrementally. ".format(k)
+        if "history" in nc.ncattrs():
+            nc.history = histtext + nc.history
+        else:
+            nc.history = histtext
+
+
+def next_burst_start_zarr(store):
+    """
+    Return the earliest possible start of the burst following the last burst
+    in an existing s-a.zarr store, in milliseconds since 1970-01-01
+    """
+
+    # EPIC time and time2 cannot be decoded, so only decode the CF time
+    with xr.open_zarr(store, decode_times=False) as ds:
+        t = "time_cf" if "time_cf" in ds.variables else "time"
+        last = xr.decode_cf(xr.Dataset({t: ds[t].variable[-1:]}))[t].values[0]
+        burst_length = ds.attrs["burst_length"]
+
+    return pd.Timestamp(last).value // 10**6 + int(round(burst_length * 1000))
+
+
+def append_waves_zarr(store, ds):
+    """
+    Append a wave statistics Dataset, as returned by nc2waves.ds_to_waves, to
+    an existing s-a.zarr store along the time dimension.
+
+    The arrays are appended with zarr directly, like append_waves does with
+    netCDF4, because xarray cannot decode the EPIC time units of the store.
+    """
+
+    import zarr
+
+    group = zarr.open_group(store, mode="r+")
+
+    if "frequency" in group and not np.allclose(
+        group["frequency"][:], ds["frequency"].values
+    ):
+        raise ValueError("Frequencies of new bursts do not match those in %s" % store)
+
+    k = len(ds["time"])
+
+    for var, arr in group.arrays():
+        dims = arr.attrs.get("_ARRAY_DIMENSIONS", [])
+        if var not in ds.variables or "time" not in dims:
+            continue
+
+        da = ds[var].transpose(*dims)
+
+        if np.issubdtype(da.dtype, np.datetime64):
+            vals, _, _ = xr.coding.times.encode_cf_datetime(
+                da.values, arr.attrs["units"], arr.attrs.get("calendar", "standard")
+            )
+        else:
+            vals = da.values
+
+        if var == "burst":
+            # burst numbers of the new bursts start from zero
+            vals = vals + arr[-1] + 1
+
+        if "scale_factor" in arr.attrs or "add_offset" in arr.attrs:
+            vals = (vals - arr.attrs.get("add_offset", 0)) / arr.attrs.get(
+                "scale_factor", 1
+            )
+
+        if vals.dtype.kind == "f" and arr.fill_value is not None:
+            vals = np.where(np.isnan(vals), arr.fill_value, vals)
+
+        if np.issubdtype(arr.dtype, np.integer):
+            if not np.all(np.mod(vals, 1) == 0):
+                warnings.warn(
+                    "Non-integer values of %s were rounded when appending" % var
+                )
+            vals = np.round(vals)
+
+        arr.append(vals.astype(arr.dtype), axis=dims.index("time"))
+
+        if "minimum" in arr.attrs and "minimum" in ds[var].attrs:
+            arr.attrs["minimum"] = json_value(
+                np.fmin(arr.attrs["minimum"], ds[var].attrs["minimum"])
+            )
+            arr.attrs["maximum"] = json_value(
+                np.fmax(arr.attrs["maximum"], ds[var].attrs["maximum"])
+            )
+
+    group.attrs["stop_time"] = ds.attrs["stop_time"]
+
+    histtext = "Wave statistics of {} bursts appended incrementally. ".format(k)
+    group.attrs["history"] = histtext + group.attrs.get("history", "")
+
+    zarr.consolidate_metadata(store)
+
+
+def json_value(x):
+    """
+    Convert a numpy scalar or array to a value that can be stored as a Zarr
+    attribute
+    """
+
+    x = np.asarray(x)
+    return x.tolist()
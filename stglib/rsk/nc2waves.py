@@ -1,9 +1,27 @@
 from __future__ import division, print_function
 
-from ..core import utils, waves
+from ..core import monitor, utils, waves
 
 
-def nc_to_waves(nc_filename):
+@monitor.timed
+def nc_to_waves(nc_filename, profile=None):
+
+    ds = open_nc(nc_filename)
+
+    ds = ds_to_waves(ds)
+
+    nc_filename = ds.attrs["filename"] + "s-a.nc"
+
+    utils.write_nc(ds, nc_filename, profile=profile, unlimited_dims=["time"])
+
+    return ds
+
+
+def open_nc(nc_filename):
+    """
+    Open a b-cal.nc file and convert it back to CF time, as needed by
+    ds_to_waves
+    """
 
     ds = utils.open_time_2d_dataset(nc_filename)  # this will deal with a cf file, too
 
@@ -14,6 +32,16 @@ def nc_to_waves(nc_filename):
 
         ds = utils.create_epic_times(ds)
 
+    return ds
+
+
+@monitor.timed
+def ds_to_waves(ds):
+    """
+    Compute wave statistics from a burst Dataset with CF time and return the
+    Dataset ready to be written to s-a.nc
+    """
+
     spec = waves.make_waves_ds(ds)
 
     for k in ["wp_peak", "wh_4061", "wp_4060", "pspec"]:
@@ -39,15 +67,12 @@ def nc_to_waves(nc_filename):
     ds = utils.ds_add_attrs(ds)
 
     # Reshape and associate dimensions with lat/lon
-    for var in ["wp_peak", "wh_4061", "wp_4060", "pspec", "water_depth"]:
-        if var in ds:
-            ds = utils.add_lat_lon(ds, var)
+    latlonvars = ["wp_peak", "wh_4061", "wp_4060", "pspec", "water_depth"]
+    ds = utils.add_singleton_dims(ds, [var for var in latlonvars if var in ds])
 
     # assign min/max (need to do this after trimming):
     ds = utils.add_min_max(ds)
 
-    nc_filename = ds.attrs["filename"] + "s-a.nc"
-
     ds = utils.rename_time(ds)
 
     for var in ds.data_vars:
@@ -55,6 +80,4 @@ def nc_to_waves(nc_filename):
             # cast as float32
             ds = utils.set_var_dtype(ds, var)
 
-    ds.to_netcdf(nc_filename, unlimited_dims=["time"])
-
     return ds
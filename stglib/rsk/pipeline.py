@@ -0,0 +1,218 @@
+from __future__ import division, print_function
+
+import xarray as xr
+
+from ..core import cache, monitor, utils
+from . import cdf2nc, nc2waves, rsk2cdf
+
+# metadata entries that change the data read from the .rsk file, or that
+# rsk_to_xr writes into variables (lat, lon and the P_1 attributes). All
+# other entries are only copied to the global attributes. wave_interval
+# sets the burst length of continuous records, good_ens stops the clip
+# being done when reading and instmeta entries are applied like any other
+RAW_KEYS = [
+    "basefile",
+    "instrument_type",
+    "recording_type",
+    "wave_interval",
+    "Deployment_date",
+    "Recovery_date",
+    "good_dates",
+    "good_ens",
+    "instmeta",
+    "latitude",
+    "longitude",
+    "initial_instrument_height",
+    "serial_number",
+]
+
+# metadata entries only used when computing wave statistics
+WAVES_KEYS = ["wp_min", "wp_max", "wh_min", "wh_max", "wp_ratio"]
+
+
+@monitor.timed
+def rsk_to_waves(
+    metadata, atmpres=None, intermediate=None, profile=None, use_cache=False
+):
+    """
+    Process a d|wave .rsk file to wave statistics in a single process,
+    passing Datasets between the rsk2cdf, cdf2nc and nc2waves steps in memory
+    instead of writing and reading back the -raw.cdf and b-cal.nc files.
+
+    The s-a.nc file is the same as that produced by running
+    runrskrsk2cdf.py, runrskcdf2nc.py and runrsknc2waves.py in turn.
+
+    Parameters
+    ----------
+    metadata : dict
+        Instrument metadata, as passed to rsk2cdf.rsk_to_cdf
+    atmpres : string, optional
+        Path to cdf file containing atmospheric pressure data
+    intermediate : list of str, optional
+        Intermediate files to write as well: "raw" for the -raw.cdf file and
+        "nc" for the b-cal.nc file. Default is to write neither
+    profile : dict, optional
+        netCDF output settings, see utils.output_profile
+    use_cache : bool, optional
+        Keep the -raw.cdf and b-cal.nc files and skip the steps whose inputs
+        have not changed since they were last run, reusing their output
+        files instead. See stage_fingerprints. Default False
+
+    Returns
+    -------
+    xarray.Dataset
+        Wave statistics, as written to the s-a.nc file
+    """
+
+    if intermediate is None:
+        intermediate = []
+
+    for k in intermediate:
+        if k not in ["raw", "nc"]:
+            raise ValueError("intermediate files must be raw or nc, not {}".format(k))
+
+    if use_cache:
+        intermediate = ["raw", "nc"]
+
+    fp = stage_fingerprints(metadata, atmpres=atmpres, profile=profile)
+
+    def filename(suffix):
+        return utils.store_path(metadata["filename"] + suffix, metadata, profile)
+
+    cdf_filename = filename("-raw.cdf")
+    nc_filename = filename("b-cal.nc")
+    waves_filename = filename("s-a.nc")
+
+    if use_cache and cache.is_current(waves_filename, fp["waves"]):
+        print("{} is up to date; nothing to do".format(waves_filename))
+        return xr.load_dataset(
+            waves_filename,
+            engine=utils.store_engine(waves_filename),
+            decode_times=False,
+        )
+
+    if use_cache and cache.is_current(nc_filename, fp["nc"]):
+        print("Using {}; cdf2nc inputs have not changed".format(nc_filename))
+        ds = nc2waves.open_nc(nc_filename).load()
+        ds = update_attrs(ds, metadata, WAVES_KEYS)
+    else:
+        if use_cache and cache.is_current(cdf_filename, fp["raw"]):
+            print("Using {}; rsk2cdf inputs have not changed".format(cdf_filename))
+            ds = xr.load_dataset(cdf_filename, engine=utils.store_engine(cdf_filename))
+            # also remove entries that have been removed from the metadata
+            keys = set(metadata) | set(cache.read_record(cdf_filename)["keys"])
+            ds = update_attrs(ds, metadata, sorted(keys - {"basefile"}))
+        else:
+            # rsk_to_xr pops basefile, so give it a copy
+            ds = rsk2cdf.rsk_to_xr(dict(metadata))
+
+            if "raw" in intermediate:
+                utils.write_nc(ds, cdf_filename, profile=profile, raw=True)
+                print("Finished writing data to %s" % cdf_filename)
+                if use_cache:
+                    cache.save_record(cdf_filename, fp["raw"], keys=sorted(metadata))
+
+        ds = cdf2nc.ds_to_nc(ds, atmpres=atmpres)
+
+        if "nc" in intermediate:
+            utils.write_nc(
+                utils.ds_rename_time_2d(ds),
+                nc_filename,
+                profile=profile,
+                format="NETCDF3_64BIT",
+                unlimited_dims=["time"],
+            )
+            print("Done writing netCDF file", nc_filename)
+            if use_cache:
+                cache.save_record(nc_filename, fp["nc"])
+
+        # nc2waves works from the float32 values stored in b-cal.nc
+        ds = as_written(ds)
+
+        # the 2D EPIC times are only written to b-cal.nc
+        ds = ds.drop_vars([k for k in ["epic_time_2d", "epic_time2_2d"] if k in ds])
+
+    ds = nc2waves.ds_to_waves(ds)
+
+    utils.write_nc(ds, waves_filename, profile=profile, unlimited_dims=["time"])
+    if use_cache:
+        cache.save_record(waves_filename, fp["waves"])
+
+    print("Done writing netCDF file", waves_filename)
+
+    return ds
+
+
+def stage_fingerprints(metadata, atmpres=None, profile=None):
+    """
+    Return the cache fingerprints of the rsk2cdf ("raw"), cdf2nc ("nc") and
+    nc2waves ("waves") steps.
+
+    Each step depends on the fingerprint of the step before it. The raw step
+    depends on the .rsk file and the RAW_KEYS metadata entries; other
+    entries are only copied to the global attributes, which are updated
+    when a cached -raw.cdf file is used. The nc step depends on all metadata
+    except WAVES_KEYS, and on the atmpres file. The waves step depends on
+    WAVES_KEYS. So changing a wave height threshold only reruns the waves
+    step.
+    """
+
+    settings = {
+        k: v
+        for k, v in (profile or {}).items()
+        if (k.startswith("nc_") or k == "store_format") and v is not None
+    }
+
+    raw = cache.fingerprint(
+        "rsk_to_cdf",
+        files=[metadata["basefile"] + ".rsk"],
+        metadata={k: metadata[k] for k in RAW_KEYS if k in metadata},
+        profile=settings,
+    )
+    nc = cache.fingerprint(
+        "cdf_to_nc",
+        files=[atmpres] if atmpres is not None else None,
+        upstream=raw,
+        metadata={k: metadata[k] for k in metadata if k not in WAVES_KEYS},
+        profile=settings,
+    )
+    waves = cache.fingerprint(
+        "nc_to_waves",
+        upstream=nc,
+        metadata={k: metadata[k] for k in WAVES_KEYS if k in metadata},
+        profile=settings,
+    )
+
+    return {"raw": raw, "nc": nc, "waves": waves}
+
+
+def update_attrs(ds, metadata, keys):
+    """
+    Set the global attributes in keys from metadata, as the step that wrote
+    a cached file would have done with the current metadata
+    """
+
+    for k in keys:
+        if k in metadata:
+            ds.attrs[k] = metadata[k]
+        elif k in ds.attrs:
+            del ds.attrs[k]
+
+    return ds
+
+
+def as_written(ds):
+    """
+    Cast variables to the dtype set in their encoding, so later steps see the
+    same values they would after writing the Dataset to disk and reading it
+    back
+    """
+
+    for var in ds.data_vars:
+        dtype = ds[var].encoding.get("dtype")
+        if dtype == "float32" and ds[var].dtype.kind in "iuf":
+            encoding = ds[var].encoding
+            ds[var] = ds[var].astype("float32")
+            ds[var].encoding = encoding
+
+    return ds
@@ -1,14 +1,17 @@
 from __future__ import division, print_function
 
+import os
 import sqlite3
+import urllib.request
 
 import numpy as np
 import pandas as pd
 import xarray as xr
 
-from ..core import utils
+from ..core import monitor, utils
 
 
+@monitor.timed
 def rsk_to_cdf(metadata):
     """
     Main function to load data from RSK file and save to raw .CDF
@@ -18,23 +21,46 @@ def rsk_to_cdf(metadata):
 
     print("Writing to raw netCDF")
 
-    ds.to_netcdf(ds.attrs["filename"] + "-raw.cdf")
+    utils.write_nc(ds, ds.attrs["filename"] + "-raw.cdf", raw=True)
 
     print("Done")
 
     return ds
 
 
-def init_connection(rskfile):
-    """Initialize an sqlite3 connection and return a cursor"""
+def init_connection(rskfile, readonly=True):
+    """Initialize an sqlite3 connection and return a cursor
 
-    conn = sqlite3.connect(rskfile)
+    By default the file is opened read-only and sqlite is allowed to memory
+    map the file and use a larger page cache, which speeds up the full-table
+    scans used to read sample data.
+    """
+
+    if readonly:
+        uri = "file:{}?mode=ro".format(
+            urllib.request.pathname2url(os.path.abspath(rskfile))
+        )
+        conn = sqlite3.connect(uri, uri=True)
+    else:
+        conn = sqlite3.connect(rskfile)
+    conn.execute("PRAGMA mmap_size = 268435456")  # 256 MB
+    conn.execute("PRAGMA cache_size = -65536")  # 64 MB
     return conn.cursor()
 
 
-def rsk_to_xr(metadata):
+@monitor.timed
+def rsk_to_xr(metadata, start=None):
     """
     Load data from RSK file and generate an xarray Dataset
+
+    Parameters
+    ----------
+    metadata : dict
+        Instrument metadata, including basefile
+    start : int, optional
+        Only load samples with timestamps (milliseconds since 1970-01-01) at
+        or after this value. Used for incremental processing of partially
+        downloaded files. Default None (load all samples)
     """
 
     rskfile = metadata.pop("basefile") + ".rsk"
@@ -48,17 +74,20 @@ def rsk_to_xr(metadata):
         % rskfile
     )
 
+    # only set when temperature is stored in a different table than pressure
+    d2 = None
+
     # Assume RBRvirtuoso in burst mode if no attrs
     if "instrument_type" not in ds.attrs:
-        (d, ds) = read_virtuoso_burst(rskfile, ds)
+        (d, ds) = read_virtuoso_burst(rskfile, ds, start=start)
     # Else, check for duo or virtuoso, duo, and recording mode
     elif ds.attrs["instrument_type"] == "rbr_duo":
         if ds.attrs["recording_type"] == "continuous":
             # Continuous
-            (d, d2, ds) = read_duo_continuous(rskfile, ds)
+            (d, ds) = read_duo_continuous(rskfile, ds, start=start)
         elif ds.attrs["recording_type"] == "burst":
             # Burst
-            (d, d2, ds) = read_duo_burst(rskfile, ds)
+            (d, d2, ds) = read_duo_burst(rskfile, ds, start=start)
         else:
             raise ValueError(
                 "recording_type in config file, {:s}, is invalid".format(
@@ -68,10 +97,10 @@ def rsk_to_xr(metadata):
     elif ds.attrs["instrument_type"] == "rbr_virtuoso":
         if ds.attrs["recording_type"] == "continuous":
             # Continuous
-            (d, ds) = read_virtuoso_continuous(rskfile, ds)
+            (d, ds) = read_virtuoso_continuous(rskfile, ds, start=start)
         elif ds.attrs["recording_type"] == "burst":
             # Burst
-            (d, ds) = read_virtuoso_burst(rskfile, ds)
+            (d, ds) = read_virtuoso_burst(rskfile, ds, start=start)
         else:
             raise ValueError(
                 "recording_type in config file, {:s}, is invalid".format(
@@ -87,42 +116,18 @@ def rsk_to_xr(metadata):
 
     samplingcount = ds.attrs["samples_per_burst"]
 
-    # Pressure
-    a = {}
-    a["unixtime"] = d[:, 0].copy()
-    a["pres"] = d[:, 1].copy()
-    # sort by time (not sorted for some reason)
-    sort = np.argsort(a["unixtime"])
-    a["unixtime"] = a["unixtime"][sort]
-    a["pres"] = a["pres"][sort]
-
-    # get indices that end at the end of the final burst
-    datlength = a["unixtime"].shape[0] - a["unixtime"].shape[0] % samplingcount
-
-    # reshape
-    for k in a:
-        a[k] = a[k][:datlength].reshape((int(datlength / samplingcount), samplingcount))
-
-    # If duo, also process temperature
-    if ("instrument_type" in ds.attrs) and (ds.attrs["instrument_type"] == "rbr_duo"):
-        t = {}
-        t["unixtime"] = d2[:, 0].copy()
-        t["temp"] = d2[:, 1].copy()
-        # sort by time (not sorted for some reason)
-        sort = np.argsort(t["unixtime"])
-        t["unixtime"] = t["unixtime"][sort]
-        t["temp"] = t["temp"][sort]
-
-        # get indices that end at the end of the final burst
-        datlength = t["unixtime"].shape[0] - t["unixtime"].shape[0] % samplingcount
-
-        # reshape
-        for k in t:
-            t[k] = t[k][:datlength].reshape(
-                (int(datlength / samplingcount), samplingcount)
+    # sort by time, if necessary, and reshape into bursts
+    a = burst_reshape(d, samplingcount)
+    if d2 is not None:
+        a["temp"] = burst_reshape(d2, samplingcount)["temp"]
+        if a["temp"].shape != a["pres"].shape:
+            raise ValueError(
+                "Temperature has {} bursts but pressure has {}".format(
+                    len(a["temp"]), len(a["pres"])
+                )
             )
 
-    times = pd.to_datetime(a["unixtime"][:, 0], unit="ms")
+    times = pd.to_datetime(a["tstamp"][:, 0], unit="ms")
     samples = np.arange(samplingcount)
 
     ds["P_1"] = xr.DataArray(
@@ -142,9 +147,9 @@ def rsk_to_xr(metadata):
     ds["P_1"].encoding["_FillValue"] = 1e35
 
     # If duo, also save temp
-    if ("instrument_type" in ds.attrs) and (ds.attrs["instrument_type"] == "rbr_duo"):
+    if "temp" in a:
         ds["T_28"] = xr.DataArray(
-            t["temp"],
+            a["temp"],
             coords=[times, samples],
             dims=("time", "sample"),
             name="Temperature",
@@ -154,15 +159,20 @@ def rsk_to_xr(metadata):
                 "epic_code": 28,
                 "serial_number": ds.attrs["serial_number"],
             },
-            encoding={"_FillValue": 1e35},
         )
+        ds["T_28"].encoding["_FillValue"] = 1e35
 
     ds["time"] = xr.DataArray(times, dims=("time"), name="time")
 
     ds["sample"] = xr.DataArray(samples, dims=("sample"), name="sample")
 
+    # bursts keep their number in the full record when the clip is done
+    # in the query
+    first_burst = ds.attrs.pop("_first_burst", 0)
     ds["burst"] = xr.DataArray(
-        np.arange(len(times)), dims=("time"), attrs={"long_name": "burst number"}
+        first_burst + np.arange(len(times)),
+        dims=("time"),
+        attrs={"long_name": "burst number"},
     )
 
     ds["lat"] = xr.DataArray(
@@ -185,21 +195,254 @@ def rsk_to_xr(metadata):
     return ds
 
 
-def read_virtuoso_burst(rskfile, ds):
+def tstamp_where(start=None, end=None):
+    """
+    Build a SQL WHERE clause restricting tstamp, along with its parameters
+    """
+
+    if start is None and end is None:
+        return "", ()
+    elif end is None:
+        return " WHERE tstamp >= ?", (int(start),)
+    elif start is None:
+        return " WHERE tstamp <= ?", (int(end),)
+    else:
+        return " WHERE tstamp BETWEEN ? AND ?", (int(start), int(end))
+
+
+def date_to_ms(date):
+    """
+    Return the first and last millisecond (since 1970-01-01) covered by a
+    date from the metadata, as used by utils.clip_ds
+    """
+
+    first, last = utils.date_bounds(date)
+
+    # sqlite needs python ints rather than numpy integers
+    return (
+        int(first.astype("datetime64[ms]").astype(np.int64)),
+        int(last.astype("datetime64[ms]").astype(np.int64)),
+    )
+
+
+def clip_bounds(conn, table, ds, start=None):
+    """
+    Convert good_dates, or Deployment_date and Recovery_date, into tstamp
+    bounds for fetch_data so that out-of-water samples are never read.
+
+    The bounds are aligned to burst boundaries: the bursts that are read are
+    exactly those that would have been kept by utils.clip_ds, i.e. those
+    whose first sample falls within the dates, and each is read in full.
+    Bursts are counted from the first sample at or after start, as in
+    rsk_to_xr. good_ens refers to indices of the full record and is left to
+    utils.clip_ds.
+
+    Returns
+    -------
+    tuple
+        (ds, start, end), with the clip recorded in the history of ds
+    """
+
+    lo, hi, name, skipped = burst_bounds(conn, table, ds, start=start)
+    # rsk_to_xr numbers the bursts read from here, as in the full record
+    ds.attrs["_first_burst"] = skipped
+    if name is None:
+        return ds, lo, hi
+
+    if hi is not None and lo > hi:
+        print("No bursts within {} found in .rsk file".format(name))
+    else:
+        print(
+            "Reading samples between {} and {} from .rsk file".format(
+                pd.to_datetime(lo, unit="ms"),
+                "end of file" if hi is None else pd.to_datetime(hi, unit="ms"),
+            )
+        )
+
+    ds = utils.insert_history(
+        ds,
+        "Samples outside of bursts within {} not read from .rsk file. ".format(name),
+    )
+
+    return ds, lo, hi
+
+
+def burst_bounds(conn, table, ds, start=None):
+    """
+    Return the tstamp bounds of clip_bounds for table, a description of
+    the dates they come from and the number of bursts before the lower
+    bound, without printing or recording them. The description is None,
+    and end None, if the data are not clipped. If no bursts are within the
+    dates, start is greater than end.
+    """
+
+    if "good_ens" in ds.attrs:
+        return start, None, None, 0
+    elif "good_dates" in ds.attrs:
+        dates = ds.attrs["good_dates"]
+        name = "good_dates of {}".format(dates)
+    elif "Deployment_date" in ds.attrs and "Recovery_date" in ds.attrs:
+        dates = [ds.attrs["Deployment_date"], ds.attrs["Recovery_date"]]
+        name = "Deployment_date of {} and Recovery_date of {}".format(*dates)
+    else:
+        return start, None, None, 0
+
+    first = date_to_ms(dates[0])[0]
+    last = date_to_ms(dates[1])[1]
+    samplingcount = ds.attrs["samples_per_burst"]
+
+    where, params = tstamp_where(start=start)
+    if where:
+        where += " AND"
+    else:
+        where = " WHERE"
+
+    def count_where(op, t):
+        return conn.execute(
+            "SELECT COUNT(*) FROM " + table + where + " tstamp " + op + " ?",
+            params + (t,),
+        ).fetchone()[0]
+
+    def nth_tstamp(n):
+        row = conn.execute(
+            "SELECT tstamp FROM "
+            + table
+            + tstamp_where(start=start)[0]
+            + " ORDER BY tstamp LIMIT 1 OFFSET ?",
+            params + (n,),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    # first sample of the first burst starting at or after the first date
+    nbefore = count_where("<", first)
+    skipped = -(-nbefore // samplingcount)
+    lo = nth_tstamp(skipped * samplingcount)
+
+    # last sample of the last burst starting at or before the last date
+    nthrough = count_where("<=", last)
+    if nthrough:
+        hi = nth_tstamp(-(-nthrough // samplingcount) * samplingcount - 1)
+
+    if lo is None or not nthrough or (hi is not None and lo > hi):
+        # select nothing
+        lo, hi = first, first - 1
+
+    return lo, hi, name, skipped
+
+
+def is_tstamp_indexed(conn, table):
+    """
+    Check whether rows of table can be returned in tstamp order without a
+    sort, i.e. tstamp is the integer primary key or leads an index
+    """
+
+    for col in conn.execute("PRAGMA table_info(" + table + ")").fetchall():
+        # columns are cid, name, type, notnull, dflt_value, pk
+        if col[1].lower() == "tstamp" and col[2].upper() == "INTEGER" and col[5]:
+            return True
+
+    for idx in conn.execute("PRAGMA index_list(" + table + ")").fetchall():
+        cols = conn.execute("PRAGMA index_info(" + idx[1] + ")").fetchall()
+        if cols and cols[0][2].lower() == "tstamp":
+            return True
+
+    return False
+
+
+@monitor.timed
+def fetch_data(conn, table, channels, start=None, end=None, chunksize=1000000):
+    """
+    Read tstamp and one or more channels from a data table in a single query,
+    optionally restricted to samples between start and end.
+
+    Rather than building a list of tuples of the full result, the number of
+    rows is queried first, arrays are preallocated and the rows are copied in
+    chunks of chunksize rows. When tstamp is indexed the rows are requested in
+    time order, which the database can provide without sorting.
+
+    Parameters
+    ----------
+    conn : sqlite3.Cursor
+        Cursor returned by init_connection
+    table : string
+        Name of the table, e.g. burstData or data
+    channels : dict
+        Mapping of output field names to channel columns, e.g.
+        {"pres": "channel02", "temp": "channel01"}
+    start : int, optional
+        Only read samples at or after this time (milliseconds since
+        1970-01-01)
+    end : int, optional
+        Only read samples at or before this time (milliseconds since
+        1970-01-01)
+    chunksize : int, optional
+        Number of rows to fetch at a time. Default 1000000
+
+    Returns
+    -------
+    numpy.ndarray
+        Structured array with an int64 tstamp field (milliseconds since
+        1970-01-01) and a float32 field for each channel
+    """
+
+    where, params = tstamp_where(start=start, end=end)
+
+    n = conn.execute("SELECT COUNT(*) FROM " + table + where, params).fetchone()[0]
+
+    dtype = [("tstamp", np.int64)] + [(k, np.float32) for k in channels]
+    d = np.empty(n, dtype=dtype)
+
+    query = "SELECT tstamp, " + ", ".join(channels.values()) + " FROM " + table + where
+    if is_tstamp_indexed(conn, table):
+        query += " ORDER BY tstamp"
+
+    conn.execute(query, params)
+    i = 0
+    while i < n:
+        rows = conn.fetchmany(min(chunksize, n - i))
+        if not rows:
+            break
+        d[i : i + len(rows)] = np.array(rows, dtype=dtype)
+        i += len(rows)
+
+    return d[:i]
+
+
+def burst_reshape(d, samplingcount):
+    """
+    Sort a structured array returned by fetch_data by time, only if it is not
+    already sorted, and reshape each field into (burst, sample), dropping any
+    incomplete final burst
+    """
+
+    if np.any(d["tstamp"][1:] < d["tstamp"][:-1]):
+        d = d[np.argsort(d["tstamp"])]
+
+    # get indices that end at the end of the final burst
+    datlength = len(d) - len(d) % samplingcount
+    d = d[:datlength]
+
+    return {
+        k: np.ascontiguousarray(d[k]).reshape((-1, samplingcount))
+        for k in d.dtype.names
+    }
+
+
+def read_virtuoso_burst(rskfile, ds, start=None):
     conn = init_connection(rskfile)
 
+    # Read sampling meta info
+    ds = utils.read_samplingrates_burst(ds, conn)
+
     try:
-        conn.execute(
-            "SELECT tstamp, channel01 FROM burstdata"
-        )  # sometimes maybe is case sensitive?
+        # sometimes maybe is case sensitive?
+        ds, start, end = clip_bounds(conn, "burstdata", ds, start=start)
+        d = fetch_data(conn, "burstdata", {"pres": "channel01"}, start=start, end=end)
     except sqlite3.OperationalError:
-        conn.execute("SELECT tstamp, channel01 FROM burstData")  # note capital "D"
-    data = conn.fetchall()
+        # note capital "D"
+        ds, start, end = clip_bounds(conn, "burstData", ds, start=start)
+        d = fetch_data(conn, "burstData", {"pres": "channel01"}, start=start, end=end)
     print("Done fetching pressure data")
-    d = np.asarray(data)
-
-    # Read sampling meta info
-    ds = utils.read_samplingrates_burst(ds, conn)
 
     # Get instr meta
     ds.attrs["serial_number"] = str(
@@ -212,17 +455,16 @@ def read_virtuoso_burst(rskfile, ds):
     return (d, ds)
 
 
-def read_virtuoso_continuous(rskfile, ds):  # UNTESTED
+def read_virtuoso_continuous(rskfile, ds, start=None):  # UNTESTED
     conn = init_connection(rskfile)
 
-    conn.execute("SELECT tstamp, channel01 FROM data")
-    data = conn.fetchall()
-    print("Done fetching pressure data")
-    d = np.asarray(data)
-
     # Read sampling meta info
     ds = utils.read_samplingrates_continuous(ds, conn)
 
+    ds, start, end = clip_bounds(conn, "data", ds, start=start)
+    d = fetch_data(conn, "data", {"pres": "channel01"}, start=start, end=end)
+    print("Done fetching pressure data")
+
     # Get meta
     ds.attrs["serial_number"] = str(
         conn.execute("select serialID from instruments").fetchall()[0][0]
@@ -234,24 +476,23 @@ def read_virtuoso_continuous(rskfile, ds):  # UNTESTED
     return (d, ds)
 
 
-def read_duo_continuous(rskfile, ds):
+def read_duo_continuous(rskfile, ds, start=None):
     conn = init_connection(rskfile)
 
-    # First load in pressure
-    conn.execute("SELECT tstamp, channel02 FROM data")
-    data = conn.fetchall()
-    print("Done fetching pressure data")
-    d = np.asarray(data)
-
-    # Second load in temprature
-    conn.execute("SELECT tstamp, channel01 FROM data")
-    data = conn.fetchall()
-    print("Done fetching temperature data")
-    t = np.asarray(data)
-
     # Read sampling meta info
     ds = utils.read_samplingrates_continuous(ds, conn)
 
+    # Load pressure and temperature together in a single pass
+    ds, start, end = clip_bounds(conn, "data", ds, start=start)
+    d = fetch_data(
+        conn,
+        "data",
+        {"pres": "channel02", "temp": "channel01"},
+        start=start,
+        end=end,
+    )
+    print("Done fetching pressure and temperature data")
+
     # Get instr meta
     ds.attrs["serial_number"] = str(
         conn.execute("select serialID from instruments").fetchall()[0][0]
@@ -260,26 +501,25 @@ def read_duo_continuous(rskfile, ds):
 
     conn.close()
 
-    return (d, t, ds)
+    return (d, ds)
 
 
-def read_duo_burst(rskfile, ds):
+def read_duo_burst(rskfile, ds, start=None):
     conn = init_connection(rskfile)
 
+    # Read sampling meta info
+    ds = utils.read_samplingrates_burst(ds, conn)
+
     # First pressure
-    conn.execute("SELECT tstamp, channel02 FROM burstdata")
-    data = conn.fetchall()
+    # temperature is in its own table, so its bursts are located separately
+    tstart, tend = burst_bounds(conn, "data", ds, start=start)[:2]
+    ds, start, end = clip_bounds(conn, "burstdata", ds, start=start)
+    d = fetch_data(conn, "burstdata", {"pres": "channel02"}, start=start, end=end)
     print("Done fetching pressure data")
-    d = np.asarray(data)
 
     # Second load in temprature
-    conn.execute("SELECT tstamp, channel01 FROM data")
-    data = conn.fetchall()
+    t = fetch_data(conn, "data", {"temp": "channel01"}, start=tstart, end=tend)
     print("Done fetching temperature data")
-    t = np.asarray(data)
-
-    # Read sampling meta info
-    ds = utils.read_samplingrates_burst(ds, conn)
 
     # Get instr meta
     ds.attrs["serial_number"] = str(
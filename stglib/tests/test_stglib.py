@@ -1,4 +1,7 @@
 import os
+import shutil
+import sqlite3
+import tempfile
 import unittest
 
 import numpy as np
@@ -7,6 +10,16 @@ import xarray as xr
 
 import stglib
 
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
@@ -19,6 +32,51 @@ class TestGlobalAttributes(unittest.TestCase):
         assert gatts["MOORING"] == "1076"
 
 
+def make_iq_mat(n=10):
+    """Make the variables of a minimal SonTek IQ .mat export"""
+    return {
+        "FlowData_SampleTime": (6e14 + np.arange(n) * 9e8)[:, None],
+        "FlowData_Depth": np.random.rand(n, 1),
+        "FlowData_Vel": np.random.rand(n, 4),
+        "Profile_0_Vel": np.random.rand(n + 1, 20),
+        "FlowSubData_PrfHeader_0_BlankingDistance": np.random.rand(n + 1, 1),
+        "FlowSubData_PrfHeader_0_CellSize": np.random.rand(n + 1, 1),
+        "Data_Units": {"FlowData_Vel": "mm/s", "FlowData_Depth": "m"},
+        "System_IqSetup": {"basicSetup": {"Channel": 2.0}},
+        "System_Id": {"SerialNumber": "IQ1234"},
+        "System_IqState": {"State": 1.0},
+    }
+
+
+def write_mat73(filename, mat):
+    """
+    Write a dict of arrays, strings and dicts as a MATLAB v7.3 .mat file: an
+    HDF5 file with a 512 byte header, column-major (transposed) datasets, a
+    MATLAB_class attribute on each, and structs as groups
+    """
+
+    def write(group, k, v):
+        if isinstance(v, dict):
+            sub = group.create_group(k)
+            sub.attrs["MATLAB_class"] = np.bytes_("struct")
+            for kk, vv in v.items():
+                write(sub, kk, vv)
+        elif isinstance(v, str):
+            chars = np.array([[ord(c) for c in v]], dtype=np.uint16)
+            group.create_dataset(k, data=chars.T)
+            group[k].attrs["MATLAB_class"] = np.bytes_("char")
+        else:
+            group.create_dataset(k, data=np.atleast_2d(v).T)
+            group[k].attrs["MATLAB_class"] = np.bytes_("double")
+
+    with h5py.File(filename, "w", userblock_size=512) as f:
+        for k, v in mat.items():
+            write(f, k, v)
+
+    with open(filename, "r+b") as f:
+        f.write(b"MATLAB 7.3 MAT-file".ljust(116) + bytes(12) + b"\x00\x02IM")
+
+
 class TestIq(unittest.TestCase):
     def setUp(self):
         self.ds = xr.Dataset()
@@ -34,6 +92,210 @@ class TestIq(unittest.TestCase):
         for v in ["FlowData_Vel", "FlowData_Vel_Mean"]:
             np.testing.assert_array_equal(result[v], expected[v])
 
+    def test_read_iq_variables(self):
+        import scipy.io
+
+        mat = make_iq_mat()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filnam = os.path.join(tmpdir, "iq.mat")
+            scipy.io.savemat(filnam, mat)
+            full = stglib.iq.read_iq(filnam)
+            ds = stglib.iq.read_iq(filnam, variables=["FlowData_Vel"])
+
+        assert "Profile_0_Vel" in full
+        # the profile headers are one profile longer, like the profiles
+        np.testing.assert_array_equal(
+            full["FlowSubData_PrfHeader_0_CellSize"],
+            mat["FlowSubData_PrfHeader_0_CellSize"][:-1, 0],
+        )
+        assert "cells_0" in stglib.iq.make_beamdist(full).coords
+        assert "FlowSubData_PrfHeader_0_CellSize" not in ds
+        assert "Profile_0_Vel" not in ds and "FlowData_Depth" not in ds
+        np.testing.assert_array_equal(ds["FlowData_Vel"], mat["FlowData_Vel"])
+        xr.testing.assert_identical(ds["FlowData_Vel"], full["FlowData_Vel"])
+        assert ds.attrs["SerialNumber"] == "IQ1234"
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filnam = os.path.join(tmpdir, "iq.mat")
+            scipy.io.savemat(filnam, mat)
+            ds = stglib.iq.read_iq(filnam, variables=["FlowData_*"])
+        assert "Profile_0_Vel" not in ds and "FlowData_Depth" in ds
+
+    @unittest.skipUnless(h5py, "h5py is not installed")
+    def test_read_iq_mat73(self):
+        import scipy.io
+
+        mat = make_iq_mat()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            v5 = os.path.join(tmpdir, "iq5.mat")
+            v73 = os.path.join(tmpdir, "iq73.mat")
+            scipy.io.savemat(v5, mat)
+            write_mat73(v73, mat)
+            self.assertFalse(stglib.utils.is_mat73(v5))
+            self.assertTrue(stglib.utils.is_mat73(v73))
+
+            for variables in [None, ["FlowData_Vel"]]:
+                expected = stglib.iq.read_iq(v5, variables=variables)
+                result = stglib.iq.read_iq(v73, variables=variables)
+                xr.testing.assert_identical(result, expected)
+                self.assertEqual(result.attrs, expected.attrs)
+
+    def test_make_beamdist(self):
+        n = 6
+        ds = xr.Dataset(coords={"time": pd.date_range("2020-01-01", periods=n)})
+        for bm in range(4):
+            dim = "cell_along" if bm < 2 else "cell_across"
+            ds["Profile_%d_Vel" % bm] = (("time", dim), np.random.rand(n, 3))
+            ds["FlowSubData_PrfHeader_%d_BlankingDistance" % bm] = (
+                "time",
+                np.random.rand(n),
+            )
+            ds["FlowSubData_PrfHeader_%d_CellSize" % bm] = ("time", np.random.rand(n))
+        result = stglib.iq.make_beamdist(ds)
+
+        for bm in range(4):
+            blank = ds["FlowSubData_PrfHeader_%d_BlankingDistance" % bm].values
+            size = ds["FlowSubData_PrfHeader_%d_CellSize" % bm].values
+            np.testing.assert_allclose(
+                result["cells_%d" % bm],
+                blank[:, None] + np.arange(3) * size[:, None],
+            )
+            np.testing.assert_array_equal(
+                result["time_%d" % bm], np.tile(ds["time"], (3, 1)).T
+            )
+
+
+class TestExo(unittest.TestCase):
+    def setUp(self):
+        n = 12
+        ds = xr.Dataset()
+        ds["time"] = xr.DataArray(
+            pd.date_range("2020-01-01", periods=n, freq="15min"), dims="time"
+        )
+        for var in ["S_41", "T_28", "Turb", "DO", "pH_159"]:
+            ds[var] = xr.DataArray(np.full(n, 10.0), dims="time")
+            ds[var].attrs["note"] = "Original note. "
+        ds["S_41"][[2, 4]] = [7, 13]
+        ds["T_28"][3:6] = 13
+        ds["Turb"][[4, 8]] = [25, 15]
+        ds["DO"][1] = 12
+        ds["P_1"] = xr.DataArray(np.full(n, 10, dtype="f4"), dims="time")
+        ds["P_1"][[2, 5]] = [9, 11.5]
+        ds["P_1"].attrs["note"] = "Original note. "
+        ds.attrs.update(
+            {
+                "S_41_min": 8.0,
+                "S_41_max": 12.0,
+                "T_28_min_diff": -2.0,
+                "T_28_max_diff": 2.0,
+                "T_28_bad_ens": [3, 5, 10, 11],
+                "Turb_med_diff": 1.5,
+                "Turb_max": 19.0,
+                "DO_med_diff_pct": 10.0,
+                "DO_bad_ens": ["2020-01-01 02:00", "2020-01-01 02:30"],
+                "P_1_min": 9.5,
+                "P_1_max_diff": 1.0,
+                "kernel_size": 3,
+                "trim_by_salinity": "true",
+            }
+        )
+        self.ds = ds
+
+    def test_exo_qaqc(self):
+        salinity = "Values filled using valid salinity threshold. "
+        bad_ens = "Data clipped using bad_ens values of [3, 5, 10, 11]. "
+        notes = {
+            "S_41": "Values filled where greater than 12.000000 units. "
+            "Values filled where less than 8.000000 units. ",
+            "T_28": bad_ens
+            + bad_ens
+            + "Values filled where data increases by more than 2.000000 "
+            "units in a single time step. "
+            "Values filled where data decreases by more than -2.000000 "
+            "units in a single time step. ",
+            "Turb": "Values filled where difference between 3-point median "
+            "filter and original values is greater than 1.500000. "
+            "Values filled where greater than 19.000000 units. ",
+            "DO": "Data clipped using bad_ens values of "
+            "['2020-01-01 02:00', '2020-01-01 02:30']. "
+            "Values filled where percent difference between 3-point median "
+            "filter and original values is greater than 10.000000. ",
+            "pH_159": "",
+            "P_1": "Values filled where data increases by more than 1.000000 "
+            "units in a single time step. "
+            "Values filled where less than 9.500000 units. ",
+        }
+        # filled values, with and without trim_by_salinity
+        filled = {
+            "S_41": ([2, 4], [2, 4]),
+            "T_28": ([3, 4, 6, 10], [2, 3, 4, 6, 10]),
+            "Turb": ([4, 8], [2, 4, 8]),
+            "DO": ([1, 8, 9, 10], [1, 2, 4, 8, 9, 10]),
+            "pH_159": ([], [2, 4]),
+            "P_1": ([2, 5], [2, 4, 5]),
+        }
+
+        for exclude in [["pH_159"], ["S_41", "DO"]]:
+            self.ds.attrs["trim_by_salinity_exclude"] = exclude
+            result = stglib.exo.exo_qaqc(self.ds.copy(deep=True))
+
+            for var in filled:
+                expected = self.ds[var].values.copy()
+                note = notes[var]
+                if var in exclude:
+                    expected[filled[var][0]] = np.nan
+                else:
+                    expected[filled[var][1]] = np.nan
+                    if var != "S_41":
+                        note = salinity + note
+                np.testing.assert_array_equal(result[var], expected)
+                self.assertEqual(result[var].attrs["note"], note + "Original note. ")
+            self.assertEqual(result["P_1"].dtype, np.float32)
+
+    def test_med_diff_and_pct(self):
+        ds = self.ds[["time", "Turb"]].isel(time=slice(7))
+        ds["Turb"][:] = [10, 10, 30, 13, 10, 10, 10]
+        ds.attrs = {"Turb_med_diff": 5.0, "Turb_med_diff_pct": 10.0, "kernel_size": 3}
+
+        # med_diff_pct reuses the median from before med_diff filled the spike
+        result = stglib.exo.exo_qaqc(ds.copy(deep=True))
+        np.testing.assert_array_equal(result["Turb"], [10, 10, np.nan, 13, 10, 10, 10])
+
+        # applying the rules in turn recomputes the median without the spike
+        result = stglib.exo.trim_med_diff(ds.copy(deep=True), "Turb")
+        result = stglib.exo.trim_med_diff_pct(result, "Turb")
+        np.testing.assert_array_equal(
+            result["Turb"], [10, 10, np.nan, np.nan, 10, 10, 10]
+        )
+
+    def test_read_exo(self):
+        lines = [
+            "KOR Export File,,,",
+            "Sonde ID,Sonde 13C101234,,",
+            "Wiped CT,13C100003,,1;2",
+            "Depth Non-Vented 0-10m,13C100007,,3",
+            "Date (MM/DD/YYYY),Time (HH:MM:SS),Temp °C,Cond µS/cm,Pressure psi a",
+            "12/31/2019,23:45:00,10.5,30.1,5.0",
+            "01/01/2020,00:00:00,10.6,30.2,5.1",
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filnam = os.path.join(tmpdir, "exo.csv")
+            # old versions of Mac Excel write Mac OS Roman and \r line endings
+            with open(filnam, "w", encoding="mac-roman", newline="") as f:
+                f.write("\r".join(lines) + "\r")
+            ds = stglib.exo.read_exo(filnam, skiprows=4)
+
+        np.testing.assert_array_equal(
+            ds["time"],
+            np.array(["2019-12-31T23:45", "2020-01-01T00:00"], dtype="datetime64[ns]"),
+        )
+        np.testing.assert_array_equal(ds["Temp_°C"], [10.5, 10.6])
+        self.assertEqual(ds.attrs["serial_number"], "13C101234")
+        self.assertEqual(
+            ds["Cond_µS_per_cm"].attrs["sensor_serial_number"], "13C100003"
+        )
+        self.assertEqual(ds["Press_dbar"].attrs["sensor_serial_number"], "13C100007")
+
 
 class TestTimes(unittest.TestCase):
     def setUp(self):
@@ -293,5 +555,416 @@ class TestWaves(unittest.TestCase):
         np.testing.assert_allclose(result, expected)
 
 
+def make_rsk(filename, nbursts=6, spb=512, sample_ms=250, interval_ms=3600000):
+    """Make a minimal RBR virtuoso burst-mode .rsk (sqlite) file"""
+    t0 = int(np.datetime64("2016-10-20 15:00", "ms").astype(int))
+    rng = np.random.default_rng(0)
+    t = np.arange(spb) * sample_ms / 1000
+
+    rows = []
+    for n in range(nbursts):
+        p = 3 + 0.001 * rng.standard_normal(spb)
+        for f in [0.1, 0.125, 0.15, 0.2]:
+            p += 0.05 * np.sin(2 * np.pi * f * t + rng.uniform(0, 2 * np.pi))
+        tstamp = t0 + n * interval_ms + np.arange(spb) * sample_ms
+        rows.extend(zip(tstamp.tolist(), p.tolist()))
+    # RSK files are not necessarily stored in time order
+    rng.shuffle(rows)
+
+    conn = sqlite3.connect(filename)
+    conn.execute(
+        "CREATE TABLE burstData (tstamp BIGINT PRIMARY KEY ASC, channel01 DOUBLE)"
+    )
+    conn.executemany("INSERT INTO burstData VALUES (?, ?)", rows)
+    conn.execute(
+        "CREATE TABLE schedules "
+        "(samplingcount INTEGER, samplingperiod INTEGER, repetitionperiod INTEGER)"
+    )
+    conn.execute(
+        "INSERT INTO schedules VALUES (?, ?, ?)", (spb, sample_ms, interval_ms)
+    )
+    conn.execute("CREATE TABLE instruments (serialID INTEGER)")
+    conn.execute("INSERT INTO instruments VALUES (55110)")
+    conn.commit()
+    conn.close()
+
+    return t0
+
+
+class TestRsk(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        self.t0 = make_rsk("full.rsk")
+        self.metadata = {
+            "basefile": "test",
+            "filename": "test",
+            "initial_instrument_height": 0.15,
+            "latitude": 30.1,
+            "longitude": -88.2,
+            "WATER_DEPTH": 3.15,
+            "Deployment_date": "2016-10-20 16:00",
+            "Recovery_date": "2016-10-21 00:00",
+        }
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_fetch_data(self):
+        conn = stglib.rsk.rsk2cdf.init_connection("full.rsk")
+        expected = np.asarray(
+            conn.execute("SELECT tstamp, channel01 FROM burstData").fetchall()
+        )
+        expected = expected[np.argsort(expected[:, 0])]
+        result = stglib.rsk.rsk2cdf.fetch_data(
+            conn, "burstData", {"pres": "channel01"}, chunksize=1000
+        )
+        self.assertEqual(result.itemsize, 12)
+        # tstamp is the primary key so data are returned sorted
+        np.testing.assert_array_equal(result["tstamp"], expected[:, 0])
+        np.testing.assert_array_equal(result["pres"], expected[:, 1].astype("f4"))
+
+        result = stglib.rsk.rsk2cdf.fetch_data(
+            conn, "burstData", {"pres": "channel01"}, start=self.t0 + 3600000
+        )
+        np.testing.assert_array_equal(
+            result["tstamp"], expected[expected[:, 0] >= self.t0 + 3600000, 0]
+        )
+        conn.close()
+
+    def test_duo_continuous(self):
+        conn = sqlite3.connect("test.rsk")
+        conn.execute(
+            "CREATE TABLE data "
+            "(tstamp BIGINT PRIMARY KEY ASC, channel01 DOUBLE, channel02 DOUBLE)"
+        )
+        tstamp = self.t0 + 500 * np.arange(1000)
+        # temperature in channel01, pressure in channel02
+        conn.executemany(
+            "INSERT INTO data VALUES (?, ?, ?)",
+            zip(tstamp[::-1].tolist(), range(1000, 0, -1), range(2000, 1000, -1)),
+        )
+        conn.execute("CREATE TABLE schedules (samplingperiod INTEGER)")
+        conn.execute("INSERT INTO schedules VALUES (500)")
+        conn.execute("CREATE TABLE instruments (serialID INTEGER)")
+        conn.execute("INSERT INTO instruments VALUES (77000)")
+        conn.commit()
+        conn.close()
+
+        metadata = dict(
+            self.metadata,
+            Recovery_date="2016-10-20 15:07",
+            instrument_type="rbr_duo",
+            recording_type="continuous",
+            wave_interval=60,
+        )
+        ds = stglib.rsk.rsk2cdf.rsk_to_xr(dict(metadata))
+
+        # all samples are before Deployment_date
+        self.assertEqual(ds["P_1"].shape, (0, 120))
+
+        ds = stglib.rsk.rsk2cdf.rsk_to_xr(dict(metadata, Deployment_date="2016-10-20"))
+        self.assertEqual(ds["P_1"].shape, (8, 120))
+        np.testing.assert_array_equal(
+            ds["T_28"].values.ravel(), np.arange(1, 961, dtype="f4")
+        )
+        np.testing.assert_array_equal(ds["P_1"] - ds["T_28"], 1000)
+        np.testing.assert_array_equal(
+            ds["time"], pd.to_datetime(tstamp[:960:120], unit="ms")
+        )
+
+    def test_pipeline_cache_wave_interval(self):
+        n = 4800
+        t = 0.5 * np.arange(n)
+        conn = sqlite3.connect("cont.rsk")
+        conn.execute(
+            "CREATE TABLE data "
+            "(tstamp BIGINT PRIMARY KEY ASC, channel01 DOUBLE, channel02 DOUBLE)"
+        )
+        conn.executemany(
+            "INSERT INTO data VALUES (?, 20, ?)",
+            zip(
+                (self.t0 + 500 * np.arange(n)).tolist(),
+                (3 + 0.05 * np.sin(2 * np.pi * 0.1 * t)).tolist(),
+            ),
+        )
+        conn.execute("CREATE TABLE schedules (samplingperiod INTEGER)")
+        conn.execute("INSERT INTO schedules VALUES (500)")
+        conn.execute("CREATE TABLE instruments (serialID INTEGER)")
+        conn.execute("INSERT INTO instruments VALUES (77000)")
+        conn.commit()
+        conn.close()
+
+        metadata = dict(
+            self.metadata,
+            basefile="cont",
+            filename="cont",
+            Deployment_date="2016-10-20",
+            instrument_type="rbr_duo",
+            recording_type="continuous",
+            wave_interval=600,
+        )
+        stglib.rsk.pipeline.rsk_to_waves(metadata, use_cache=True)
+        with xr.open_dataset("cont-raw.cdf") as ds:
+            self.assertEqual(ds["P_1"].shape, (4, 1200))
+
+        # bursts are cut from continuous data by wave_interval
+        metadata["wave_interval"] = 1200
+        stglib.rsk.pipeline.rsk_to_waves(metadata, use_cache=True)
+        with xr.open_dataset("cont-raw.cdf") as ds:
+            self.assertEqual(ds["P_1"].shape, (2, 2400))
+
+    def test_duo_burst(self):
+        conn = sqlite3.connect("test.rsk")
+        conn.execute(
+            "CREATE TABLE burstData "
+            "(tstamp BIGINT PRIMARY KEY ASC, channel01 DOUBLE, channel02 DOUBLE)"
+        )
+        conn.execute("CREATE TABLE data (tstamp BIGINT PRIMARY KEY ASC, channel01)")
+        tstamp = (
+            self.t0 + 3600000 * np.arange(4)[:, None] + 500 * np.arange(8)
+        ).ravel()
+        conn.executemany(
+            "INSERT INTO burstData VALUES (?, 0, ?)",
+            zip(tstamp.tolist(), range(1000, 1032)),
+        )
+        # temperature is logged a little after pressure
+        conn.executemany(
+            "INSERT INTO data VALUES (?, ?)", zip((tstamp + 10).tolist(), range(32))
+        )
+        conn.execute(
+            "CREATE TABLE schedules "
+            "(samplingcount INTEGER, samplingperiod INTEGER, repetitionperiod INTEGER)"
+        )
+        conn.execute("INSERT INTO schedules VALUES (8, 500, 3600000)")
+        conn.execute("CREATE TABLE instruments (serialID INTEGER)")
+        conn.execute("INSERT INTO instruments VALUES (77000)")
+        conn.commit()
+        conn.close()
+
+        metadata = dict(
+            self.metadata,
+            Recovery_date="2016-10-20 17:00",
+            instrument_type="rbr_duo",
+            recording_type="burst",
+        )
+        ds = stglib.rsk.rsk2cdf.rsk_to_xr(dict(metadata))
+        self.assertEqual(ds["P_1"].shape, (2, 8))
+        np.testing.assert_array_equal(ds["P_1"] - ds["T_28"], 1000)
+
+    def test_clip_bounds(self):
+        metadata = dict(
+            self.metadata,
+            basefile="full",
+            Deployment_date="2016-10-20 15:30",
+            # the whole hour is included, as in utils.clip_ds
+            Recovery_date="2016-10-20 18",
+        )
+        ds = stglib.rsk.rsk2cdf.rsk_to_xr(dict(metadata))
+        np.testing.assert_array_equal(
+            ds["time"],
+            pd.to_datetime(self.t0 + 3600000 * np.arange(1, 4), unit="ms"),
+        )
+        self.assertIn("not read from .rsk file", ds.attrs["history"])
+
+        del metadata["Deployment_date"], metadata["Recovery_date"]
+        full = stglib.rsk.rsk2cdf.rsk_to_xr(dict(metadata))
+        full.attrs.update(ds.attrs)
+        full = stglib.utils.clip_ds(full)
+        np.testing.assert_array_equal(ds["P_1"], full["P_1"])
+        # bursts keep their numbers in the full record
+        np.testing.assert_array_equal(ds["burst"], [1, 2, 3])
+        np.testing.assert_array_equal(ds["burst"], full["burst"])
+
+    def test_update_waves(self):
+        # partial download ending part way through the fourth burst
+        shutil.copy("full.rsk", "test.rsk")
+        conn = sqlite3.connect("test.rsk")
+        conn.execute(
+            "DELETE FROM burstData WHERE tstamp >= ?", (self.t0 + 3 * 3600000 + 100,)
+        )
+        conn.commit()
+        conn.close()
+
+        stglib.rsk.incremental.update_waves(self.metadata)
+        shutil.copy("full.rsk", "test.rsk")
+        result = stglib.rsk.incremental.update_waves(self.metadata)
+        self.assertEqual(len(result["time"]), 3)
+        self.assertIsNone(stglib.rsk.incremental.update_waves(self.metadata))
+
+        metadata = dict(self.metadata, basefile="full", filename="full")
+        stglib.rsk.incremental.update_waves(metadata)
+
+        with xr.open_dataset("tests-a.nc", decode_times=False) as inc, xr.open_dataset(
+            "fulls-a.nc", decode_times=False
+        ) as full:
+            self.assertEqual(len(full["time"]), 5)
+            for k in full.variables:
+                if "time" in full[k].dims:
+                    np.testing.assert_allclose(inc[k], full[k], rtol=1e-6)
+            for k in ["wh_4061", "wp_peak"]:
+                self.assertEqual(inc[k].attrs["minimum"], full[k].attrs["minimum"])
+                self.assertEqual(inc[k].attrs["maximum"], full[k].attrs["maximum"])
+
+    def test_pipeline(self):
+        metadata = dict(self.metadata, basefile="full", filename="full")
+        result = stglib.rsk.pipeline.rsk_to_waves(metadata)
+        self.assertFalse(os.path.exists("full-raw.cdf"))
+        self.assertFalse(os.path.exists("fullb-cal.nc"))
+
+        stglib.rsk.rsk2cdf.rsk_to_cdf(dict(metadata))
+        stglib.rsk.cdf2nc.cdf_to_nc("full-raw.cdf")
+        expected = stglib.rsk.nc2waves.nc_to_waves("fullb-cal.nc")
+
+        for k in ["wh_4061", "wp_peak", "wp_4060", "pspec"]:
+            np.testing.assert_array_equal(result[k], expected[k])
+            np.testing.assert_equal(result[k].attrs, expected[k].attrs)
+
+    def test_working_precision(self):
+        metadata = dict(self.metadata, basefile="full", filename="full")
+        raw = stglib.rsk.rsk2cdf.rsk_to_xr(dict(metadata))
+        met = xr.Dataset({"time": raw["time"]})
+        met["atmpres"] = xr.DataArray(
+            10.1 + 0.01 * np.arange(len(met["time"])), dims="time"
+        )
+        met["atmpres"].attrs["offset"] = -0.05
+        met.to_netcdf("atmpres.cdf")
+
+        expected = stglib.rsk.pipeline.rsk_to_waves(
+            metadata, atmpres="atmpres.cdf", intermediate=["nc"]
+        )
+        nc64 = xr.load_dataset("fullb-cal.nc", decode_times=False)
+
+        metadata["working_precision"] = "float32"
+        result = stglib.rsk.pipeline.rsk_to_waves(
+            metadata, atmpres="atmpres.cdf", intermediate=["nc"]
+        )
+        nc32 = xr.load_dataset("fullb-cal.nc", decode_times=False)
+
+        np.testing.assert_allclose(nc32["P_1ac"], nc64["P_1ac"], rtol=1e-6)
+        for k in ["wh_4061", "wp_peak", "wp_4060", "pspec"]:
+            np.testing.assert_allclose(result[k], expected[k], rtol=1e-4)
+
+        # rsk_to_xr reads pressure as float32, so check the cast from float64
+        raw["P_1"] = raw["P_1"].astype(np.float64)
+        p64 = stglib.rsk.cdf2nc.ds_to_nc(raw.copy(deep=True), atmpres="atmpres.cdf")
+        raw.attrs["working_precision"] = "float32"
+        p32 = stglib.rsk.cdf2nc.ds_to_nc(raw.copy(deep=True), atmpres="atmpres.cdf")
+        self.assertEqual(p64["P_1ac"].dtype, np.float64)
+        self.assertEqual(p32["P_1ac"].dtype, np.float32)
+        np.testing.assert_allclose(p32["P_1ac"], p64["P_1ac"], rtol=1e-6)
+
+        metadata["working_precision"] = "float16"
+        with self.assertRaises(ValueError):
+            stglib.rsk.pipeline.rsk_to_waves(metadata)
+
+    def test_pipeline_cache(self):
+        metadata = dict(self.metadata, basefile="full", filename="full")
+        stglib.rsk.pipeline.rsk_to_waves(metadata, use_cache=True)
+        raw = stglib.core.cache.file_state("full-raw.cdf")
+        nc = stglib.core.cache.file_state("fullb-cal.nc")
+
+        # only the waves step is rerun
+        metadata["wh_min"] = 0.33
+        result = stglib.rsk.pipeline.rsk_to_waves(metadata, use_cache=True)
+        self.assertEqual(stglib.core.cache.file_state("full-raw.cdf"), raw)
+        self.assertEqual(stglib.core.cache.file_state("fullb-cal.nc"), nc)
+        self.assertEqual(result.attrs["wh_min"], 0.33)
+
+        # the data read from the .rsk file are reused
+        metadata["NAVD88_ref"] = -2.0
+        result = stglib.rsk.pipeline.rsk_to_waves(metadata, use_cache=True)
+        self.assertEqual(stglib.core.cache.file_state("full-raw.cdf"), raw)
+        self.assertNotEqual(stglib.core.cache.file_state("fullb-cal.nc"), nc)
+        self.assertEqual(result.attrs["NAVD88_ref"], -2.0)
+
+        expected = stglib.rsk.pipeline.rsk_to_waves(metadata)
+        for k in ["wh_4061", "wp_peak", "pspec", "water_depth"]:
+            np.testing.assert_array_equal(result[k], expected[k])
+
+        # variables written from the metadata by rsk_to_xr are rebuilt
+        metadata["latitude"] = 45.0
+        result = stglib.rsk.pipeline.rsk_to_waves(metadata, use_cache=True)
+        self.assertNotEqual(stglib.core.cache.file_state("full-raw.cdf"), raw)
+        np.testing.assert_array_equal(result["lat"], [45.0])
+        with xr.open_dataset("full-raw.cdf") as cdf:
+            np.testing.assert_array_equal(cdf["lat"], [45.0])
+
+    @unittest.skipIf(zarr is None, "zarr is not installed")
+    def test_update_waves_zarr(self):
+        metadata = dict(self.metadata, store_format="zarr")
+        shutil.copy("full.rsk", "test.rsk")
+        conn = sqlite3.connect("test.rsk")
+        conn.execute(
+            "DELETE FROM burstData WHERE tstamp >= ?", (self.t0 + 3 * 3600000 + 100,)
+        )
+        conn.commit()
+        conn.close()
+
+        stglib.rsk.incremental.update_waves(metadata)
+        shutil.copy("full.rsk", "test.rsk")
+        stglib.rsk.incremental.update_waves(metadata)
+        self.assertFalse(os.path.exists("tests-a.nc"))
+
+        stglib.rsk.incremental.update_waves(
+            dict(self.metadata, basefile="full", filename="full")
+        )
+
+        with xr.open_zarr("tests-a.zarr", decode_times=False) as inc, xr.open_dataset(
+            "fulls-a.nc", decode_times=False
+        ) as full:
+            for k in full.variables:
+                if "time" in full[k].dims:
+                    np.testing.assert_allclose(inc[k], full[k], rtol=1e-6)
+            self.assertEqual(inc.attrs["stop_time"], full.attrs["stop_time"])
+            np.testing.assert_allclose(
+                inc["wh_4061"].attrs["maximum"], full["wh_4061"].attrs["maximum"]
+            )
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        os.mkdir("dwave")
+        make_rsk(os.path.join("dwave", "test.rsk"))
+        shutil.copy(
+            os.path.join(THIS_DIR, "../../examples/glob_att1076a.txt"), "gatts.txt"
+        )
+        with open("dw_config.yaml", "w") as f:
+            f.write(
+                "basefile: test\n"
+                "filename: test\n"
+                "initial_instrument_height: 0.15\n"
+                "Deployment_date: 2016-10-20 16:00\n"
+                "Recovery_date: 2016-10-21 00:00\n"
+            )
+        with open("manifest.yaml", "w") as f:
+            f.write(
+                "gatts: gatts.txt\n"
+                "jobs:\n"
+                "  - {instrument: rsk, config: dw_config.yaml, directory: dwave}\n"
+                "  - {instrument: exo, config: dw_config.yaml, name: missing}\n"
+            )
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_batch(self):
+        summary = stglib.batch.run_batch("manifest.yaml", max_workers=2)
+
+        self.assertEqual([r["name"] for r in summary], ["rsk-0", "missing"])
+        self.assertEqual([r["status"] for r in summary], ["ok", "failed"])
+        self.assertTrue(os.path.exists(os.path.join("dwave", "tests-a.nc")))
+        with open(os.path.join("logs", "missing.log")) as f:
+            self.assertIn("Traceback", f.read())
+        with open(os.path.join("logs", "rsk-0.log")) as f:
+            self.assertIn("Done writing netCDF file tests-a.nc", f.read())
+
+
 if __name__ == "__main__":
     unittest.main()
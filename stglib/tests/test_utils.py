@@ -1,3 +1,7 @@
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
 import numpy as np
@@ -76,3 +80,450 @@ class TestClip(unittest.TestCase):
         result = stglib.utils.clip_ds(self.ds)
 
         np.testing.assert_array_equal(expected["time"], result["time"])
+
+    def test_open_clipped_dataset(self):
+        self.ds["P_1"] = xr.DataArray(np.arange(len(self.ds["time"])), dims="time")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test-raw.cdf")
+            self.ds.to_netcdf(filename)
+            result = stglib.utils.open_clipped_dataset(filename)
+
+        expected = stglib.utils.clip_ds(self.ds)
+        np.testing.assert_array_equal(expected["time"], result["time"])
+        np.testing.assert_array_equal(expected["P_1"], result["P_1"])
+        self.assertEqual(expected.attrs["history"], result.attrs["history"])
+
+    def test_working_precision(self):
+        self.ds["P_1"] = xr.DataArray(
+            np.linspace(0, 1, len(self.ds["time"])), dims="time"
+        )
+        self.ds.attrs["working_precision"] = "float32"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test-raw.cdf")
+            self.ds.to_netcdf(filename)
+            result = stglib.utils.open_clipped_dataset(filename)
+
+        expected = stglib.utils.clip_ds(self.ds)
+        self.assertEqual(result["P_1"].dtype, np.float32)
+        np.testing.assert_allclose(result["P_1"], expected["P_1"], rtol=1e-7)
+        np.testing.assert_array_equal(result["time"], expected["time"])
+
+    def test_time_indexer(self):
+        time = self.ds["time"].values
+        # partial dates cover the whole period, like .sel()
+        result = stglib.utils.time_indexer(time, "2000-01-02", "2000-01-02")
+        np.testing.assert_array_equal(
+            time[result], self.ds["time"].sel(time="2000-01-02")
+        )
+        self.assertIsInstance(result, slice)
+
+        # unsorted times fall back to boolean indexing
+        result = stglib.utils.time_indexer(time[::-1], "2000-01-02", "2000-01-02")
+        self.assertEqual(len(result), 96)
+
+
+class TestAtmos(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.atmpres = os.path.join(self.tmpdir.name, "atmpres.cdf")
+        met = xr.Dataset()
+        met["time"] = xr.DataArray(
+            pd.date_range("2000-01-01", "2000-01-02", freq="1h"), dims="time"
+        )
+        met["atmpres"] = xr.DataArray(
+            10 + np.random.rand(len(met["time"])), dims="time"
+        )
+        met["atmpres"].attrs["offset"] = -0.5
+        met.to_netcdf(self.atmpres)
+        self.met = met
+
+        self.time = pd.date_range("1999-12-31 23:00", "2000-01-02 01:00", freq="7min")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_nearest(self):
+        record = stglib.core.atmos.load_atmpres(self.atmpres)
+        self.assertIs(record, stglib.core.atmos.load_atmpres(self.atmpres))
+
+        for tolerance in [None, "10min", 0]:
+            result = stglib.core.atmos.interp_atmpres(
+                record, self.time, tolerance=tolerance
+            )
+            expected = self.met["atmpres"].reindex(
+                time=self.time, method="nearest", tolerance=tolerance
+            )
+            np.testing.assert_array_equal(result, expected)
+
+    def test_linear(self):
+        record = stglib.core.atmos.load_atmpres(self.atmpres)
+        result = stglib.core.atmos.interp_atmpres(record, self.time, method="linear")
+        expected = self.met["atmpres"].interp(time=self.time)
+        np.testing.assert_allclose(result, expected)
+
+    def test_atmos_correct(self):
+        ds = xr.Dataset()
+        ds["time"] = self.met["time"]
+        ds["P_1"] = xr.DataArray(
+            np.random.rand(len(ds["time"]), 4) + 12, dims=("time", "sample")
+        )
+        result = stglib.core.atmos.atmos_correct(ds["P_1"], self.atmpres, ds.attrs)
+        expected = ds["P_1"] - self.met["atmpres"] - self.met["atmpres"].offset
+        xr.testing.assert_allclose(result, expected)
+
+
+class TestImports(unittest.TestCase):
+    def test_lazy_imports(self):
+        code = (
+            "import sys, stglib; stglib.hobo; stglib.rsk.rsk2cdf; "
+            "print(' '.join(sorted(sys.modules)))"
+        )
+        modules = subprocess.check_output([sys.executable, "-c", code], text=True)
+        modules = modules.split()
+        self.assertIn("stglib.hobo", modules)
+        self.assertNotIn("stglib.aqd", modules)
+        self.assertNotIn("matplotlib", modules)
+        self.assertNotIn("scipy.signal", modules)
+
+        self.assertIs(stglib.qaqc, stglib.aqd.qaqc)
+        self.assertEqual(len(dir(stglib)), len(set(dir(stglib))))
+        with self.assertRaises(AttributeError):
+            stglib.notamodule
+
+
+class TestMonitor(unittest.TestCase):
+    def setUp(self):
+        self.ds = xr.Dataset()
+        self.ds["time"] = xr.DataArray(
+            pd.date_range("2000-01-01", "2000-01-02", freq="15min"), dims="time"
+        )
+        self.ds.attrs["good_ens"] = [1, 3]
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "perf.csv")
+            with stglib.monitor.report(filename, trace_memory=True) as records:
+                with stglib.monitor.step("clip"):
+                    stglib.utils.clip_ds(self.ds)
+            written = pd.read_csv(filename)
+
+        self.assertEqual(
+            [(r["name"], r["depth"]) for r in records],
+            [("clip", 0), ("core.utils.clip_ds", 1)],
+        )
+        for r in records:
+            self.assertGreaterEqual(r["wall_time"], 0)
+            self.assertGreaterEqual(r["traced_memory_peak"], 0)
+        self.assertEqual(list(written.columns), stglib.monitor.FIELDS)
+        self.assertEqual(list(written["name"]), [r["name"] for r in records])
+
+        # nothing is recorded outside a report
+        stglib.utils.clip_ds(self.ds)
+        self.assertEqual(len(records), 2)
+
+    def test_progress(self):
+        calls = []
+        stglib.monitor.set_progress(lambda name, f: calls.append((name, f)))
+        try:
+            for i in range(400):
+                stglib.monitor.progress("loop", i, 400)
+        finally:
+            stglib.monitor.set_progress()
+        self.assertEqual(calls, [("loop", 0), ("loop", 0.5)])
+
+
+class TestSingletonDims(unittest.TestCase):
+    def test_add_singleton_dims(self):
+        ds = xr.Dataset()
+        ds["time"] = xr.DataArray(np.arange(5), dims="time")
+        ds["P_1"] = xr.DataArray(
+            np.random.rand(5, 3), dims=("time", "sample"), attrs={"units": "dbar"}
+        )
+        ds["P_1"].encoding["dtype"] = "float32"
+        ds.attrs.update(latitude=30.1, longitude=-88.2)
+        ds = stglib.utils.ds_add_lat_lon(ds)
+        ds["depth"] = xr.DataArray([2.0], dims="depth")
+        data = ds["P_1"].values
+
+        expected = xr.concat([ds["P_1"]], dim=ds["lon"])
+        expected = xr.concat([expected], dim=ds["lat"])
+        expected = xr.concat([expected], dim=ds["depth"])
+        expected = expected.transpose("time", "sample", "lat", "lon", "depth")
+
+        result = stglib.utils.add_singleton_dims(ds, ["P_1"], ["lat", "lon", "depth"])
+        xr.testing.assert_identical(result["P_1"], expected)
+        self.assertEqual(result["P_1"].encoding, {"dtype": "float32"})
+        self.assertTrue(np.shares_memory(result["P_1"].values, data))
+
+
+class TestRollingMedian(unittest.TestCase):
+    def test_rolling_median(self):
+        import scipy.signal
+
+        x = np.random.default_rng(0).random((2, 500)).astype(np.float32)
+        for k in [5, 31, 101]:
+            result = stglib.utils.rolling_median(x, kernel_size=k)
+            expected = scipy.signal.medfilt(x, kernel_size=[1, k])
+            h = k // 2
+            np.testing.assert_array_equal(result[:, h:-h], expected[:, h:-h])
+            self.assertEqual(result.dtype, np.float32)
+
+        np.testing.assert_array_equal(
+            stglib.utils.rolling_median(x[0], kernel_size=5),
+            stglib.utils.rolling_median(x, kernel_size=5)[0],
+        )
+        with self.assertRaises(ValueError):
+            stglib.utils.rolling_median(x, kernel_size=4)
+
+    def test_nan_policy(self):
+        x = np.array([1.0, 2, np.nan, 4, 5, 6, 7])
+        np.testing.assert_array_equal(
+            stglib.utils.rolling_median(x, 3), [1.5, 1.5, 3, 4.5, 5, 6, 6.5]
+        )
+        np.testing.assert_array_equal(
+            stglib.utils.rolling_median(x, 3, nan_policy="propagate"),
+            [1.5, np.nan, np.nan, np.nan, 5, 6, 6.5],
+        )
+
+
+class TestBurstStats(unittest.TestCase):
+    def test_burst_stats(self):
+        # the last burst is partial and padded with NaN
+        x = stglib.utils.burst_matrix(np.random.rand(125), 60)
+        self.assertEqual(x.shape, (3, 60))
+        self.assertEqual(np.isnan(x).sum(), 55)
+
+        da = xr.DataArray(x, dims=["time", "sample"])
+        coeffs = [2.0, 1.0]
+        cal = 2 * da + 1
+        expected = {
+            "mean": cal.mean("sample"),
+            "std": cal.std("sample"),
+            "median": cal.median("sample"),
+            "min": cal.min("sample"),
+            "max": cal.max("sample"),
+            "count": cal.count("sample"),
+            "p90": cal.quantile(0.9, "sample").drop_vars("quantile"),
+        }
+        result = stglib.utils.burst_stats(da, list(expected), calibration=coeffs)
+        for k in expected:
+            xr.testing.assert_allclose(result[k], expected[k].astype(float))
+
+
+class TestReadCsv(unittest.TestCase):
+    def test_read_csv_skipfooter(self):
+        body = ["h1", "h2", "", "01/02/20\t13:45:00\t1", "01/02/20\t13:45:01\t2"]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filnam = os.path.join(tmpdir, "eco.raw")
+            for end in ["\n", "\r\n", "\r"]:
+                for footer in [["etx"], ["etx", "", ""], ["", "etx"]]:
+                    with open(filnam, "w", newline="") as f:
+                        f.write(end.join(body + footer))
+                    for skipfooter in range(len(footer) + 1):
+                        kwargs = dict(sep="\t", names=["d", "t", "n"], skiprows=3)
+                        expected = pd.read_csv(
+                            filnam, skipfooter=skipfooter, engine="python", **kwargs
+                        )
+                        result = stglib.utils.read_csv_skipfooter(
+                            filnam, skipfooter=skipfooter, **kwargs
+                        )
+                        pd.testing.assert_frame_equal(result, expected)
+
+            result = stglib.utils.combine_date_time(result["d"], result["t"])
+            np.testing.assert_array_equal(
+                result,
+                pd.to_datetime(["2020-01-02 13:45:00", "2020-01-02 13:45:01"]),
+            )
+
+
+class TestEpicTimes(unittest.TestCase):
+    def setUp(self):
+        self.ds = xr.Dataset()
+        self.ds["time"] = xr.DataArray(
+            pd.date_range("1968-05-22 23:00", periods=100, freq="1234567ms"),
+            dims="time",
+        )
+        self.ds.attrs["sample_interval"] = 0.125
+        self.ds.attrs["samples_per_burst"] = 16
+
+    def test_create_epic_times(self):
+        jd = stglib.utils.make_jd(pd.DatetimeIndex(self.ds["time"]))
+        result = stglib.utils.create_epic_times(self.ds)
+
+        np.testing.assert_array_equal(
+            result["epic_time"], stglib.utils.make_epic_time(jd)
+        )
+        np.testing.assert_array_equal(
+            result["epic_time2"], stglib.utils.make_epic_time2(jd)
+        )
+        self.assertEqual(result["epic_time"][0], 2439999)
+        self.assertEqual(result["epic_time"][-1], 2440001)
+
+    def test_create_2d_time(self):
+        result = stglib.utils.create_2d_time(self.ds)
+
+        self.assertEqual(result["epic_time_2d"].dims, ("time", "sample"))
+        time_2d = pd.DatetimeIndex(
+            np.ravel(
+                self.ds["time"].values[:, None]
+                + np.arange(16) * np.timedelta64(125, "ms")
+            )
+        )
+        jd = stglib.utils.make_jd(time_2d)
+        np.testing.assert_array_equal(
+            np.ravel(result["epic_time_2d"]), stglib.utils.make_epic_time(jd)
+        )
+        np.testing.assert_array_equal(
+            np.ravel(result["epic_time2_2d"]), stglib.utils.make_epic_time2(jd)
+        )
+
+    def test_datetime_to_epic(self):
+        # works elementwise on DataArrays as well as numpy arrays
+        epic_time, epic_time2 = stglib.utils.datetime_to_epic(self.ds["time"])
+        self.assertIsInstance(epic_time, xr.DataArray)
+        np.testing.assert_array_equal(
+            stglib.utils.epic_to_datetime(epic_time.values, epic_time2.values),
+            self.ds["time"],
+        )
+
+    def test_ds_rename_time_2d(self):
+        ds = stglib.utils.create_2d_time(stglib.utils.create_epic_times(self.ds))
+        result = stglib.utils.ds_rename_time_2d(ds)
+
+        self.assertEqual(result["time"].dims, ("time", "sample"))
+        self.assertEqual(result["time2"].dims, ("time", "sample"))
+        self.assertEqual(result["time_cf"].dims, ("time",))
+        np.testing.assert_array_equal(result["time"], ds["epic_time_2d"])
+        np.testing.assert_array_equal(result["time_cf"], ds["time"])
+        self.assertNotIn("time", result.coords)
+
+    def test_rename_time_2d(self):
+        ds = stglib.utils.create_2d_time(stglib.utils.create_epic_times(self.ds))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.nc")
+            ds.to_netcdf(filename, format="NETCDF3_64BIT")
+            with self.assertWarns(DeprecationWarning):
+                stglib.utils.rename_time_2d(filename, ds)
+            with xr.open_dataset(filename, decode_times=False) as result:
+                self.assertEqual(result["time"].dims, ("time", "sample"))
+                np.testing.assert_array_equal(result["time"], ds["epic_time_2d"])
+                self.assertIn("time_cf", result)
+
+
+class TestMinMax(unittest.TestCase):
+    def test_add_min_max(self):
+        rng = np.random.default_rng(0)
+        ds = xr.Dataset()
+        ds["P_1"] = xr.DataArray(
+            rng.standard_normal((100, 64)), dims=("time", "sample")
+        )
+        ds["P_1"][3, :] = np.nan
+        ds["vel"] = xr.DataArray(
+            rng.standard_normal((100, 5, 3)), dims=("time", "depth", "beam")
+        )
+        ds["n"] = xr.DataArray(np.arange(64, dtype="i4"), dims="sample")
+
+        result = stglib.utils.add_min_max(ds.copy(deep=True))
+
+        for k, dims in [("P_1", ("time", "sample")), ("vel", ("time", "depth"))]:
+            np.testing.assert_array_equal(
+                result[k].attrs["minimum"], ds[k].min(dim=dims).values
+            )
+            np.testing.assert_array_equal(
+                result[k].attrs["maximum"], ds[k].max(dim=dims).values
+            )
+        self.assertEqual(result["vel"].attrs["minimum"].shape, (3,))
+        self.assertEqual(result["n"].attrs["minimum"], 0)
+        self.assertEqual(result["n"].attrs["maximum"], 63)
+
+    def test_nanminmax(self):
+        a = np.random.default_rng(1).standard_normal((1000, 3))
+        a[10] = np.nan
+        mn, mx = stglib.utils.nanminmax(a, axis=0, blocksize=100)
+        np.testing.assert_array_equal(mn, np.nanmin(a, axis=0))
+        np.testing.assert_array_equal(mx, np.nanmax(a, axis=0))
+
+
+class TestOutputProfile(unittest.TestCase):
+    def setUp(self):
+        self.ds = xr.Dataset()
+        self.ds["time"] = xr.DataArray(
+            pd.date_range("2000-01-01", periods=100, freq="h"), dims="time"
+        )
+        self.ds["u_1205"] = xr.DataArray(
+            np.linspace(-150, 150, 100 * 8).reshape((100, 8)),
+            dims=("time", "depth"),
+            attrs={"units": "cm/s"},
+        )
+        self.ds["u_1205"][0, 0] = np.nan
+        self.ds["P_1"] = xr.DataArray(
+            np.ones((100, 64)), dims=("time", "sample"), attrs={"units": "dbar"}
+        )
+        self.ds["P_1"].encoding["dtype"] = "float32"
+
+    def test_no_profile(self):
+        self.assertIsNone(stglib.utils.output_profile(self.ds))
+        self.assertIsNone(
+            stglib.utils.output_profile(self.ds, profile={"nc_profile": None})
+        )
+
+    def test_nc_encoding(self):
+        self.ds.attrs["nc_profile"] = "burst"
+        settings = stglib.utils.output_profile(
+            self.ds, profile={"nc_complevel": 6, "nc_pack_velocity": "int16"}
+        )
+        enc = stglib.utils.nc_encoding(self.ds, settings)
+
+        self.assertNotIn("zlib", enc["time"])
+        self.assertEqual(enc["P_1"]["chunksizes"], (1, 64))
+        self.assertEqual(enc["P_1"]["dtype"], "float32")
+        self.assertEqual(enc["P_1"]["complevel"], 6)
+        self.assertEqual(enc["u_1205"]["chunksizes"], (100, 8))
+        self.assertEqual(enc["u_1205"]["dtype"], "int16")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test-a.nc")
+            stglib.utils.write_nc(
+                self.ds,
+                filename,
+                profile={"nc_pack_velocity": "int16"},
+                unlimited_dims=["time"],
+            )
+            with xr.open_dataset(filename) as result:
+                self.assertEqual(result["u_1205"].encoding["dtype"], np.int16)
+                self.assertTrue(result["u_1205"].encoding["zlib"])
+                np.testing.assert_allclose(
+                    result["u_1205"], self.ds["u_1205"], atol=0.005
+                )
+                self.assertTrue(np.isnan(result["u_1205"][0, 0]))
+
+    def test_store_format(self):
+        filename = "test-a.nc"
+        self.assertEqual(stglib.utils.store_path(filename, self.ds.attrs), filename)
+        self.assertEqual(
+            stglib.utils.store_path(filename, {"store_format": "zarr"}), "test-a.zarr"
+        )
+        self.assertEqual(
+            stglib.utils.store_path(
+                filename, {"store_format": "zarr"}, {"store_format": "netcdf"}
+            ),
+            filename,
+        )
+        with self.assertRaises(ValueError):
+            stglib.utils.get_store_format({"store_format": "hdf5"})
+
+    def test_write_zarr(self):
+        try:
+            import zarr  # noqa: F401
+        except ImportError:
+            self.skipTest("zarr is not installed")
+
+        self.ds.attrs["store_format"] = "zarr"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test-a.nc")
+            stglib.utils.write_nc(self.ds, filename, unlimited_dims=["time"])
+            self.assertFalse(os.path.exists(filename))
+            with xr.open_zarr(os.path.join(tmpdir, "test-a.zarr")) as result:
+                xr.testing.assert_identical(result, self.ds)
+                self.assertEqual(result["P_1"].encoding["dtype"], np.float32)
+                self.assertEqual(result["P_1"].encoding["chunks"], (2**13, 64))